@@ -0,0 +1,202 @@
+from functools import lru_cache
+import sys
+import time
+
+import numpy as np
+from scipy.special import ndtr
+
+from charging import CcCvProfile
+
+# Gauss-Legendre nodes on every smooth piece of the SoC distribution
+NODES = 32
+SOC_I_MIN = 0.05
+# the initial SoC is at most soc_r minus this
+SOC_I_GAP = 0.1
+
+# the M/G/s/(s+r) approximation of the models: up to s busy chargers the probabilities
+# are those of the Erlang loss system, which do not depend on the charging time
+# distribution, and over the r waiting spaces they fall geometrically with the ratio
+# zeta of the two moment approximation, which is ro for exponential charging times;
+# works on numbers as well as on numpy arrays of ro and c_s
+def get_zeta(s, ro, c_s):
+    theta = (s-1.0)/(s+1.0)
+    f = (np.sqrt((9.0+theta)/(1.0-theta))-2)*theta/(8.0+8.0*theta)
+    g = (1.0-ro)/ro
+    # for a single charger the correction takes its limit r_d = 1/2
+    with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+        r_d = np.where(f*g > 0.0, (1.0+f*g*(1-np.exp(-theta/(f*g))))/2.0, 0.5)
+    r_g = ((1.0+c_s**2.0)*r_d)/((2.0*r_d-1.0)*c_s**2.0+1.0)
+    # the corrected ratio goes to 1 as ro does, above that the queue is full most of the
+    # time and the ratio of the M/M/s/(s+r) queue, ro, is used
+    return np.where(ro < 1.0, ro*r_g/(1.0-ro+ro*r_g), ro)
+
+# the sum of (s*ro)**j/j! below s, and the term of s busy chargers
+def get_erlang_terms(s, ro):
+    term = 1.0
+    temp = 0.0
+    for j in range(s):
+        temp = temp+term
+        term = term*s*ro/(j+1)
+    return temp, term
+
+# the sums of zeta**k and k*zeta**k over k waiting PEVs
+def get_queue_terms(r, zeta):
+    term = 1.0
+    temp = 0.0
+    waiting = 0.0
+    for k in range(r+1):
+        temp = temp+term
+        waiting = waiting+k*term
+        term = term*zeta
+    return temp, waiting
+
+def get_state_terms(s, r, ro, c_s):
+    zeta = get_zeta(s, ro, c_s)
+    below, busy = get_erlang_terms(s, ro)
+    queue, waiting = get_queue_terms(r, zeta)
+    p_0 = 1.0/(below+busy*queue)
+    return zeta, busy*p_0, waiting
+
+def get_blocking_probability(s, r, ro, c_s):
+    zeta, p_s, _ = get_state_terms(s, r, ro, c_s)
+    return p_s*zeta**r
+
+# of the admitted PEVs in minutes by Little's law, lam is per hour
+def get_mean_waiting_time(lam, s, r, ro, c_s):
+    zeta, p_s, waiting = get_state_terms(s, r, ro, c_s)
+    return 60.0*p_s*waiting/(lam*(1.0-p_s*zeta**r))
+
+@lru_cache(maxsize=None)
+def get_legendre(nodes):
+    return np.polynomial.legendre.leggauss(nodes)
+
+# nodes and weights of the initial SoC, a Gaussian clipped to [SOC_I_MIN, soc_r-SOC_I_GAP],
+# one row for every soc_r: the clipped tails are two atoms at the bounds, and the rest is
+# split at the SoC where the charging curve has its kink, so every piece is smooth for
+# the quadrature; a piece that is empty gets zero weights
+def get_soc_i_distribution(soc_rs, mu, sigma, kink=None, nodes=NODES):
+    t, w = get_legendre(nodes)
+    lower = np.full(len(soc_rs), SOC_I_MIN)
+    upper = np.maximum(lower, np.asarray(soc_rs, dtype=float)-SOC_I_GAP)
+    middle = upper if kink is None else np.clip(kink, lower, upper)
+    soc = [lower[:, None], upper[:, None]]
+    # when soc_r-SOC_I_GAP is below SOC_I_MIN every PEV starts at SOC_I_MIN
+    weights = [np.where(upper > lower, ndtr((lower-mu)/sigma), 1.0)[:, None], np.where(upper > lower, 1.0-ndtr((upper-mu)/sigma), 0.0)[:, None]]
+    for a, b in ((lower, middle), (middle, upper)):
+        half = ((b-a)/2.0)[:, None]
+        x = ((a+b)/2.0)[:, None]+half*t
+        soc.append(x)
+        weights.append(half*w*np.exp(-0.5*((x-mu)/sigma)**2)/(sigma*np.sqrt(2.0*np.pi)))
+    return np.hstack(soc), np.hstack(weights)
+
+# mean and coefficient of variation of the charging time in minutes, mean initial SoC,
+# mean power and mean battery cost of the charges for every soc_r, without simulating them
+def get_charge_moments(profile, soc_rs, e_max, soc_i_mu, soc_i_sigma, batt_deg, t_ch_coefficient, nodes=NODES):
+    kink = profile.e_c/e_max if isinstance(profile, CcCvProfile) else None
+    soc_i, w = get_soc_i_distribution(soc_rs, soc_i_mu, soc_i_sigma, kink, nodes)
+    t_ch, p_ow = profile.get_charges(soc_i*e_max, np.asarray(soc_rs, dtype=float)[:, None]*e_max)
+    t_ch = t_ch*60.0*t_ch_coefficient
+    mean_t_ch = np.sum(w*t_ch, axis=1)
+    c_batt = batt_deg["a"]*p_ow**2+batt_deg["b"]*p_ow+batt_deg["c"]
+    return {
+        "mean_charging_time": mean_t_ch,
+        "cv_charging_time": np.sqrt(np.maximum(np.sum(w*t_ch**2, axis=1)-mean_t_ch**2, 0.0))/mean_t_ch,
+        "mean_soc_i": np.sum(w*soc_i, axis=1),
+        "mean_charging_power": np.sum(w*p_ow, axis=1),
+        "mean_c_batt": np.sum(w*c_batt, axis=1)
+    }
+
+# moments of a mix of classes, every class with its share of the arrivals; the charging
+# time of the mix has the shares of the second moments of the classes
+def get_mixed_moments(moments, shares):
+    mean_t_ch = sum(share*temp1["mean_charging_time"] for temp1, share in zip(moments, shares))
+    second = sum(share*temp1["mean_charging_time"]**2*(1.0+temp1["cv_charging_time"]**2) for temp1, share in zip(moments, shares))
+    res = {name: sum(share*temp1[name] for temp1, share in zip(moments, shares)) for name in moments[0]}
+    res["cv_charging_time"] = np.sqrt(np.maximum(second-mean_t_ch**2, 0.0))/mean_t_ch
+    return res
+
+# the single class model without simpy: the charging time moments come from quadrature
+# over the initial SoC and the queue from the M/G/s/(s+r) approximation, so a whole
+# sweep over soc_r takes well under a millisecond; the getters return {soc_r: value}
+# like those of single_class.Simulation
+class Analytic:
+    def __init__(self,lam,s,r,soc_rs,soc_i_p,p_max,e_max,e_c,batt_deg,reward,c_w,t_ch_coefficient,charging_profile=None,nodes=NODES):
+        self.lam = lam
+        self.s = s
+        self.r = r
+        self.soc_rs = soc_rs
+        self.soc_i_mu = soc_i_p["mu"]
+        self.soc_i_sigma = soc_i_p["sigma"]
+        self.p_max = p_max
+        self.e_max = e_max
+        self.e_c = e_c
+        self.batt_deg = batt_deg
+        self.reward = reward
+        self.c_w = c_w
+        self.t_ch_coefficient = t_ch_coefficient
+        self.charging_profile = charging_profile or CcCvProfile(p_max, e_max, e_c)
+        # the whole sweep over soc_r is evaluated at once
+        self.moments = get_charge_moments(self.charging_profile, soc_rs, e_max, self.soc_i_mu, self.soc_i_sigma, batt_deg, t_ch_coefficient, nodes)
+        self.ro = self.moments["mean_charging_time"]*lam/(60*s)
+        self.p_k, self.mean_t_w = self.get_queue()
+
+    # blocking probability and mean waiting time for every soc_r
+    def get_queue(self):
+        c_s = self.moments["cv_charging_time"]
+        return get_blocking_probability(self.s, self.r, self.ro, c_s), get_mean_waiting_time(self.lam, self.s, self.r, self.ro, c_s)
+
+    def get_sweep(self, values):
+        temp1 = dict()
+        for k, soc_r in enumerate(self.soc_rs):
+            temp1[soc_r] = float(values[k])
+        return temp1
+
+    def get_mean_charging_time(self):
+        return self.get_sweep(self.moments["mean_charging_time"])
+
+    def get_mean_charging_power(self):
+        return self.get_sweep(self.moments["mean_charging_power"])
+
+    def get_traffic_intensity(self):
+        return self.get_sweep(self.ro)
+
+    def get_blocking_probability(self):
+        return self.get_sweep(self.p_k)
+
+    def get_mean_waiting_time(self):
+        return self.get_sweep(self.mean_t_w)
+
+    def get_system_revenue(self):
+        reward = self.reward["m"]*np.asarray(self.soc_rs, dtype=float)+self.reward["n"]
+        moments = self.moments
+        return self.get_sweep(self.lam*(1-self.p_k)*(reward-self.c_w*self.mean_t_w/60.0-moments["mean_c_batt"]*moments["mean_charging_time"]/60.0))
+
+if __name__ == "__main__":
+    import single_class
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    # the charging curve is tabulated once, a sweep only evaluates it
+    profile = CcCvProfile(single_class.P_MAX, single_class.E_MAX, single_class.E_C)
+    t = time.perf_counter()
+    for _ in range(runs):
+        model = Analytic(
+            lam=single_class.LAM,
+            s=single_class.S,
+            r=single_class.R,
+            soc_rs=single_class.SOC_RS,
+            soc_i_p=single_class.SOC_I_P,
+            p_max=single_class.P_MAX,
+            e_max=single_class.E_MAX,
+            e_c=single_class.E_C,
+            batt_deg=single_class.BATT_DEG,
+            reward=single_class.REWARD,
+            c_w=single_class.C_W,
+            t_ch_coefficient=single_class.T_CH_COEFFICIENT,
+            charging_profile=profile
+        )
+        revenue = model.get_system_revenue()
+    print("{:.1f} us per sweep over soc_r".format((time.perf_counter()-t)/runs*1e6))
+    print(model.get_mean_charging_time())
+    print(model.get_blocking_probability())
+    print(model.get_mean_waiting_time())
+    print(revenue)
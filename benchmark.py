@@ -0,0 +1,207 @@
+from time import perf_counter
+import argparse
+import json
+import os
+import sys
+
+from profiling import Profiler
+import single_class
+import multiclass_dedicated
+import multiclass_shared
+
+PEV_NUMS = [10**3, 10**4, 10**5, 10**6]
+QUICK_PEV_NUMS = [10**3, 10**4]
+SS = [7, 100, 1000]
+QUICK_SS = [7, 100]
+# arrivals per hour for every charger, keeps the traffic intensity near 0.7 at any size
+LAM_PER_CHARGER = 1.4
+BASELINE_PATH = "benchmark_baseline.json"
+THRESHOLD = 0.2
+# getters are cheap, so they are repeated until this many seconds have passed
+MIN_TIME = 0.2
+
+def make_single_class(pev_num, s, **kwargs):
+    params = dict(
+        pev_num=pev_num,
+        lam=LAM_PER_CHARGER*s,
+        s=s,
+        r=single_class.R,
+        soc_rs=[0.9],
+        soc_i_p=single_class.SOC_I_P,
+        p_max=single_class.P_MAX,
+        e_max=single_class.E_MAX,
+        e_c=single_class.E_C,
+        batt_deg=single_class.BATT_DEG,
+        reward=single_class.REWARD,
+        c_w=single_class.C_W,
+        t_ch_coefficient=single_class.T_CH_COEFFICIENT
+    )
+    params.update(kwargs)
+    return single_class.Simulation(**params)
+
+def make_multiclass(module):
+    def make(pev_num, s, **kwargs):
+        params = dict(
+            theta=module.THETA,
+            pev_num=pev_num,
+            lam=[LAM_PER_CHARGER*s/2.0],
+            s=s,
+            r=module.R,
+            soc_r=module.SOC_R,
+            batt_deg=module.BATT_DEG,
+            reward=module.REWARD,
+            c_w=module.C_W,
+            t_ch_coefficient=module.T_CH_COEFFICIENT,
+            soc_i_mu=module.SOC_I_MU,
+            soc_i_sigma=module.SOC_I_SIGMA,
+            p_max=module.P_MAX,
+            e_max=module.E_MAX,
+            e_c=module.E_C
+        )
+        params.update(kwargs)
+        return module.Simulation(**params)
+    return make
+
+MODELS = {
+    "single_class": make_single_class,
+    "multiclass_dedicated": make_multiclass(multiclass_dedicated),
+    "multiclass_shared": make_multiclass(multiclass_shared)
+}
+
+GETTERS = {
+    "single_class": [
+        ("get_mean_charging_time", {}),
+        ("get_mean_charging_power", {}),
+        ("get_mean_charging_power", {"numerical": True}),
+        ("get_traffic_intensity", {}),
+        ("get_blocking_probability", {}),
+        ("get_blocking_probability", {"numerical": True}),
+        ("get_mean_waiting_time", {}),
+        ("get_mean_waiting_time", {"numerical": True}),
+        ("get_system_revenue", {})
+    ],
+    "multiclass_dedicated": [
+        ("get_mean_charging_time", {}),
+        ("get_traffic_intensity", {}),
+        ("get_blocking_probability", {}),
+        ("get_mean_waiting_time", {}),
+        ("get_system_revenue", {})
+    ],
+    "multiclass_shared": [
+        ("get_mean_charging_time", {}),
+        ("get_traffic_intensity", {}),
+        ("get_blocking_probability", {}),
+        ("get_mean_waiting_time", {}),
+        ("get_system_revenue", {})
+    ]
+}
+
+def get_getter_name(name, kwargs):
+    return name+"".join("["+key+"]" for key in sorted(kwargs))
+
+# best of a few runs, larger constructions are only run once
+def bench_construction(model, pev_num, s):
+    repeats = max(1, min(3, 10**4//pev_num))
+    best = None
+    sim = None
+    for _ in range(repeats):
+        start = perf_counter()
+        sim = MODELS[model](pev_num, s)
+        elapsed = perf_counter()-start
+        best = elapsed if best is None else min(best, elapsed)
+    return sim, {"wall_time": best, "throughput": pev_num/best, "unit": "PEVs/s"}
+
+def bench_getter(sim, name, kwargs):
+    getter = getattr(sim, name)
+    calls = 0
+    start = perf_counter()
+    while True:
+        getter(**kwargs)
+        calls += 1
+        elapsed = perf_counter()-start
+        if elapsed >= MIN_TIME:
+            break
+    return {"wall_time": elapsed/calls, "throughput": calls/elapsed, "unit": "calls/s"}
+
+# simpy events per PEV, and the memory a PEV holds while it is at the station; with one
+# charger, unlimited waiting spaces and fast arrivals almost every PEV waits at once, with
+# a charger for every PEV and all of them arriving within a minute almost every PEV charges
+# at once, so the peak minus what is left after the run (the result records) is what they hold
+def bench_pev_footprint(model, pev_num=10**4, charging=False):
+    profiler = Profiler()
+    s = pev_num if charging else 1
+    lam = 60.0*pev_num if charging else 600.0
+    r = pev_num if model == "single_class" else [pev_num, pev_num]
+    lam = lam if model == "single_class" else [lam]
+    MODELS[model](pev_num, s, r=r, lam=lam, profiler=profiler)
+    points = profiler.sweep_points
+    pevs = sum(point["pevs"] for point in points)
+    return {
+        "events_per_pev": sum(point["events"] for point in points)/pevs,
+        "memory_per_pev": sum(point["peak_memory"]-point["retained_memory"] for point in points)/pevs,
+        "record_memory_per_pev": sum(point["retained_memory"] for point in points)/pevs
+    }
+
+def run_suite(models, pev_nums, ss, getter_pev_num=10**4, getter_s=7, log=print):
+    results = dict()
+    for model in models:
+        for pev_num in pev_nums:
+            for s in ss:
+                name = "{}/construct/pev_num={}/s={}".format(model, pev_num, s)
+                _, results[name] = bench_construction(model, pev_num, s)
+                log("{:<60}{:>14.0f} {}".format(name, results[name]["throughput"], results[name]["unit"]))
+        for state, charging in (("waiting", False), ("charging", True)):
+            footprint = bench_pev_footprint(model, charging=charging)
+            log("{:<60}{:>14.2f} events, {:.0f} bytes per PEV".format(model+"/footprint/"+state, footprint["events_per_pev"], footprint["memory_per_pev"]))
+        sim = MODELS[model](getter_pev_num, getter_s)
+        for getter, kwargs in GETTERS[model]:
+            name = "{}/{}/pev_num={}".format(model, get_getter_name(getter, kwargs), getter_pev_num)
+            results[name] = bench_getter(sim, getter, kwargs)
+            log("{:<60}{:>14.0f} {}".format(name, results[name]["throughput"], results[name]["unit"]))
+    return results
+
+# cases whose throughput fell more than the threshold below the baseline
+def compare(results, baseline, threshold=THRESHOLD):
+    regressions = list()
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["throughput"]/baseline[name]["throughput"]
+        if ratio < 1.0-threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the charging station models")
+    parser.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--quick", action="store_true", help="only run the smaller sizes")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed relative throughput loss")
+    args = parser.parse_args(argv)
+    results = run_suite(
+        args.models,
+        QUICK_PEV_NUMS if args.quick else PEV_NUMS,
+        QUICK_SS if args.quick else SS
+    )
+    if args.save:
+        baseline = dict()
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        return 0
+    if not os.path.exists(args.baseline):
+        print("no baseline at "+args.baseline+", run with --save to create one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for name, ratio in regressions:
+        print("REGRESSION {}: {:.0%} of baseline throughput".format(name, ratio))
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
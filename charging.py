@@ -0,0 +1,151 @@
+import csv
+from math import ceil, log
+
+import numpy as np
+
+# every profile is resampled on this many evenly spaced energies
+GRID_POINTS = 4096
+
+# a charging curve as tables over an even energy grid: the power drawn at every energy
+# and the cumulative time in hours to charge from the bottom of the grid to it; between
+# grid points the time is interpolated with the power as its slope, so a charge needs
+# no transcendental math
+class ChargingProfile:
+    def __init__(self, energy, power, time=None, grid_points=GRID_POINTS):
+        energy = np.asarray(energy, dtype=float)
+        power = np.asarray(power, dtype=float)
+        if len(energy) < 2 or len(energy) != len(power) or np.any(np.diff(energy) <= 0.0):
+            raise ValueError("a charging profile needs at least two increasing energies with a power each")
+        if np.any(power < 0.0):
+            raise ValueError("charging power can not be negative")
+        self.energy = np.linspace(energy[0], energy[-1], grid_points)
+        self.power = np.interp(self.energy, energy, power)
+        # what a charger on this curve can draw at most, for sharing a site power cap
+        self.peak_power = float(self.power.max())
+        if time is None:
+            time = self.get_cumulative_time()
+        self.time = time
+        self.step = float(self.energy[1]-self.energy[0])
+        # the time grows by 1/P hours per kWh, these slopes at both ends of every interval
+        # make the interpolation cubic
+        with np.errstate(divide="ignore"):
+            time_rate = np.where(self.power > 0.0, 1.0/self.power, 0.0)
+        self.set_slopes(time_rate[:-1], time_rate[1:])
+
+    def set_slopes(self, start_rate, end_rate):
+        self.slope_start = start_rate*self.step
+        self.slope_end = end_rate*self.step
+        # plain lists for the lookups of single PEVs, numpy is slower on scalars
+        self.energy_list = self.energy.tolist()
+        self.time_list = self.time.tolist()
+        self.slope_start_list = self.slope_start.tolist()
+        self.slope_end_list = self.slope_end.tolist()
+
+    # the power is linear between grid points, so every interval takes
+    # dE*ln(P2/P1)/(P2-P1) hours, or dE/P when the power does not change
+    def get_cumulative_time(self):
+        d_energy = np.diff(self.energy)
+        p1 = self.power[:-1]
+        p2 = self.power[1:]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            constant = np.abs(p2-p1) <= 1e-12*np.maximum(p1, p2)
+            dt = np.where(constant, d_energy/p1, d_energy*np.log(p2/p1)/(p2-p1))
+        dt[(p1 <= 0.0) | (p2 <= 0.0)] = np.inf
+        return np.concatenate(([0.0], np.cumsum(dt)))
+
+    # cubic Hermite interpolation of the cumulative time
+    def get_time(self, energy):
+        x = (np.asarray(energy, dtype=float)-self.energy[0])/self.step
+        k = np.clip(x.astype(int), 0, len(self.energy)-2)
+        u = x-k
+        return (self.time[k]*(1.0+2.0*u)*(1.0-u)**2+self.slope_start[k]*u*(1.0-u)**2
+            +self.time[k+1]*u**2*(3.0-2.0*u)-self.slope_end[k]*u**2*(1.0-u))
+
+    def get_time_one(self, energy):
+        x = (energy-self.energy_list[0])/self.step
+        k = min(max(int(x), 0), len(self.energy_list)-2)
+        u = x-k
+        v = 1.0-u
+        return (self.time_list[k]*(1.0+2.0*u)*v*v+self.slope_start_list[k]*u*v*v
+            +self.time_list[k+1]*u*u*(3.0-2.0*u)-self.slope_end_list[k]*u*u*v)
+
+    # charging time in hours and mean power of charges from e_i to e_r, for arrays
+    def get_charges(self, e_i, e_r):
+        t = self.get_time(e_r)-self.get_time(e_i)
+        return t, (np.asarray(e_r)-np.asarray(e_i))/t
+
+    # the same for a single PEV
+    def get_charge(self, e_i, e_r):
+        t = self.get_time_one(e_r)-self.get_time_one(e_i)
+        return t, (e_r-e_i)/t
+
+# constant power p_max up to e_c, then a power falling linearly to zero at e_max; with
+# legacy the taper takes log10 instead of ln of the energy ratio and the mean power is
+# the trapezoid of its ends, as the models always computed it
+class CcCvProfile(ChargingProfile):
+    def __init__(self, p_max, e_max, e_c, legacy=True, grid_points=GRID_POINTS):
+        self.p_max = p_max
+        self.e_max = e_max
+        self.e_c = e_c
+        self.legacy = legacy
+        # e_c is put on the grid so no interval straddles the kink of the curve, and the
+        # grid stops short of a full battery, which the taper never reaches
+        step = e_max/grid_points
+        if 0.0 < e_c < e_max:
+            step = e_c/ceil(e_c/step)
+        energy = step*np.arange(grid_points)
+        power = self.get_power(energy)
+        base = log(10.0) if legacy else 1.0
+        taper = np.log((e_max-e_c)/(e_max-np.maximum(energy, e_c)))*(e_max-e_c)/p_max/base
+        time = np.minimum(energy, e_c)/p_max+taper
+        cc_rate = 1.0/p_max
+        cv_rate = (e_max-e_c)/p_max/base/(e_max-energy)
+        super().__init__(energy, power, time, grid_points=grid_points)
+        # with legacy the rate jumps at e_c, so the intervals on both sides of it use their own
+        self.set_slopes(np.where(energy[:-1] < e_c, cc_rate, cv_rate[:-1]), np.where(energy[1:] <= e_c, cc_rate, cv_rate[1:]))
+
+    def get_power(self, energy):
+        return np.where(energy <= self.e_c, self.p_max, self.p_max*(self.e_max-energy)/(self.e_max-self.e_c))
+
+    def get_charges(self, e_i, e_r):
+        if not self.legacy:
+            return super().get_charges(e_i, e_r)
+        e_i = np.asarray(e_i, dtype=float)
+        e_r = np.asarray(e_r, dtype=float)
+        t = self.get_time(e_r)-self.get_time(e_i)
+        t1 = np.maximum(np.minimum(e_r, self.e_c)-e_i, 0.0)/self.p_max
+        p_taper = (self.get_power(np.maximum(e_i, self.e_c))+self.get_power(e_r))/2.0
+        return t, (self.p_max*t1+p_taper*(t-t1))/t
+
+    def get_charge(self, e_i, e_r):
+        if not self.legacy:
+            return super().get_charge(e_i, e_r)
+        t = self.get_time_one(e_r)-self.get_time_one(e_i)
+        t1 = max(min(e_r, self.e_c)-e_i, 0.0)/self.p_max
+        p_taper = self.p_max*(2.0*self.e_max-max(e_i, self.e_c)-e_r)/(2.0*(self.e_max-self.e_c))
+        return t, (self.p_max*t1+p_taper*(t-t1))/t
+
+# a curve of a vehicle model as power in kW against SoC; below and above the tabulated
+# SoC the power of the closest point is used
+class TabulatedProfile(ChargingProfile):
+    def __init__(self, soc, power, e_max, grid_points=GRID_POINTS):
+        soc = np.asarray(soc, dtype=float)
+        power = np.asarray(power, dtype=float)
+        if soc[0] > 0.0:
+            soc = np.concatenate(([0.0], soc))
+            power = np.concatenate(([power[0]], power))
+        if soc[-1] < 1.0:
+            soc = np.concatenate((soc, [1.0]))
+            power = np.concatenate((power, [power[-1]]))
+        self.e_max = e_max
+        super().__init__(soc*e_max, power, grid_points=grid_points)
+
+# reads a curve from a csv file with soc and power columns
+def load_profile(path, e_max, grid_points=GRID_POINTS):
+    soc = list()
+    power = list()
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            soc.append(float(row["soc"]))
+            power.append(float(row["power"]))
+    return TabulatedProfile(soc, power, e_max, grid_points)
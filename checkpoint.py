@@ -0,0 +1,257 @@
+from heapq import heapify, heappush
+import hashlib
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+from simpy.events import NORMAL, Event
+
+import single_class
+
+# arrivals between two checkpoints
+EVERY = 100000
+STATE = "state.pkl"
+
+# a simpy event due at the given time exactly; a timeout adds its delay to the current
+# time, which can be off by the last bit from the time the interrupted run had scheduled
+def get_event_at(env, due):
+    event = Event(env)
+    event._ok = True
+    event._value = None
+    heappush(env._queue, (due, NORMAL, next(env._eid), event))
+    return event
+
+# the records of PEVs that have left never change again, so they are written once in
+# columns: floats with NaN for None, integers and booleans as they are, anything else
+# pickled; decoding gives back the same python values
+def encode_records(records):
+    columns = dict()
+    kinds = dict()
+    for name in records[0]:
+        values = [record[name] for record in records]
+        if all(type(value) is bool for value in values):
+            kinds[name] = "bool"
+            columns[name] = np.array(values, dtype=bool)
+        elif all(type(value) is int for value in values):
+            kinds[name] = "int"
+            columns[name] = np.array(values, dtype=np.int64)
+        elif all(type(value) is float or value is None for value in values):
+            kinds[name] = "float"
+            columns[name] = np.array([np.nan if value is None else value for value in values], dtype=float)
+        else:
+            kinds[name] = "object"
+            columns[name] = np.frombuffer(pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+    return columns, kinds
+
+def decode_records(columns, kinds):
+    values = dict()
+    for name, kind in kinds.items():
+        if kind == "object":
+            values[name] = pickle.loads(columns[name].tobytes())
+        elif kind == "float":
+            values[name] = [None if value != value else value for value in columns[name].tolist()]
+        else:
+            values[name] = columns[name].tolist()
+    names = list(kinds)
+    return [dict(zip(names, row)) for row in zip(*(values[name] for name in names))]
+
+def write_atomic(path, data):
+    temp = path+".tmp"
+    with open(temp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+# a hash of what a charging profile computes charges from: its class, its tables and its
+# parameters, the same for equal profiles in every process
+def get_profile_hash(profile):
+    digest = hashlib.sha1(type(profile).__name__.encode())
+    for name, value in sorted(vars(profile).items()):
+        if isinstance(value, np.ndarray):
+            digest.update(name.encode()+value.tobytes())
+        elif isinstance(value, (bool, int, float, str)):
+            digest.update(name.encode()+repr(value).encode())
+    return digest.hexdigest()
+
+# periodic checkpoints of a single class simulation in a directory: every so many
+# arrivals the records of the PEVs that have left since the last checkpoint are appended
+# as a segment, and a small state file is replaced with the clock, the records of the
+# PEVs still at the station, the arrival count and the state of the sampler; a finished
+# soc_r is kept as its frame. Running the simulation again with the same parameters and
+# directory resumes from the last checkpoint, and as every PEV at
+# the station can be rebuilt from its record, the results are the same to the bit as
+# those of a run that was never stopped. Checkpoints are taken at arrivals, so a power
+# cap, whose sessions are not in the records, is not supported
+class Checkpoint:
+    def __init__(self, path, every=EVERY):
+        self.path = path
+        self.every = every
+        self.state = None
+        self.arrivals = 0
+        self.frozen = 0
+
+    def get_fingerprint(self, sim):
+        return repr((sim.pev_num, sim.lam, sim.s, sim.r, list(sim.soc_rs), sim.soc_i_mu, sim.soc_i_sigma, sim.p_max,
+            sim.e_max, sim.e_c, sim.batt_deg, sim.t_ch_coefficient, sim.horizon, get_profile_hash(sim.charging_profile)))
+
+    def get_file(self, name):
+        return os.path.join(self.path, name)
+
+    def start(self, sim):
+        if sim.power_cap is not None:
+            raise ValueError("checkpoints do not support a power cap")
+        if sim.patience is not None:
+            raise ValueError("checkpoints do not support reneging")
+        os.makedirs(self.path, exist_ok=True)
+        fingerprint = self.get_fingerprint(sim)
+        if os.path.exists(self.get_file(STATE)):
+            with open(self.get_file(STATE), "rb") as f:
+                self.state = pickle.load(f)
+            if self.state["fingerprint"] != fingerprint:
+                raise ValueError("the checkpoint in "+str(self.path)+" is of a simulation with other parameters")
+            # the sweep points still to run draw from the seed of the interrupted run
+            sim.seed_sequence = self.state["seed_sequence"]
+        else:
+            self.state = {"fingerprint": fingerprint, "seed_sequence": sim.seed_sequence, "done": dict(), "running": None}
+
+    def is_done(self, soc_r):
+        return soc_r in self.state["done"]
+
+    def get_done(self, soc_r):
+        with open(self.get_file(self.state["done"][soc_r]), "rb") as f:
+            return pickle.load(f)
+
+    def is_running(self, soc_r):
+        return self.state["running"] is not None and self.state["running"]["soc_r"] == soc_r
+
+    def get_time(self):
+        return self.state["running"]["now"]
+
+    # the records, the sampler and the station as they were at the checkpoint; returns
+    # the station and the number of PEVs that had arrived
+    def restore(self, sim):
+        running = self.state["running"]
+        for k in range(running["segments"]):
+            with np.load(self.get_file("segment-{}-{}.npz".format(running["index"], k))) as segment:
+                columns = {name: segment[name] for name in segment.files}
+            sim.temp_pevs.extend(decode_records(columns, running["kinds"][k]))
+        sim.temp_pevs.extend(running["records"])
+        sim.sampler = running["sampler"]
+        self.arrivals = running["i"]+1
+        self.frozen = len(sim.temp_pevs)-len(running["records"])
+        env = sim.env
+        charging_station = single_class.ChargingStation(env, sim.s, sim.r, sim)
+        busy = set()
+        # the charging PEVs take their chargers first, the waiting ones queue behind them
+        # in the order they came
+        for record in running["records"]:
+            if record["departure_time"] is not None or record["blocked"] or record["start_time"] is None:
+                continue
+            pev = self.get_pev(record, sim)
+            due = record["start_time"]+pev.get_charge_time(sim)
+            busy.add(record["charger"]-1)
+            env.process(self.finish_charge(env, charging_station, pev, due))
+        for record in running["records"]:
+            if record["departure_time"] is not None or record["blocked"] or record["start_time"] is not None:
+                continue
+            env.process(self.wait(env, charging_station, self.get_pev(record, sim)))
+        charging_station.free_chargers = [charger for charger in range(sim.s) if charger not in busy]
+        heapify(charging_station.free_chargers)
+        return charging_station, running["i"]
+
+    # a PEV around its record, without drawing its initial SoC again
+    def get_pev(self, record, sim):
+        pev = single_class.Pev.__new__(single_class.Pev)
+        pev.e_i = record["soc_i"]*sim.e_max
+        pev.e_r = sim.soc_r*sim.e_max
+        pev.profile = sim.charging_profile
+        pev.p_ow = record["mean_power"]
+        pev.record = record
+        return pev
+
+    def finish_charge(self, env, charging_station, pev, due):
+        with charging_station.charger.request() as request:
+            yield request
+            yield get_event_at(env, due)
+            heappush(charging_station.free_chargers, pev.record["charger"]-1)
+        pev.leave(env, charging_station)
+
+    def wait(self, env, charging_station, pev):
+        with charging_station.charger.request() as request:
+            yield request
+            yield from pev.charge(env, charging_station)
+        pev.leave(env, charging_station)
+
+    # called at every arrival before the PEV is made, with the number of PEVs before it
+    def arrival(self, sim, i):
+        self.arrivals += 1
+        if self.arrivals % self.every == 0:
+            self.save(sim, i)
+
+    def save(self, sim, i):
+        records = sim.temp_pevs
+        index = sim.soc_rs.index(sim.soc_r)
+        running = self.state["running"]
+        if running is None or running["soc_r"] != sim.soc_r:
+            running = {"soc_r": sim.soc_r, "index": index, "segments": 0, "kinds": list()}
+        # every record up to the first PEV still at the station is final
+        frozen = self.frozen
+        while frozen < len(records) and records[frozen]["departure_time"] is not None:
+            frozen += 1
+        if frozen > self.frozen:
+            columns, kinds = encode_records(records[self.frozen:frozen])
+            name = self.get_file("segment-{}-{}.npz".format(index, running["segments"]))
+            with open(name+".tmp", "wb") as f:
+                np.savez(f, **columns)
+            os.replace(name+".tmp", name)
+            running = dict(running, segments=running["segments"]+1, kinds=running["kinds"]+[kinds])
+            self.frozen = frozen
+        running = dict(running, now=sim.env.now, i=i, records=records[self.frozen:], sampler=sim.sampler)
+        self.write_state(dict(self.state, running=running))
+
+    def write_state(self, state):
+        write_atomic(self.get_file(STATE), pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+        self.state = state
+
+    # keeps the frame of a finished soc_r and drops its segments
+    def finish(self, sim):
+        index = sim.soc_rs.index(sim.soc_r)
+        name = "point-{}.pkl".format(index)
+        write_atomic(self.get_file(name), pickle.dumps(sim.pevs[sim.soc_r], protocol=pickle.HIGHEST_PROTOCOL))
+        running = self.state["running"]
+        done = dict(self.state["done"])
+        done[sim.soc_r] = name
+        self.write_state(dict(self.state, done=done, running=None))
+        if running is not None and running["soc_r"] == sim.soc_r:
+            for k in range(running["segments"]):
+                os.remove(self.get_file("segment-{}-{}.npz".format(index, k)))
+        self.arrivals = 0
+        self.frozen = 0
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    pev_num = int(sys.argv[2]) if len(sys.argv) > 2 else 10**6
+    # stopping and running this again with the same arguments goes on from the last checkpoint
+    t = time.perf_counter()
+    sim = single_class.Simulation(
+        pev_num=pev_num,
+        lam=single_class.LAM,
+        s=single_class.S,
+        r=single_class.R,
+        soc_rs=single_class.SOC_RS,
+        soc_i_p=single_class.SOC_I_P,
+        p_max=single_class.P_MAX,
+        e_max=single_class.E_MAX,
+        e_c=single_class.E_C,
+        batt_deg=single_class.BATT_DEG,
+        reward=single_class.REWARD,
+        c_w=single_class.C_W,
+        t_ch_coefficient=single_class.T_CH_COEFFICIENT,
+        checkpoint=Checkpoint(path)
+    )
+    print("done in {:.1f} s".format(time.perf_counter()-t))
+    print(sim.get_blocking_probability())
+    print(sim.get_system_revenue())
@@ -0,0 +1,236 @@
+from math import ceil, comb, sqrt
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.linalg import LinearOperator, gmres, spilu, spsolve
+
+import analytic
+
+# the chain is kept below this many states by using fewer phases
+MAX_STATES = 50000
+# larger chains are solved iteratively, an LU factorization fills in too much
+DIRECT_STATES = 5000
+# the most phases of a fit
+MAX_PHASES = 40
+
+# a Coxian distribution: a charge starts in phase j with probability alpha[j], leaves
+# phase j at rate mu[j], and then goes on to phase j+1 with probability go_on[j] or is done
+class PhaseType:
+    def __init__(self, alpha, mu, go_on):
+        self.alpha = np.asarray(alpha, dtype=float)
+        self.mu = np.asarray(mu, dtype=float)
+        self.go_on = np.asarray(go_on, dtype=float)
+
+    def get_moments(self):
+        # the time from every phase to the end, then its square
+        phases = len(self.mu)
+        first = np.zeros(phases)
+        second = np.zeros(phases)
+        for j in reversed(range(phases)):
+            after = first[j+1] if j+1 < phases else 0.0
+            after_second = second[j+1] if j+1 < phases else 0.0
+            first[j] = 1.0/self.mu[j]+self.go_on[j]*after
+            second[j] = 2.0/self.mu[j]**2+2.0*self.go_on[j]*after/self.mu[j]+self.go_on[j]*after_second
+        mean = self.alpha@first
+        return mean, sqrt(max(self.alpha@second-mean**2, 0.0))/mean
+
+# number of states with s chargers, r waiting spaces and a fit with the given phases
+def get_state_num(s, r, phases):
+    return comb(s+phases, phases)+r*comb(s+phases-1, phases-1)
+
+# two moment fit of a charging time with the given mean and coefficient of variation: a
+# mix of Erlang distributions of k-1 and k phases of one rate below cv 1, and two
+# exponentials with balanced means above it; when matching a small cv would need more
+# phases than max_phases, the Erlang distribution of max_phases phases is used instead
+def fit_phase_type(mean, cv, max_phases=MAX_PHASES):
+    c2 = cv**2
+    if c2 >= 1.0:
+        p = (1.0+sqrt((c2-1.0)/(c2+1.0)))/2.0
+        return PhaseType([p, 1.0-p], [2.0*p/mean, 2.0*(1.0-p)/mean], [0.0, 0.0])
+    k = max(1, ceil(1.0/c2-1e-9))
+    if k > max_phases:
+        return PhaseType([1.0]+[0.0]*(max_phases-1), [max_phases/mean]*max_phases, [1.0]*(max_phases-1)+[0.0])
+    if k == 1:
+        return PhaseType([1.0], [1.0/mean], [0.0])
+    # with probability p the charge ends after k-1 phases
+    p = (k*c2-sqrt(k*(1.0+c2)-k**2*c2))/(1.0+c2)
+    go_on = [1.0]*(k-2)+[1.0-p, 0.0]
+    return PhaseType([1.0]+[0.0]*(k-1), [(k-p)/mean]*k, go_on)
+
+# the most phases the chain of a station can afford, the state keys also have to fit in
+# 64 bits
+def get_max_phases(s, r, max_states=MAX_STATES):
+    phases = 1
+    while phases < MAX_PHASES and get_state_num(s, r, phases+1) <= max_states and (max(s, r)+1)**(phases+2) < 2**62:
+        phases += 1
+    return phases
+
+# every way to have at most s charges in the phases, one row each with the number of
+# charges in every phase
+def get_occupancies(s, phases):
+    rows = np.zeros((1, 0), dtype=np.int64)
+    for _ in range(phases):
+        counts = s-rows.sum(axis=1)+1
+        values = np.concatenate([np.arange(count) for count in counts])
+        rows = np.hstack((np.repeat(rows, counts, axis=0), values[:, None]))
+    return rows
+
+# the states of the station, the charges in every phase and the waiting PEVs in the last
+# column, and the generator of the chain, with rates per minute
+def get_generator(lam, s, r, phase_type):
+    phases = len(phase_type.mu)
+    occupancies = get_occupancies(s, phases)
+    busy = occupancies.sum(axis=1)
+    full = occupancies[busy == s]
+    states = np.vstack([np.hstack((occupancies, np.zeros((len(occupancies), 1), dtype=np.int64)))]
+        +[np.hstack((full, np.full((len(full), 1), q, dtype=np.int64))) for q in range(1, r+1)])
+    # every state as a number in base max(s, r)+1, so a target state is found by a sorted search
+    base = (max(s, r)+1)**np.arange(phases+1, dtype=np.int64)
+    keys = states@base
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    def find(targets):
+        return order[np.searchsorted(sorted_keys, targets@base)]
+    busy = states[:, :phases].sum(axis=1)
+    waiting = states[:, phases]
+    rows = list()
+    cols = list()
+    rates = list()
+    def add(mask, change, rate):
+        if not np.any(mask) or np.all(rate == 0.0):
+            return
+        index = np.nonzero(mask)[0]
+        rows.append(index)
+        cols.append(find(states[index]+change))
+        rates.append(np.broadcast_to(rate, mask.shape)[index])
+    unit = np.eye(phases+1, dtype=np.int64)
+    for j in range(phases):
+        # an arrival at a free charger starts in phase j
+        add(busy < s, unit[j], lam*phase_type.alpha[j])
+    # an arrival at busy chargers waits
+    add((busy == s) & (waiting < r), unit[phases], lam)
+    for j in range(phases):
+        rate = states[:, j]*phase_type.mu[j]
+        charging = states[:, j] > 0
+        if j+1 < phases:
+            add(charging, unit[j+1]-unit[j], rate*phase_type.go_on[j])
+        done = rate*(1.0-phase_type.go_on[j])
+        add(charging & (waiting == 0), -unit[j], done)
+        # a waiting PEV takes the charger that is done
+        for i in range(phases):
+            add(charging & (waiting > 0), unit[i]-unit[j]-unit[phases], done*phase_type.alpha[i])
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    rates = np.concatenate(rates)
+    generator = coo_matrix((rates, (rows, cols)), shape=(len(states), len(states))).tocsr()
+    generator = generator-csr_matrix((np.asarray(generator.sum(axis=1)).ravel(), (np.arange(len(states)), np.arange(len(states)))), shape=generator.shape)
+    return states, generator
+
+# stationary distribution: the empty station is given weight 1, which leaves a sparse
+# system for the other states, and the weights are normalized after; large systems are
+# solved by GMRES with a coarse incomplete LU preconditioner, which is cheap to build and
+# still converges in a few hundred iterations, and directly if that fails
+def get_stationary(generator):
+    a = generator.T.tocsc()
+    a_rest = a[1:, 1:]
+    b = -a[1:, 0].toarray().ravel()
+    x = None
+    if a.shape[0] > DIRECT_STATES:
+        ilu = spilu(a_rest, drop_tol=1e-2, fill_factor=2)
+        x, info = gmres(a_rest, b, M=LinearOperator(a_rest.shape, ilu.solve), rtol=1e-8, atol=0.0, restart=50, maxiter=50)
+        if info != 0:
+            x = None
+    if x is None:
+        x = spsolve(a_rest, b)
+    pi = np.maximum(np.concatenate(([1.0], x)), 0.0)
+    return pi/pi.sum()
+
+# blocking probability and mean waiting time in minutes of the admitted PEVs, arrivals
+# see the stationary distribution, lam is per hour and the charging time in minutes
+def solve(lam, s, r, phase_type):
+    states, generator = get_generator(lam/60.0, s, r, phase_type)
+    pi = get_stationary(generator)
+    phases = len(phase_type.mu)
+    busy = states[:, :phases].sum(axis=1)
+    waiting = states[:, phases]
+    p_k = pi[(busy == s) & (waiting == r)].sum()
+    mean_waiting = pi@waiting
+    return {
+        "blocking_probability": float(p_k),
+        "mean_waiting_time": float(60.0*mean_waiting/(lam*(1.0-p_k))),
+        "states": len(states)
+    }
+
+# the single class model as a Markov chain: the charging time of every soc_r is fitted by
+# a phase-type distribution on the moments from analytic, and blocking and waiting come
+# from the stationary distribution of the chain; meant for small stations, the phases
+# are cut to keep the chain below max_states, and when that leaves the fit with a larger
+# cv than the charging time the metrics of the two largest fits are extrapolated
+# linearly in the squared cv, along which they change almost linearly; that is the case
+# for most realistic charging times, with a cv of about 0.2 from soc_r 0.7 on, so the
+# blocking probability, the waiting time and the revenue of those soc_r are
+# extrapolations, get_extrapolated tells which
+class MarkovChain(analytic.Analytic):
+    def __init__(self,lam,s,r,soc_rs,soc_i_p,p_max,e_max,e_c,batt_deg,reward,c_w,t_ch_coefficient,charging_profile=None,max_states=MAX_STATES):
+        self.max_states = max_states
+        self.fits = dict()
+        super().__init__(lam,s,r,soc_rs,soc_i_p,p_max,e_max,e_c,batt_deg,reward,c_w,t_ch_coefficient,charging_profile)
+
+    def get_queue(self):
+        p_k = np.empty(len(self.soc_rs))
+        mean_t_w = np.empty(len(self.soc_rs))
+        max_phases = get_max_phases(self.s, self.r, self.max_states)
+        for k, soc_r in enumerate(self.soc_rs):
+            mean = self.moments["mean_charging_time"][k]
+            cv = self.moments["cv_charging_time"][k]
+            phase_type = fit_phase_type(mean, cv, max_phases)
+            temp1 = solve(self.lam, self.s, self.r, phase_type)
+            fit_cv = phase_type.get_moments()[1]
+            extrapolated = bool(fit_cv > cv*(1.0+1e-6) and max_phases > 1)
+            if extrapolated:
+                coarse = fit_phase_type(mean, cv, max_phases-1)
+                temp2 = solve(self.lam, self.s, self.r, coarse)
+                weight = (cv**2-fit_cv**2)/(fit_cv**2-coarse.get_moments()[1]**2)
+                for name in ("blocking_probability", "mean_waiting_time"):
+                    temp1[name] = max(0.0, temp1[name]+weight*(temp1[name]-temp2[name]))
+                temp1["blocking_probability"] = min(1.0, temp1["blocking_probability"])
+            p_k[k] = temp1["blocking_probability"]
+            mean_t_w[k] = temp1["mean_waiting_time"]
+            self.fits[soc_r] = {"phases": len(phase_type.mu), "cv": float(fit_cv), "states": temp1["states"], "extrapolated": extrapolated}
+        return p_k, mean_t_w
+
+    # {soc_r: True} where the metrics are extrapolated from fits with a larger cv
+    def get_extrapolated(self):
+        temp1 = dict()
+        for soc_r in self.soc_rs:
+            temp1[soc_r] = self.fits[soc_r]["extrapolated"]
+        return temp1
+
+if __name__ == "__main__":
+    import single_class
+
+    s = int(sys.argv[1]) if len(sys.argv) > 1 else single_class.S
+    r = int(sys.argv[2]) if len(sys.argv) > 2 else single_class.R
+    t = time.perf_counter()
+    chain = MarkovChain(
+        lam=single_class.LAM,
+        s=s,
+        r=r,
+        soc_rs=single_class.SOC_RS,
+        soc_i_p=single_class.SOC_I_P,
+        p_max=single_class.P_MAX,
+        e_max=single_class.E_MAX,
+        e_c=single_class.E_C,
+        batt_deg=single_class.BATT_DEG,
+        reward=single_class.REWARD,
+        c_w=single_class.C_W,
+        t_ch_coefficient=single_class.T_CH_COEFFICIENT
+    )
+    print("solved in {:.2f} s".format(time.perf_counter()-t))
+    print(chain.fits)
+    print(chain.get_extrapolated())
+    print(chain.get_blocking_probability())
+    print(chain.get_mean_waiting_time())
+    print(chain.get_system_revenue())
@@ -0,0 +1,146 @@
+from concurrent.futures import ProcessPoolExecutor
+import sys
+
+import numpy as np
+import pandas as pd
+
+from shared_results import SharedPevs, save_pevs, share_pevs
+import single_class
+
+CONFIG_NUM = 1000
+REPLICATIONS = 5
+PEV_NUM = 2000
+SEED = 458
+# parameter ranges the configurations are sampled from
+RANGES = {
+    "lam": (2.0, 60.0),
+    "s": (2, 40),
+    "r": (0, 10),
+    "soc_r": (0.6, 0.99),
+    "p_max": (20.0, 120.0),
+    "e_c": (0.2, 0.6)
+}
+METRICS = ["blocking_probability", "mean_waiting_time", "mean_charging_power"]
+# the analytic value agrees if it is inside Z standard errors of the simulated mean,
+# widened by a relative and an absolute tolerance
+Z = 1.96
+REL_TOL = 0.1
+ABS_TOL = {"blocking_probability": 0.005, "mean_waiting_time": 0.5, "mean_charging_power": 0.5}
+RESULTS_PATH = "equivalence_report.csv"
+
+# e_c is sampled as a fraction of the requested energy, since the charging model
+# assumes the requested energy is above e_c
+def sample_configs(n, seed=SEED, ranges=RANGES):
+    rng = np.random.default_rng(seed)
+    configs = list()
+    for k in range(n):
+        soc_r = rng.uniform(*ranges["soc_r"])
+        configs.append({
+            "config": k,
+            "lam": float(rng.uniform(*ranges["lam"])),
+            "s": int(rng.integers(ranges["s"][0], ranges["s"][1]+1)),
+            "r": int(rng.integers(ranges["r"][0], ranges["r"][1]+1)),
+            "soc_r": float(soc_r),
+            "p_max": float(rng.uniform(*ranges["p_max"])),
+            "e_c": float(rng.uniform(*ranges["e_c"])*soc_r*single_class.E_MAX)
+        })
+    return configs
+
+def get_or_nan(getter, soc_r, **kwargs):
+    try:
+        value = getter(**kwargs)[soc_r]
+    except (ZeroDivisionError, ValueError, OverflowError):
+        return float("nan")
+    return float(value) if value is not None else float("nan")
+
+# one replication of one configuration, run in a worker process; with pevs its frame comes
+# back through shared memory, only the descriptor is pickled
+def run_replication(task):
+    config, replication, seed, pev_num, pevs = task
+    soc_r = config["soc_r"]
+    sim = single_class.Simulation(
+        pev_num=pev_num,
+        lam=config["lam"],
+        s=config["s"],
+        r=config["r"],
+        soc_rs=[soc_r],
+        soc_i_p=single_class.SOC_I_P,
+        p_max=config["p_max"],
+        e_max=single_class.E_MAX,
+        e_c=config["e_c"],
+        batt_deg=single_class.BATT_DEG,
+        reward=single_class.REWARD,
+        c_w=single_class.C_W,
+        t_ch_coefficient=single_class.T_CH_COEFFICIENT,
+        seed=seed
+    )
+    descriptors = share_pevs(sim.pevs) if pevs else None
+    return descriptors, {
+        "config": config["config"],
+        "replication": replication,
+        "traffic_intensity": get_or_nan(sim.get_traffic_intensity, soc_r),
+        "sim_blocking_probability": get_or_nan(sim.get_blocking_probability, soc_r),
+        "analytic_blocking_probability": get_or_nan(sim.get_blocking_probability, soc_r, numerical=True),
+        "sim_mean_waiting_time": get_or_nan(sim.get_mean_waiting_time, soc_r),
+        "analytic_mean_waiting_time": get_or_nan(sim.get_mean_waiting_time, soc_r, numerical=True),
+        "sim_mean_charging_power": get_or_nan(sim.get_mean_charging_power, soc_r),
+        "analytic_mean_charging_power": get_or_nan(sim.get_mean_charging_power, soc_r, numerical=True)
+    }
+
+# with pevs_path the per-PEV frame of every replication is written there as well, e.g.
+# config-3-1-0.8.npz for replication 1 of configuration 3, to look into the ones that disagree
+def run_harness(configs, replications=REPLICATIONS, pev_num=PEV_NUM, seed=SEED, max_workers=None, pevs_path=None):
+    seeds = np.random.SeedSequence(seed).generate_state(len(configs)*replications)
+    tasks = list()
+    for k, config in enumerate(configs):
+        for replication in range(replications):
+            tasks.append((config, replication, int(seeds[k*replications+replication]), pev_num, pevs_path is not None))
+    rows = list()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for descriptors, row in executor.map(run_replication, tasks, chunksize=max(1, len(tasks)//256)):
+            if descriptors is not None:
+                with SharedPevs(descriptors) as pevs:
+                    save_pevs(pevs, pevs_path, "config-{}-{}".format(row["config"], row["replication"]))
+            rows.append(row)
+    return compare(pd.DataFrame(configs).set_index("config"), pd.DataFrame(rows))
+
+# collapses the replications of every configuration and checks the analytic value
+# against the confidence interval of the simulated one
+def compare(configs, replications):
+    grouped = replications.groupby("config")
+    res = configs.copy()
+    res["traffic_intensity"] = grouped["traffic_intensity"].mean()
+    for metric in METRICS:
+        sim_mean = grouped["sim_"+metric].mean()
+        count = grouped["sim_"+metric].count()
+        sim_se = grouped["sim_"+metric].std()/np.sqrt(count)
+        analytic = grouped["analytic_"+metric].mean()
+        error = analytic-sim_mean
+        res["sim_"+metric] = sim_mean
+        res["sim_se_"+metric] = sim_se
+        res["analytic_"+metric] = analytic
+        res["error_"+metric] = error
+        res["rel_error_"+metric] = error/sim_mean.abs().replace(0.0, np.nan)
+        tolerance = Z*sim_se.fillna(0.0)+REL_TOL*sim_mean.abs()+ABS_TOL[metric]
+        res["agrees_"+metric] = (error.abs() <= tolerance) & analytic.notna()
+    return res
+
+# share of configurations where the analytic path agrees, by traffic intensity
+def summarize(res, bins=(0.0, 0.3, 0.5, 0.7, 0.8, 0.9, 1.0, np.inf)):
+    groups = res.groupby(pd.cut(res["traffic_intensity"], bins), observed=True)
+    summary = pd.DataFrame({"configs": groups.size()})
+    for metric in METRICS:
+        summary["agrees_"+metric] = groups["agrees_"+metric].mean()
+        summary["median_abs_rel_error_"+metric] = groups["rel_error_"+metric].apply(lambda x: x.abs().median())
+    return summary
+
+if __name__ == "__main__":
+    config_num = int(sys.argv[1]) if len(sys.argv) > 1 else CONFIG_NUM
+    pevs_path = sys.argv[2] if len(sys.argv) > 2 else None
+    res = run_harness(sample_configs(config_num), pevs_path=pevs_path)
+    res.to_csv(RESULTS_PATH)
+    pd.set_option("display.width", 200)
+    pd.set_option("display.max_columns", None)
+    print(summarize(res))
+    for metric in METRICS:
+        print("{}: analytic agrees in {:.1%} of {} configurations".format(metric, res["agrees_"+metric].mean(), len(res)))
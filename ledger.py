@@ -0,0 +1,94 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+PERCENTILES = [5, 25, 50, 75, 95, 99]
+# level of the tail the CVaR of the waiting penalty is taken over
+ALPHA = 0.95
+COLUMNS = ["revenue", "waiting_penalty", "battery_cost", "net_revenue"]
+
+# the economics of every PEV of a result frame in dollars, from the columns at once: the
+# reward for its soc_r, the cost of its wait at c_w per hour and the battery cost of its
+# charge; a blocked PEV has zeros everywhere and charger 0, a PEV that gave up waiting
+# has charger 0 too and only the cost of its wait until it left
+def get_ledger(pevs, reward, c_w):
+    abandoned = pevs["abandoned"].to_numpy(dtype=bool)
+    admitted = ~pevs["blocked"].to_numpy(dtype=bool) & ~abandoned
+    arrival = pevs["arrival_time"].to_numpy(dtype=float, na_value=np.nan)
+    start = pevs["start_time"].to_numpy(dtype=float, na_value=np.nan)
+    departure = pevs["departure_time"].to_numpy(dtype=float, na_value=np.nan)
+    c_batt = pevs["c_batt"].to_numpy(dtype=float, na_value=np.nan)
+    waiting_penalty = np.where(admitted, c_w*(start-arrival)/60.0, np.where(abandoned, c_w*(departure-arrival)/60.0, 0.0))
+    battery_cost = np.where(admitted, c_batt*(departure-start)/60.0, 0.0)
+    revenue = np.where(admitted, float(reward), 0.0)
+    return pd.DataFrame({
+        "charger": pevs["charger"].to_numpy(dtype=np.int64),
+        "abandoned": abandoned,
+        "revenue": revenue,
+        "waiting_penalty": waiting_penalty,
+        "battery_cost": battery_cost,
+        "net_revenue": revenue-waiting_penalty-battery_cost
+    }, index=pevs.index)
+
+# conditional value at risk, the mean of the worst 1-alpha of the values counting the
+# share of the quantile itself that falls into the tail, so it is defined for any n
+def get_cvar(values, alpha=ALPHA):
+    if len(values) == 0:
+        return float("nan"), float("nan")
+    var = float(np.quantile(values, alpha))
+    return var, var+float(np.mean(np.maximum(values-var, 0.0)))/(1.0-alpha)
+
+# distribution of the per PEV economics of a sweep point, rate being the arrivals per
+# hour the point is weighted with in get_system_revenue: the means over all arrivals and
+# over the admitted PEVs, the percentiles of the admitted PEVs, VaR and CVaR of the
+# waiting penalty, and the revenue per hour in total and of every charger; the total is
+# the mean of the per PEV net revenue, not the product of the mean terms, so it moves
+# away from get_system_revenue as much as waiting and charging times are correlated
+def get_distribution(ledger, rate, percentiles=PERCENTILES, alpha=ALPHA):
+    charger = ledger["charger"].to_numpy()
+    values = ledger[COLUMNS].to_numpy()
+    # the PEVs that gave up count as admitted, they held a waiting space
+    admitted = (charger > 0) | ledger["abandoned"].to_numpy()
+    n = len(values)
+    temp1 = values[admitted]
+    var, cvar = get_cvar(temp1[:, COLUMNS.index("waiting_penalty")], alpha)
+    per_charger = np.bincount(charger[admitted], weights=temp1[:, COLUMNS.index("net_revenue")], minlength=charger.max(initial=0)+1)[1:]
+    return {
+        "mean": pd.Series(values.mean(axis=0) if n else np.full(len(COLUMNS), np.nan), index=COLUMNS),
+        "mean_admitted": pd.Series(temp1.mean(axis=0) if len(temp1) else np.full(len(COLUMNS), np.nan), index=COLUMNS),
+        "percentiles": pd.DataFrame(np.percentile(temp1, percentiles, axis=0) if len(temp1) else np.nan, index=pd.Index(percentiles, name="percentile"), columns=COLUMNS),
+        "var_waiting_penalty": var,
+        "cvar_waiting_penalty": cvar,
+        "revenue_per_hour": rate*float(values[:, COLUMNS.index("net_revenue")].sum())/n if n else float("nan"),
+        "revenue_per_charger": pd.Series(rate*per_charger/n if n else per_charger, index=pd.Index(np.arange(1, len(per_charger)+1), name="charger"))
+    }
+
+if __name__ == "__main__":
+    import single_class
+
+    pev_num = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+    sim = single_class.Simulation(
+        pev_num=pev_num,
+        lam=single_class.LAM,
+        s=single_class.S,
+        r=single_class.R,
+        soc_rs=[0.9],
+        soc_i_p=single_class.SOC_I_P,
+        p_max=single_class.P_MAX,
+        e_max=single_class.E_MAX,
+        e_c=single_class.E_C,
+        batt_deg=single_class.BATT_DEG,
+        reward=single_class.REWARD,
+        c_w=single_class.C_W,
+        t_ch_coefficient=single_class.T_CH_COEFFICIENT
+    )
+    t = time.perf_counter()
+    res = sim.get_revenue_distribution()[0.9]
+    print("{} PEVs in {:.3f} s".format(pev_num, time.perf_counter()-t))
+    pd.set_option("display.width", 200)
+    print(res["percentiles"])
+    print("CVaR of the waiting penalty: {:.2f}, revenue per hour: {:.2f}, from get_system_revenue: {:.2f}".format(
+        res["cvar_waiting_penalty"], res["revenue_per_hour"], sim.get_system_revenue()[0.9]))
+    print(res["revenue_per_charger"])
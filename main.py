@@ -2,11 +2,14 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.pyplot as plt
 import tkinter as tk
 from collections import defaultdict
-from simpy.rt import RealtimeEnvironment
 
 import single_class
 import multiclass_dedicated
 import multiclass_shared
+from plotting import ResultFigure
+from profiling import NULL_PROFILER, Profiler
+from surrogate import INTEGERS, SURROGATE_PATH, load_surrogate
+from visualization import StationPlayback, Timeline
 
 MODEL_NAMES = [
     "Single Class Model",
@@ -17,6 +20,17 @@ XLABEL_SOC = "Requested SoC (%)"
 XLABEL_LAM = "Arrival rate (each class)"
 LEGEND = ["Numerical result","Simulation Result"]
 LEGEND1 = ["Simulation: Fast charging","Simulation: Level-II 3 phase"]
+PROFILE_PATH = "profile_report.json"
+SURROGATE_LABELS = {
+    "lam": "Lambda",
+    "s": "Charger number",
+    "r": "Waiting space number",
+    "soc_r": "SoC r",
+    "p_max": "P max",
+    "system_revenue": "System revenue ($ per hour)",
+    "blocking_probability": "Blocking probability",
+    "mean_waiting_time": "Mean waiting time (minutes)"
+}
 
 def validate_value(val: str):
     try:
@@ -79,6 +93,8 @@ class SingleClassWindow:
         self.c_w_val.set(single_class.C_W)
         self.soc_r_vis_val = tk.StringVar(self.window)
         self.time_vis_val = tk.DoubleVar(self.window)
+        self.speed_vis_val = tk.DoubleVar(self.window)
+        self.profile_val = tk.BooleanVar(self.window)
 
         self.vcmd = (self.window.register(validate_value))
         self.vcmd2 = (self.window.register(validate_value_with_commas))
@@ -152,7 +168,15 @@ class SingleClassWindow:
         c_w.grid(column=5,row=5,padx=10,pady=5)
         sim_button = tk.Button(self.window, text="Simulate", command=self.open_result_window)
         sim_button.grid(column=1,row=5,padx=10,pady=5)
+        what_if_button = tk.Button(self.window, text="What-if", command=self.open_what_if_window)
+        what_if_button.grid(column=1,row=6,padx=10,pady=5)
     
+    def open_what_if_window(self):
+        if self.root_window.model_what_if_window:
+            self.root_window.model_what_if_window.window.destroy()
+            self.root_window.model_what_if_window = None
+        self.root_window.model_what_if_window = WhatIfWindow(self.window)
+
     def open_result_window(self):
         if self.soc_rs_val.get() == "":
             return
@@ -188,6 +212,8 @@ class SingleClassWindow:
         buttons_frm = tk.Frame(self.root_window.model_result_window, bg="#fff")
         sim_button = tk.Button(buttons_frm, text="Re-Simulate", command=self.simulate)
         sim_button.grid(column=0,row=0,padx=(0,120),pady=(60,5))
+        profile_button = tk.Checkbutton(buttons_frm,text="Profile",variable=self.profile_val,background="#fff")
+        profile_button.grid(column=0,row=1,padx=(0,120),pady=5)
         soc_r_vis_label = tk.Label(buttons_frm,text="SoC r to visualize",background="#fff")
         soc_r_vis_label.grid(column=1,row=0,padx=10,pady=(60,5))
         self.soc_r_vis = tk.OptionMenu(buttons_frm,self.soc_r_vis_val,"")
@@ -197,6 +223,11 @@ class SingleClassWindow:
         self.time_vis_val.set(150.0)
         time_vis = tk.Entry(buttons_frm,textvariable=self.time_vis_val,validate="all",validatecommand=(self.vcmd, "%P"),width=10)
         time_vis.grid(column=2,row=1,padx=10,pady=5)
+        speed_vis_label = tk.Label(buttons_frm,text="Playback speed (minutes per second)",background="#fff")
+        speed_vis_label.grid(column=1,row=2,padx=10,pady=5)
+        self.speed_vis_val.set(10.0)
+        speed_vis = tk.Entry(buttons_frm,textvariable=self.speed_vis_val,validate="all",validatecommand=(self.vcmd, "%P"),width=10)
+        speed_vis.grid(column=2,row=2,padx=10,pady=5)
         vis_button = tk.Button(buttons_frm, text="Visualize", command=self.open_visual_window)
         vis_button.grid(column=3,row=0,padx=10,pady=(60,5))
         buttons_frm.grid()
@@ -210,9 +241,17 @@ class SingleClassWindow:
         self.data_plot = FigureCanvasTkAgg(fig, master=self.root_window.model_result_window)
         self.data_plot.get_tk_widget().config(height=550,width=1100)
         self.data_plot.get_tk_widget().grid()
+        self.result_figure = ResultFigure(self.data_plot)
+        self.p1 = self.result_figure.add(self.a1,XLABEL_SOC,"Mean charging time (minutes)",stem=True,legend=LEGEND)
+        self.p2 = self.result_figure.add(self.a2,XLABEL_SOC,"Mean charging power (kWh)",stem=True,legend=LEGEND)
+        self.p3 = self.result_figure.add(self.a3,XLABEL_SOC,"Traffic intensity (cars per minute)",stem=True,legend=LEGEND)
+        self.p4 = self.result_figure.add(self.a4,XLABEL_SOC,"Blocking probability (%)",stem=True,legend=LEGEND)
+        self.p5 = self.result_figure.add(self.a5,XLABEL_SOC,"Mean waiting time (minutes)",stem=True,legend=LEGEND)
+        self.p6 = self.result_figure.add(self.a6,XLABEL_SOC,"System revenue ($ per hour)")
         self.simulate()
     
     def simulate(self):
+        self.profiler = Profiler() if self.profile_val.get() else NULL_PROFILER
         self.sim = single_class.Simulation(
             pev_num=int(self.pev_num_val.get()),
             lam=self.lam_val.get(),
@@ -226,7 +265,8 @@ class SingleClassWindow:
             batt_deg={"a": self.batt_deg_a_val.get(),"b": self.batt_deg_b_val.get(),"c": self.batt_deg_c_val.get()},
             reward={"m": self.reward_m_val.get(),"n": self.reward_n_val.get()},
             c_w=self.c_w_val.get(),
-            t_ch_coefficient=self.t_ch_coefficient_val.get()
+            t_ch_coefficient=self.t_ch_coefficient_val.get(),
+            profiler=self.profiler
         )
         self.soc_r_vis_val.set("")
         self.soc_r_vis["menu"].delete(0, "end")
@@ -234,73 +274,34 @@ class SingleClassWindow:
         for soc_r in soc_rs:
             self.soc_r_vis["menu"].add_command(label=soc_r, command=tk._setit(self.soc_r_vis_val, soc_r))
         self.soc_r_vis_val.set(soc_rs[0])
+        with self.profiler.phase("plot"):
+            self.plot()
+        if self.profiler.enabled:
+            self.profiler.to_json(PROFILE_PATH)
+
+    def plot(self):
         a1_dict = self.sim.get_mean_charging_time()
-        self.a1.cla()
-        self.a1.set_xlabel(XLABEL_SOC)
-        self.a1.set_ylabel("Mean charging time (minutes)")
-        self.a1.plot(list(a1_dict.keys()),list(a1_dict.values()))
-        self.a1.stem(list(a1_dict.keys()),list(a1_dict.values()),use_line_collection=True,bottom=-1,linefmt="C3-",markerfmt="C3o")
-        self.a1.legend(LEGEND)
-        self.a1.set_xticks(self.sim.soc_rs)
-        self.a1.set_ylim(0,None)
-        self.a1.set_xlim(None,self.sim.soc_rs[-1])
+        changed = self.p1.update(self.sim.soc_rs,[list(a1_dict.values())],list(a1_dict.values()))
         a2_dict = self.sim.get_mean_charging_power(numerical=True)
         a2_dict2 = self.sim.get_mean_charging_power()
-        self.a2.cla()
-        self.a2.set_xlabel(XLABEL_SOC)
-        self.a2.set_ylabel("Mean charging power (kWh)")
-        self.a2.plot(list(a2_dict.keys()),list(a2_dict.values()))
-        self.a2.stem(list(a2_dict2.keys()),list(a2_dict2.values()),use_line_collection=True,bottom=-1,linefmt="C3-",markerfmt="C3o")
-        self.a2.legend(LEGEND)
-        self.a2.set_xticks(self.sim.soc_rs)
-        self.a2.set_ylim(0,None)
-        self.a2.set_xlim(None,self.sim.soc_rs[-1])
+        changed = self.p2.update(self.sim.soc_rs,[list(a2_dict.values())],list(a2_dict2.values())) or changed
         a3_dict = self.sim.get_traffic_intensity()
-        self.a3.cla()
-        self.a3.set_xlabel(XLABEL_SOC)
-        self.a3.set_ylabel("Traffic intensity (cars per minute)")
-        self.a3.plot(list(a3_dict.keys()),list(a3_dict.values()))
-        self.a3.stem(list(a3_dict.keys()),list(a3_dict.values()),use_line_collection=True,bottom=-1,linefmt="C3-",markerfmt="C3o")
-        self.a3.legend(LEGEND)
-        self.a3.set_xticks(self.sim.soc_rs)
-        self.a3.set_ylim(0,None)
-        self.a3.set_xlim(None,self.sim.soc_rs[-1])
+        changed = self.p3.update(self.sim.soc_rs,[list(a3_dict.values())],list(a3_dict.values())) or changed
         a4_dict = self.sim.get_blocking_probability(numerical=True)
         a4_dict2 = self.sim.get_blocking_probability()
-        self.a4.cla()
-        self.a4.set_xlabel(XLABEL_SOC)
-        self.a4.set_ylabel("Blocking probability (%)")
-        self.a4.plot(list(a4_dict.keys()),list(a4_dict.values()))
-        self.a4.stem(list(a4_dict2.keys()),list(a4_dict2.values()),use_line_collection=True,bottom=-1,linefmt="C3-",markerfmt="C3o")
-        self.a4.legend(LEGEND)
-        self.a4.set_xticks(self.sim.soc_rs)
-        self.a4.set_ylim(0,None)
-        self.a4.set_xlim(None,self.sim.soc_rs[-1])
+        changed = self.p4.update(self.sim.soc_rs,[list(a4_dict.values())],list(a4_dict2.values())) or changed
         a5_dict = self.sim.get_mean_waiting_time(numerical=True)
         a5_dict2 = self.sim.get_mean_waiting_time()
-        self.a5.cla()
-        self.a5.set_xlabel(XLABEL_SOC)
-        self.a5.set_ylabel("Mean waiting time (minutes)")
-        self.a5.plot(list(a5_dict.keys()),list(a5_dict.values()))
-        self.a5.stem(list(a5_dict2.keys()),list(a5_dict2.values()),use_line_collection=True,bottom=-1,linefmt="C3-",markerfmt="C3o")
-        self.a5.legend(LEGEND)
-        self.a5.set_xticks(self.sim.soc_rs)
-        self.a5.set_ylim(0,None)
-        self.a5.set_xlim(None,self.sim.soc_rs[-1])
+        changed = self.p5.update(self.sim.soc_rs,[list(a5_dict.values())],list(a5_dict2.values())) or changed
         a6_dict = self.sim.get_system_revenue()
-        self.a6.cla()
-        self.a6.set_xlabel(XLABEL_SOC)
-        self.a6.set_ylabel("System revenue ($ per hour)")
-        self.a6.plot(list(a6_dict.keys()),list(a6_dict.values()))
-        self.a6.set_xticks(self.sim.soc_rs)
-        self.a6.set_ylim(0,None)
-        self.a6.set_xlim(None,self.sim.soc_rs[-1])
-        self.data_plot.draw()
+        changed = self.p6.update(self.sim.soc_rs,[list(a6_dict.values())]) or changed
+        self.result_figure.draw(full=changed)
 
     def open_visual_window(self):
         try:
             self.soc_r_vis_val.get()
             self.time_vis_val.get()
+            self.speed_vis_val.get()
         except tk.TclError:
             return
         if self.root_window.model_visual_window:
@@ -309,74 +310,10 @@ class SingleClassWindow:
         self.root_window.model_visual_window = tk.Toplevel(self.root_window.model_result_window)
         self.root_window.model_visual_window.config(bg="#fff")
         self.root_window.model_visual_window.grid()
-        self.rt_env = RealtimeEnvironment(factor=0.1,strict=False)
-        self.canvas = tk.Canvas(self.root_window.model_visual_window,
-            width=max(450,self.sim.s*75),height=350,bg="#fff")
-        self.canvas.grid()
-        self.charger_img = tk.PhotoImage(file = "images/charger.gif")
-        self.pev_img = tk.PhotoImage(file = "images/pev.gif")
-        for i in range(self.sim.s):
-            x = 25+75*i
-            self.canvas.create_image(x, 20, anchor = tk.NW, image = self.charger_img)
-        self.i = 0
-        self.temp_soc_r_vis = float(self.soc_r_vis_val.get())
-        self.total_charge_time = 0
-        self.total_wait_time = 0
-        self.canvas.create_rectangle(230, 200, 420, 280, fill="#fff")
-        self.time = self.canvas.create_text(240, 210, text = "Time = "+str(round(self.rt_env.now, 1))+"m", anchor = tk.NW)
-        self.charge_time = self.canvas.create_text(240, 235, text = "Average Charge time = 0", anchor = tk.NW)
-        self.wait_time = self.canvas.create_text(240, 260, text = "Average Wait time = 0", anchor = tk.NW)
-        self.pev_icons = list()
-        self.waiting_cars = list()
-        self.waiting_cars_num = self.canvas.create_text(25, 150, text = "# of waiting cars: "+str(len(self.waiting_cars)), anchor = tk.NW)
-        self.rt_env.process(self.visualize())
-        self.rt_env.run(until=self.time_vis_val.get())
-        self.canvas.update()
-
-    def visualize(self):
-        while True:
-            yield self.rt_env.timeout(0.1)
-            self.tick()
-
-    def tick(self):
-        self.canvas.delete(self.time)
-        self.time = self.canvas.create_text(240, 210, text = "Time = "+str(round(self.rt_env.now, 1))+"m", anchor = tk.NW)
-        if self.i > 0:
-            self.canvas.delete(self.charge_time)
-            self.canvas.delete(self.wait_time)
-            self.canvas.delete(self.waiting_cars_num)
-            self.charge_time = self.canvas.create_text(240, 235, text = "Average Charge time = "+str(round(self.total_charge_time/self.i if self.i else 0, 1)), anchor = tk.NW)
-            self.wait_time = self.canvas.create_text(240, 260, text = "Average Wait time = "+str(round(self.total_wait_time/self.i if self.i else 0, 1)), anchor = tk.NW)
-            self.waiting_cars_num = self.canvas.create_text(25, 150, text = "# of waiting cars: "+str(len(self.waiting_cars)), anchor = tk.NW)       
-        if self.rt_env.now >= self.sim.pevs[self.temp_soc_r_vis].at[self.i+1,"arrival_time"]:
-            self.i += 1
-            if not self.sim.pevs[self.temp_soc_r_vis].at[self.i,"blocked"]:
-                if self.sim.pevs[self.temp_soc_r_vis].at[self.i,"arrival_time"] == self.sim.pevs[self.temp_soc_r_vis].at[self.i+1,"start_time"]:
-                    x = 25+75*(self.sim.pevs[self.temp_soc_r_vis].at[self.i,"charger"]-1)
-                    self.pev_icons.append(
-                        (self.i,
-                        self.canvas.create_image(x, 50, anchor = tk.NW, image = self.pev_img),
-                        self.canvas.create_text(x, 85, text = "PEV #"+str(self.i), anchor = tk.NW))
-                    )
-                else:
-                    self.waiting_cars.append(self.i)
-        for car in self.pev_icons:
-            self.total_charge_time += 0.1
-            if self.rt_env.now >= self.sim.pevs[self.temp_soc_r_vis].at[car[0],"departure_time"]:
-                self.canvas.delete(car[1])
-                self.canvas.delete(car[2])
-                self.pev_icons.remove(car)
-        for car in self.waiting_cars:
-            self.total_wait_time += 0.1
-            if self.rt_env.now >= self.sim.pevs[self.temp_soc_r_vis].at[car,"start_time"]:
-                x = 25+75*(self.sim.pevs[self.temp_soc_r_vis].at[self.i,"charger"]-1)
-                self.pev_icons.append(
-                    (self.i,
-                    self.canvas.create_image(x, 50, anchor = tk.NW, image = self.pev_img),
-                    self.canvas.create_text(x, 85, text = "PEV #"+str(self.i), anchor = tk.NW))
-                )
-                self.waiting_cars.remove(car)
-        self.canvas.update()
+        timeline = Timeline(self.sim.pevs[float(self.soc_r_vis_val.get())], self.sim.s)
+        self.playback = StationPlayback(self.root_window.model_visual_window, timeline, self.sim.r,
+            speed=self.speed_vis_val.get(), until=self.time_vis_val.get())
+        self.playback.start()
 
 class MultiClassDedicatedWindow:
     def __init__(self,root_window: "RootWindow"):
@@ -431,6 +368,11 @@ class MultiClassDedicatedWindow:
         self.reward_n_val.set(multiclass_dedicated.REWARD["n"])
         self.c_w_val = tk.DoubleVar(self.window)
         self.c_w_val.set(multiclass_dedicated.C_W)
+        self.lam_vis_val = tk.StringVar(self.window)
+        self.class_vis_val = tk.StringVar(self.window)
+        self.time_vis_val = tk.DoubleVar(self.window)
+        self.speed_vis_val = tk.DoubleVar(self.window)
+        self.profile_val = tk.BooleanVar(self.window)
 
         self.vcmd = (self.window.register(validate_value))
         self.vcmd2 = (self.window.register(validate_value_with_commas))
@@ -550,7 +492,30 @@ class MultiClassDedicatedWindow:
         self.root_window.model_result_window.grid()
         buttons_frm = tk.Frame(self.root_window.model_result_window, bg="#fff")
         sim_button = tk.Button(buttons_frm, text="Re-Simulate", command=self.simulate)
-        sim_button.grid(column=0,row=0,pady=(60,5))
+        sim_button.grid(column=0,row=0,padx=(0,120),pady=(60,5))
+        profile_button = tk.Checkbutton(buttons_frm,text="Profile",variable=self.profile_val,background="#fff")
+        profile_button.grid(column=0,row=1,padx=(0,120),pady=5)
+        lam_vis_label = tk.Label(buttons_frm,text="Lambda to visualize",background="#fff")
+        lam_vis_label.grid(column=1,row=0,padx=10,pady=(60,5))
+        self.lam_vis = tk.OptionMenu(buttons_frm,self.lam_vis_val,"")
+        self.lam_vis.grid(column=2,row=0,padx=10,pady=(60,5))
+        class_vis_label = tk.Label(buttons_frm,text="Class to visualize",background="#fff")
+        class_vis_label.grid(column=1,row=1,padx=10,pady=5)
+        self.class_vis_val.set(LEGEND1[0])
+        class_vis = tk.OptionMenu(buttons_frm,self.class_vis_val,*LEGEND1)
+        class_vis.grid(column=2,row=1,padx=10,pady=5)
+        time_vis_label = tk.Label(buttons_frm,text="Visualization time (minutes)",background="#fff")
+        time_vis_label.grid(column=1,row=2,padx=10,pady=5)
+        self.time_vis_val.set(150.0)
+        time_vis = tk.Entry(buttons_frm,textvariable=self.time_vis_val,validate="all",validatecommand=(self.vcmd, "%P"),width=10)
+        time_vis.grid(column=2,row=2,padx=10,pady=5)
+        speed_vis_label = tk.Label(buttons_frm,text="Playback speed (minutes per second)",background="#fff")
+        speed_vis_label.grid(column=1,row=3,padx=10,pady=5)
+        self.speed_vis_val.set(10.0)
+        speed_vis = tk.Entry(buttons_frm,textvariable=self.speed_vis_val,validate="all",validatecommand=(self.vcmd, "%P"),width=10)
+        speed_vis.grid(column=2,row=3,padx=10,pady=5)
+        vis_button = tk.Button(buttons_frm, text="Visualize", command=self.open_visual_window)
+        vis_button.grid(column=3,row=0,padx=10,pady=(60,5))
         buttons_frm.grid()
         fig = plt.Figure(figsize=(2, 3), dpi=72)
         self.a1 = fig.add_subplot(221)
@@ -560,9 +525,15 @@ class MultiClassDedicatedWindow:
         self.data_plot = FigureCanvasTkAgg(fig, master=self.root_window.model_result_window)
         self.data_plot.get_tk_widget().config(height=550,width=800)
         self.data_plot.get_tk_widget().grid()
+        self.result_figure = ResultFigure(self.data_plot)
+        self.p1 = self.result_figure.add(self.a1,XLABEL_LAM,"Traffic intensity",line_num=2,legend=LEGEND1)
+        self.p2 = self.result_figure.add(self.a2,XLABEL_LAM,"Class blocking probability",line_num=2,legend=LEGEND1)
+        self.p3 = self.result_figure.add(self.a3,XLABEL_LAM,"Class revenue",line_num=2,legend=LEGEND1)
+        self.p4 = self.result_figure.add(self.a4,XLABEL_LAM,"System revenue")
         self.simulate()
     
     def simulate(self):
+        self.profiler = Profiler() if self.profile_val.get() else NULL_PROFILER
         self.sim = multiclass_dedicated.Simulation(
             theta=[float(self.theta0_val.get()),float(self.theta1_val.get())],
             pev_num=int(self.pev_num_val.get()),
@@ -578,49 +549,51 @@ class MultiClassDedicatedWindow:
             batt_deg={"a": self.batt_deg_a_val.get(),"b": self.batt_deg_b_val.get(),"c": self.batt_deg_c_val.get()},
             reward={"m": self.reward_m_val.get(),"n": self.reward_n_val.get()},
             c_w=self.c_w_val.get(),
-            t_ch_coefficient=self.t_ch_coefficient_val.get()
+            t_ch_coefficient=self.t_ch_coefficient_val.get(),
+            profiler=self.profiler
         )
+        self.lam_vis_val.set("")
+        self.lam_vis["menu"].delete(0, "end")
+        lams = [str(lam) for lam in self.sim.lam]
+        for lam in lams:
+            self.lam_vis["menu"].add_command(label=lam, command=tk._setit(self.lam_vis_val, lam))
+        self.lam_vis_val.set(lams[0])
+        with self.profiler.phase("plot"):
+            self.plot()
+        if self.profiler.enabled:
+            self.profiler.to_json(PROFILE_PATH)
+
+    def plot(self):
         a1_dict = self.sim.get_traffic_intensity()
-        self.a1.cla()
-        self.a1.set_xlabel(XLABEL_LAM)
-        self.a1.set_ylabel("Traffic intensity")
-        self.a1.plot(list(a1_dict[0].keys()),list(a1_dict[0].values()))
-        self.a1.plot(list(a1_dict[1].keys()),list(a1_dict[1].values()))
-        self.a1.legend(LEGEND1)
-        self.a1.set_xticks(self.sim.lam)
-        self.a1.set_ylim(0,None)
-        self.a1.set_xlim(None,self.sim.lam[-1])
+        changed = self.p1.update(self.sim.lam,[list(a1_dict[0].values()),list(a1_dict[1].values())])
         a2_dict = self.sim.get_blocking_probability()
-        self.a2.cla()
-        self.a2.set_xlabel(XLABEL_LAM)
-        self.a2.set_ylabel("Class blocking probability")
-        self.a2.plot(list(a2_dict[0].keys()),list(a2_dict[0].values()))
-        self.a2.plot(list(a2_dict[1].keys()),list(a2_dict[1].values()))
-        self.a2.legend(LEGEND1)
-        self.a2.set_xticks(self.sim.lam)
-        self.a2.set_ylim(0,None)
-        self.a2.set_xlim(None,self.sim.lam[-1])
+        changed = self.p2.update(self.sim.lam,[list(a2_dict[0].values()),list(a2_dict[1].values())]) or changed
         a3_dict = self.sim.get_system_revenue()
-        self.a3.cla()
-        self.a3.set_xlabel(XLABEL_LAM)
-        self.a3.set_ylabel("Class revenue")
-        self.a3.plot(list(a3_dict[0].keys()),list(a3_dict[0].values()))
-        self.a3.plot(list(a3_dict[1].keys()),list(a3_dict[1].values()))
-        self.a3.legend(LEGEND1)
-        self.a3.set_xticks(self.sim.lam)
-        self.a3.set_ylim(0,None)
-        self.a3.set_xlim(None,self.sim.lam[-1])
+        changed = self.p3.update(self.sim.lam,[list(a3_dict[0].values()),list(a3_dict[1].values())]) or changed
         a4_dict = a3_dict[0]
         for i in a4_dict.keys():
             a4_dict[i] += a3_dict[1][i]
-        self.a4.cla()
-        self.a4.set_xlabel(XLABEL_LAM)
-        self.a4.set_ylabel("System revenue")
-        self.a4.plot(list(a4_dict.keys()),list(a4_dict.values()))
-        self.a4.set_xticks(self.sim.lam)
-        self.a4.set_ylim(0,None)
-        self.a4.set_xlim(None,self.sim.lam[-1])
-        self.data_plot.draw()
+        changed = self.p4.update(self.sim.lam,[list(a4_dict.values())]) or changed
+        self.result_figure.draw(full=changed)
+
+    def open_visual_window(self):
+        try:
+            self.lam_vis_val.get()
+            self.time_vis_val.get()
+            self.speed_vis_val.get()
+        except tk.TclError:
+            return
+        if self.root_window.model_visual_window:
+            self.root_window.model_visual_window.destroy()
+            self.root_window.model_visual_window = None
+        self.root_window.model_visual_window = tk.Toplevel(self.root_window.model_result_window)
+        self.root_window.model_visual_window.config(bg="#fff")
+        self.root_window.model_visual_window.grid()
+        pev_class = LEGEND1.index(self.class_vis_val.get())
+        timeline = Timeline(self.sim.pevs[pev_class][float(self.lam_vis_val.get())], self.sim.s)
+        self.playback = StationPlayback(self.root_window.model_visual_window, timeline, self.sim.r[pev_class],
+            speed=self.speed_vis_val.get(), until=self.time_vis_val.get())
+        self.playback.start()
 
 class MultiClassSharedWindow:
     def __init__(self,root_window: "RootWindow"):
@@ -675,6 +648,10 @@ class MultiClassSharedWindow:
         self.reward_n_val.set(multiclass_shared.REWARD["n"])
         self.c_w_val = tk.DoubleVar(self.window)
         self.c_w_val.set(multiclass_shared.C_W)
+        self.lam_vis_val = tk.StringVar(self.window)
+        self.time_vis_val = tk.DoubleVar(self.window)
+        self.speed_vis_val = tk.DoubleVar(self.window)
+        self.profile_val = tk.BooleanVar(self.window)
 
         self.vcmd = (self.window.register(validate_value))
         self.vcmd2 = (self.window.register(validate_value_with_commas))
@@ -794,7 +771,25 @@ class MultiClassSharedWindow:
         self.root_window.model_result_window.grid()
         buttons_frm = tk.Frame(self.root_window.model_result_window, bg="#fff")
         sim_button = tk.Button(buttons_frm, text="Re-Simulate", command=self.simulate)
-        sim_button.grid(column=0,row=0,pady=(60,5))
+        sim_button.grid(column=0,row=0,padx=(0,120),pady=(60,5))
+        profile_button = tk.Checkbutton(buttons_frm,text="Profile",variable=self.profile_val,background="#fff")
+        profile_button.grid(column=0,row=1,padx=(0,120),pady=5)
+        lam_vis_label = tk.Label(buttons_frm,text="Lambda to visualize",background="#fff")
+        lam_vis_label.grid(column=1,row=0,padx=10,pady=(60,5))
+        self.lam_vis = tk.OptionMenu(buttons_frm,self.lam_vis_val,"")
+        self.lam_vis.grid(column=2,row=0,padx=10,pady=(60,5))
+        time_vis_label = tk.Label(buttons_frm,text="Visualization time (minutes)",background="#fff")
+        time_vis_label.grid(column=1,row=1,padx=10,pady=5)
+        self.time_vis_val.set(150.0)
+        time_vis = tk.Entry(buttons_frm,textvariable=self.time_vis_val,validate="all",validatecommand=(self.vcmd, "%P"),width=10)
+        time_vis.grid(column=2,row=1,padx=10,pady=5)
+        speed_vis_label = tk.Label(buttons_frm,text="Playback speed (minutes per second)",background="#fff")
+        speed_vis_label.grid(column=1,row=2,padx=10,pady=5)
+        self.speed_vis_val.set(10.0)
+        speed_vis = tk.Entry(buttons_frm,textvariable=self.speed_vis_val,validate="all",validatecommand=(self.vcmd, "%P"),width=10)
+        speed_vis.grid(column=2,row=2,padx=10,pady=5)
+        vis_button = tk.Button(buttons_frm, text="Visualize", command=self.open_visual_window)
+        vis_button.grid(column=3,row=0,padx=10,pady=(60,5))
         buttons_frm.grid()
         fig = plt.Figure(figsize=(2, 3), dpi=72)
         self.a1 = fig.add_subplot(221)
@@ -803,9 +798,14 @@ class MultiClassSharedWindow:
         self.data_plot = FigureCanvasTkAgg(fig, master=self.root_window.model_result_window)
         self.data_plot.get_tk_widget().config(height=550,width=800)
         self.data_plot.get_tk_widget().grid()
+        self.result_figure = ResultFigure(self.data_plot)
+        self.p1 = self.result_figure.add(self.a1,XLABEL_LAM,"Traffic intensity")
+        self.p2 = self.result_figure.add(self.a2,XLABEL_LAM,"Class blocking probability")
+        self.p3 = self.result_figure.add(self.a3,XLABEL_LAM,"Class revenue")
         self.simulate()
     
     def simulate(self):
+        self.profiler = Profiler() if self.profile_val.get() else NULL_PROFILER
         self.sim = multiclass_shared.Simulation(
             theta=[float(self.theta0_val.get()),float(self.theta1_val.get())],
             pev_num=int(self.pev_num_val.get()),
@@ -821,33 +821,88 @@ class MultiClassSharedWindow:
             batt_deg={"a": self.batt_deg_a_val.get(),"b": self.batt_deg_b_val.get(),"c": self.batt_deg_c_val.get()},
             reward={"m": self.reward_m_val.get(),"n": self.reward_n_val.get()},
             c_w=self.c_w_val.get(),
-            t_ch_coefficient=self.t_ch_coefficient_val.get()
+            t_ch_coefficient=self.t_ch_coefficient_val.get(),
+            profiler=self.profiler
         )
+        self.lam_vis_val.set("")
+        self.lam_vis["menu"].delete(0, "end")
+        lams = [str(lam) for lam in self.sim.lam]
+        for lam in lams:
+            self.lam_vis["menu"].add_command(label=lam, command=tk._setit(self.lam_vis_val, lam))
+        self.lam_vis_val.set(lams[0])
+        with self.profiler.phase("plot"):
+            self.plot()
+        if self.profiler.enabled:
+            self.profiler.to_json(PROFILE_PATH)
+
+    def plot(self):
         a1_dict = self.sim.get_traffic_intensity()
-        self.a1.cla()
-        self.a1.set_xlabel(XLABEL_LAM)
-        self.a1.set_ylabel("Traffic intensity")
-        self.a1.plot(list(a1_dict.keys()),list(a1_dict.values()))
-        self.a1.set_xticks(self.sim.lam)
-        self.a1.set_ylim(0,None)
-        self.a1.set_xlim(None,self.sim.lam[-1])
+        changed = self.p1.update(self.sim.lam,[list(a1_dict.values())])
         a2_dict = self.sim.get_blocking_probability()
-        self.a2.cla()
-        self.a2.set_xlabel(XLABEL_LAM)
-        self.a2.set_ylabel("Class blocking probability")
-        self.a2.plot(list(a2_dict.keys()),list(a2_dict.values()))
-        self.a2.set_xticks(self.sim.lam)
-        self.a2.set_ylim(0,None)
-        self.a2.set_xlim(None,self.sim.lam[-1])
+        changed = self.p2.update(self.sim.lam,[list(a2_dict.values())]) or changed
         a3_dict = self.sim.get_system_revenue()
-        self.a3.cla()
-        self.a3.set_xlabel(XLABEL_LAM)
-        self.a3.set_ylabel("Class revenue")
-        self.a3.plot(list(a3_dict.keys()),list(a3_dict.values()))
-        self.a3.set_xticks(self.sim.lam)
-        self.a3.set_ylim(0,None)
-        self.a3.set_xlim(None,self.sim.lam[-1])
-        self.data_plot.draw()
+        changed = self.p3.update(self.sim.lam,[list(a3_dict.values())]) or changed
+        self.result_figure.draw(full=changed)
+
+    def open_visual_window(self):
+        try:
+            self.lam_vis_val.get()
+            self.time_vis_val.get()
+            self.speed_vis_val.get()
+        except tk.TclError:
+            return
+        if self.root_window.model_visual_window:
+            self.root_window.model_visual_window.destroy()
+            self.root_window.model_visual_window = None
+        self.root_window.model_visual_window = tk.Toplevel(self.root_window.model_result_window)
+        self.root_window.model_visual_window.config(bg="#fff")
+        self.root_window.model_visual_window.grid()
+        timeline = Timeline(self.sim.pevs[float(self.lam_vis_val.get())], self.sim.s)
+        self.playback = StationPlayback(self.root_window.model_visual_window, timeline, self.sim.r[0],
+            speed=self.speed_vis_val.get(), until=self.time_vis_val.get())
+        self.playback.start()
+
+# sliders over the fitted domain of the surrogate, every move is answered by the emulators
+class WhatIfWindow:
+    def __init__(self, master):
+        self.window = tk.Toplevel(master)
+        self.window.title("Single Class Model What-If")
+        self.window.resizable(width=False,height=False)
+        self.window.config(bg="#fff")
+        self.window.grid()
+        try:
+            self.surrogate = load_surrogate(SURROGATE_PATH)
+        except FileNotFoundError:
+            self.surrogate = None
+            message = tk.Label(self.window,text="No surrogate at "+SURROGATE_PATH+", build one with: python surrogate.py",background="#fff")
+            message.grid(column=0,row=0,padx=10,pady=5)
+            return
+        defaults = {"lam": single_class.LAM, "s": single_class.S, "r": single_class.R, "soc_r": max(single_class.SOC_RS), "p_max": single_class.P_MAX}
+        self.values = dict()
+        for row, name in enumerate(self.surrogate.names):
+            low, high = self.surrogate.domain[name]
+            self.values[name] = tk.DoubleVar(self.window)
+            self.values[name].set(min(high, max(low, defaults.get(name, low))))
+            label = tk.Label(self.window,text=SURROGATE_LABELS.get(name, name),background="#fff")
+            label.grid(column=0,row=row,padx=10,pady=5)
+            scale = tk.Scale(self.window,variable=self.values[name],from_=low,to=high,
+                resolution=1 if name in INTEGERS else (high-low)/1000.0,orient=tk.HORIZONTAL,length=300,
+                command=self.update,background="#fff")
+            scale.grid(column=1,row=row,padx=10,pady=5)
+        self.results = dict()
+        for row, target in enumerate(self.surrogate.processes, start=len(self.surrogate.names)):
+            label = tk.Label(self.window,text=SURROGATE_LABELS.get(target, target),background="#fff")
+            label.grid(column=0,row=row,padx=10,pady=5)
+            self.results[target] = tk.Label(self.window,text="",background="#fff")
+            self.results[target].grid(column=1,row=row,padx=10,pady=5)
+        note = tk.Label(self.window,text="Other parameters at the single class defaults, from {} runs".format(len(self.surrogate.x)),background="#fff")
+        note.grid(column=0,row=len(self.surrogate.names)+len(self.results),columnspan=2,padx=10,pady=5)
+        self.update()
+
+    def update(self, *args):
+        res = self.surrogate.predict({name: value.get() for name, value in self.values.items()})
+        for target, label in self.results.items():
+            label.config(text="{:.4g} \u00b1 {:.2g}".format(*res[target]))
 
 class RootWindow:
     def __init__(self):
@@ -860,6 +915,7 @@ class RootWindow:
         self.model_config_window = None
         self.model_result_window = None
         self.model_visual_window = None
+        self.model_what_if_window = None
         self.root.option_add("*Font", "Times 12")
         self.model_type_val = tk.StringVar(self.frm)
         self.model_type_val.set(MODEL_NAMES[0])
@@ -1,11 +1,18 @@
-from math import log
+from heapq import heappop, heappush
+import numpy as np
 import pandas as pd
-import random
 
-from simpy import Environment
-from simpy import Resource
 from simpy.events import Event
 
+import analytic
+import ledger
+import occupancy
+from charging import CcCvProfile
+from power_sharing import PowerSharing
+from profiling import NULL_PROFILER, profiled
+import reneging
+from sampling import StreamSampler, get_point_seed, get_seed_record, get_seed_sequence
+
 THETA = [0.5,0.5]
 PEV_NUM = 1000
 LAM = [1, 2, 3, 4, 5, 6, 7]
@@ -26,18 +33,17 @@ C_W = 20
 T_CH_COEFFICIENT = 2
 
 class Pev:
-    def __init__(self, soc_r, i, e_c, p_max, sim: 'Simulation'):
-        self.i = i
-        soc_i = random.gauss(sim.soc_i_mu,sim.soc_i_sigma)
+    # the simulation is reached through the charging station, so a PEV only holds
+    # what its charge needs and its own record
+    __slots__ = ("e_i", "e_r", "profile", "p_ow", "record")
+
+    def __init__(self, soc_r, i, profile, sim: 'Simulation'):
+        soc_i = sim.sampler.soc_i(sim.soc_i_mu,sim.soc_i_sigma)
         soc_i = max(0.05, min(soc_r-0.1, soc_i))
         self.e_i = soc_i*sim.e_max
-        self.e_c = e_c
         self.e_r = soc_r*sim.e_max
-        self.e_max = sim.e_max
-        self.p_max = p_max
-        self.sim = sim
-        self.sim.temp_pevs.append(
-            {
+        self.profile = profile
+        self.record = {
                 "pev": i,
                 "soc_i": soc_i,
                 "charger": 0,
@@ -45,73 +51,97 @@ class Pev:
                 "start_time": None,
                 "departure_time": None,
                 "c_batt": None,
-                "blocked": False
+                "blocked": False,
+                "abandoned": False
             }
-        )
-    #! there is an assumption that e_r is never lower than e_c
-    def get_charge_time(self):
-        n1 = self.p_max/(self.e_max-self.e_c)
-        m1 = n1*self.e_c + self.p_max
-        e_i = self.e_i
-        t1 = 0.0
-        if e_i <= self.e_c:
-            t1 = (self.e_c-e_i)/self.p_max
-            e_i = self.e_c
-        t2 = log((m1-n1*e_i)/(m1-n1*self.e_r),10.0)/n1
-        p_ow = (self.p_max*t1+(2*m1-n1*(self.e_r+e_i))*t2/2.0)/(t1+t2)
-        self.sim.temp_pevs[self.i-1]["c_batt"] = self.sim.batt_deg["a"]*p_ow**2+self.sim.batt_deg["b"]*p_ow+self.sim.batt_deg["c"]
-        return (t1+t2)*60.0*self.sim.t_ch_coefficient
+        sim.temp_pevs.append(self.record)
+    
+    def get_charge_time(self, sim: 'Simulation'):
+        t_ch, self.p_ow = self.profile.get_charge(self.e_i, self.e_r)
+        self.set_mean_power(self.p_ow, sim)
+        return t_ch*60.0*sim.t_ch_coefficient
+
+    # a power cap can stretch a charge, and the battery cost with it
+    def set_mean_power(self, p_ow, sim: 'Simulation'):
+        self.record["c_batt"] = sim.batt_deg["a"]*p_ow**2+sim.batt_deg["b"]*p_ow+sim.batt_deg["c"]
     
+    # the whole stay of a PEV, charging included, is this one process
     def go_to_charging_station(self, env, charging_station: 'ChargingStation'):
+        record = self.record
         # at this point the PEV in question has just pulled up to the charging station
-        self.sim.temp_pevs[self.i-1]["arrival_time"] = env.now
+        record["arrival_time"] = env.now
         # check if there are any empty spaces near chargers or in the waiting spaces
         if len(charging_station.charger.queue) < charging_station.waiting_space_capacity:
             with charging_station.charger.request() as request:
-                yield request
-                # at this point the PEV in question is near the charger
-                for i in range(1,charging_station.charger.capacity+1):
-                    if charging_station.charger_availability[i-1]:
-                        self.sim.temp_pevs[self.i-1]["charger"] = i
-                        break
-                self.sim.temp_pevs[self.i-1]["start_time"] = env.now
-                yield env.process(charging_station.charge_pev(self))
+                if (yield from reneging.wait(env, request, charging_station.sim)):
+                    yield from self.charge(env, charging_station)
+                else:
+                    # leaving the with block takes the request out of the queue
+                    record["abandoned"] = True
         else:
             # at this point the PEV in question has no place to park so it is blocked
-            self.sim.temp_pevs[self.i-1]["blocked"] = True
+            record["blocked"] = True
+        self.leave(env, charging_station)
+
+    # the charge from the moment the PEV gets a charger
+    def charge(self, env, charging_station: 'ChargingStation'):
+        record = self.record
+        # at this point the PEV in question is near the charger
+        charger = heappop(charging_station.free_chargers)
+        record["charger"] = charger+1
+        record["start_time"] = env.now
+        sim = charging_station.sim
+        # the phase is only entered when profiling, it would cost every PEV a context manager
+        if sim.profiler.enabled:
+            with sim.profiler.phase("get_charge_time"):
+                charge_time = self.get_charge_time(sim)
+        else:
+            charge_time = self.get_charge_time(sim)
+        # wait time until PEV is charged
+        if charging_station.power_sharing is None:
+            yield env.timeout(charge_time)
+        else:
+            yield charging_station.power_sharing.charge(self, charge_time)
+        heappush(charging_station.free_chargers, charger)
+
+    def leave(self, env, charging_station: 'ChargingStation'):
         # at this point the PEV in question is charged and is leaving the charging station
-        self.sim.temp_pevs[self.i-1]["departure_time"] = env.now
-        if not (charging_station.admission or charging_station.charger.count):
-            self.sim.stop_event.succeed()
+        self.record["departure_time"] = env.now
+        # with a single charger the released request is still counted as queued here
+        if not (charging_station.admission or charging_station.charger.count or charging_station.charger.queue):
+            charging_station.sim.stop_event.succeed()
 
 class ChargingStation:
-    def __init__(self, env, s, r):
+    def __init__(self, env, s, r, sim: 'Simulation'):
         self.env = env
-        self.charger = Resource(env, s)
-        self.charger_availability = list()
-        for _ in range(s):
-            self.charger_availability.append(True)
+        self.sim = sim
+        self.charger = reneging.ChargerResource(env, s)
+        # indices of the free chargers, the lowest one is taken first
+        self.free_chargers = list(range(s))
         self.waiting_space_capacity = r
         self.admission = True
-    
-    def charge_pev(self, pev: Pev):
-        for i in range(self.charger.capacity):
-            if self.charger_availability[i]:
-                self.charger_availability[i] = False
-                occupied_charger = i
-                break
-        # wait time until PEV is charged
-        yield self.env.timeout(pev.get_charge_time())
-        self.charger_availability[occupied_charger] = True
+        # with a site power cap the chargers share it and the charges are run by power_sharing
+        self.power_sharing = PowerSharing(env, sim, sim.power_cap, sim.power_policy) if sim.power_cap is not None else None
 
 # this is the main class of the simulation
 # when it is initialized, the simulation is run automatically
 
 class Simulation:
-    def __init__(self,theta,pev_num, lam, s, r, soc_r, batt_deg, reward, c_w, t_ch_coefficient, soc_i_mu,soc_i_sigma,p_max, e_max,e_c):
+    def __init__(self,theta,pev_num, lam, s, r, soc_r, batt_deg, reward, c_w, t_ch_coefficient, soc_i_mu,soc_i_sigma,p_max, e_max,e_c,profiler=None,horizon=None,sampler=None,charging_profiles=None,power_cap=None,power_policy="equal",seed=None,patience=None):
+        self.profiler = profiler or NULL_PROFILER
+        self.sampler = sampler
+        # an int or a SeedSequence, e.g. one spawned for every replication
+        self.seed_sequence = get_seed_sequence(seed) if sampler is None else None
+        self.seed_record = None
+        self.horizon = horizon
+        # site limit in kW on the power all chargers draw together, None for no limit
+        self.power_cap = power_cap
+        self.power_policy = power_policy
+        # mean time in minutes a PEV waits for a charger before it leaves, None to wait forever
+        self.patience = patience
         self.lam = lam
         self.theta = theta
-        self.pev_num = [pev_num*theta[0],pev_num*theta[1]]
+        self.pev_num = [pev_num*theta[0],pev_num*theta[1]] if pev_num is not None else None
         self.s = s 
         self.r = r
         self.soc_r = soc_r
@@ -124,61 +154,115 @@ class Simulation:
         self.reward = reward
         self.c_w = c_w
         self.t_ch_coefficient = t_ch_coefficient
+        # the charging curve of every class, by default the CC/CV curves of p_max and e_c
+        self.charging_profiles = charging_profiles or [CcCvProfile(p_max[k], e_max, e_c[k]) for k in range(len(p_max))]
         self.pevs = list()
         self.pevs.append(dict())
         self.pevs.append(dict())
         self.current_pev_class = 0
-        for lam in self.lam:
-            self.env = Environment()
+        for k, lam in enumerate(self.lam):
+            self.set_sampler((0, k))
+            self.env = self.profiler.get_environment()
             self.temp_pevs = list()
             self.temp_lam = lam
             self.stop_event = Event(self.env)
             self.env.process(self.run_charging_station())
-            self.env.run(self.stop_event)
-            self.temp_pevs = pd.DataFrame(self.temp_pevs)
-            self.temp_pevs.set_index("pev", inplace = True)
+            with self.profiler.sweep_point((self.current_pev_class, lam), self):
+                self.env.run(self.stop_event)
+            with self.profiler.phase("dataframe"):
+                self.temp_pevs = pd.DataFrame(self.temp_pevs)
+                self.temp_pevs.set_index("pev", inplace = True)
+                if self.seed_record is not None:
+                    self.temp_pevs.attrs["seed"] = self.seed_record
             self.pevs[0][lam] = self.temp_pevs
         
         self.current_pev_class = 1
-        for lam in self.lam:
-            self.env = Environment()
+        for k, lam in enumerate(self.lam):
+            self.set_sampler((1, k))
+            self.env = self.profiler.get_environment()
             self.temp_pevs = list()
             self.temp_lam = lam
             self.stop_event = Event(self.env)
             self.env.process(self.run_charging_station())
-            self.env.run(self.stop_event)
-            self.temp_pevs = pd.DataFrame(self.temp_pevs)
-            self.temp_pevs.set_index("pev", inplace = True)
+            with self.profiler.sweep_point((self.current_pev_class, lam), self):
+                self.env.run(self.stop_event)
+            with self.profiler.phase("dataframe"):
+                self.temp_pevs = pd.DataFrame(self.temp_pevs)
+                self.temp_pevs.set_index("pev", inplace = True)
+                if self.seed_record is not None:
+                    self.temp_pevs.attrs["seed"] = self.seed_record
             self.pevs[1][lam] = self.temp_pevs
 
-    # process function for the simulation to run until a specified number of PEVs is charged
+    # without a sampler of its own every sweep point draws from generators spawned from the
+    # seed for it, and the seed is kept in the attrs of its frame
+    def set_sampler(self, point):
+        if self.seed_sequence is not None:
+            seed_sequence = get_point_seed(self.seed_sequence, point)
+            self.sampler = StreamSampler(seed_sequence)
+            self.seed_record = get_seed_record(seed_sequence)
+
+    # process function for the simulation to run until a specified number of PEVs has arrived
+    # or the horizon is reached, after that only the PEVs already at the station are simulated
     def run_charging_station(self):
-        charging_station = ChargingStation(self.env, self.s, self.r[self.current_pev_class])
+        charging_station = ChargingStation(self.env, self.s, self.r[self.current_pev_class], self)
         i = 0
         while True:
             # wait time until next PEV has to be introduced to the simulation
-            yield self.env.timeout(random.expovariate(self.temp_lam/60))
+            interarrival = self.sampler.interarrival(self.temp_lam/60)
+            if self.horizon is not None and self.env.now+interarrival > self.horizon*60.0:
+                # the next PEV would come after the horizon, so no arrival is scheduled for it
+                yield self.env.timeout(self.horizon*60.0-self.env.now)
+                charging_station.admission = False
+                if not (charging_station.charger.count or charging_station.charger.queue):
+                    self.stop_event.succeed()
+                return
+            yield self.env.timeout(interarrival)
             i += 1
-            if charging_station.admission:
-                # create a new PEV in the simulation and send it to the charging station
-                pev = Pev(self.soc_r, i, self.e_c[self.current_pev_class], self.p_max[self.current_pev_class], self)
-                self.env.process(pev.go_to_charging_station(self.env,charging_station))
-            if i >= self.pev_num[self.current_pev_class]:
+            # create a new PEV in the simulation and send it to the charging station
+            pev = Pev(self.soc_r, i, self.charging_profiles[self.current_pev_class], self)
+            self.env.process(pev.go_to_charging_station(self.env,charging_station))
+            if self.pev_num is not None and i >= self.pev_num[self.current_pev_class]:
+                # the last PEV stops the simulation when it leaves
                 charging_station.admission = False
+                return
     
-    def get_mean_charging_time(self):
+    # charging time moments of every class by quadrature over the initial SoC, for the
+    # numerical getters, which evaluate the whole lam vector at once
+    def get_charge_moments(self):
+        res = list()
+        for profile in self.charging_profiles:
+            temp1 = analytic.get_charge_moments(profile, [self.soc_r], self.e_max, self.soc_i_mu, self.soc_i_sigma, self.batt_deg, self.t_ch_coefficient)
+            res.append({name: float(values[0]) for name, values in temp1.items()})
+        return res
+
+    # every class has its own station, an M/G/s/(s+r) queue of its own
+    def get_queue(self, i, moments):
+        lam = np.asarray(self.lam, dtype=float)
+        ro = moments["mean_charging_time"]*lam/(60*self.s)
+        p_k = analytic.get_blocking_probability(self.s, self.r[i], ro, moments["cv_charging_time"])
+        mean_t_w = analytic.get_mean_waiting_time(lam, self.s, self.r[i], ro, moments["cv_charging_time"])
+        return p_k, mean_t_w
+
+    @profiled
+    def get_mean_charging_time(self, numerical=False):
         res = list()
+        if numerical:
+            moments = self.get_charge_moments()
         for i in range(2):
             temp1 = dict()
             for lam in self.lam:
-                temp2 = self.pevs[i][lam][self.pevs[i][lam]["blocked"]==False]
-                temp1[lam] = (temp2["departure_time"]-temp2["start_time"]).mean()
+                if numerical:
+                    temp1[lam] = moments[i]["mean_charging_time"]
+                else:
+                    temp2 = self.pevs[i][lam][self.pevs[i][lam]["blocked"]==False]
+                    temp1[lam] = (temp2["departure_time"]-temp2["start_time"]).mean()
             res.append(temp1)
         return res
     
-    def get_traffic_intensity(self):
+    @profiled
+    def get_traffic_intensity(self, numerical=False):
         res = list()
-        mu_over_1 = self.get_mean_charging_time()
+        mu_over_1 = self.get_mean_charging_time(numerical)
         for i in range(2):
             temp = dict()
             for lam in self.lam:
@@ -186,37 +270,114 @@ class Simulation:
             res.append(temp)
         return res
     
-    def get_blocking_probability(self):
+    @profiled
+    def get_blocking_probability(self, numerical=False):
+        res = list()
+        if numerical:
+            moments = self.get_charge_moments()
+        for i in range(2):
+            temp1 = dict()
+            if numerical:
+                p_k = self.get_queue(i, moments[i])[0]
+                for k, lam in enumerate(self.lam):
+                    temp1[lam] = float(p_k[k])
+            else:
+                for lam in self.lam:
+                    temp1[lam] = len(self.pevs[i][lam][self.pevs[i][lam]["blocked"]==True].index)/len(self.pevs[i][lam].index)
+            res.append(temp1)
+        return res
+
+    # share of the arrivals that got a waiting space but left before a charger was free
+    @profiled
+    def get_abandonment_probability(self):
         res = list()
         for i in range(2):
             temp1 = dict()
             for lam in self.lam:
-                temp1[lam] = len(self.pevs[i][lam][self.pevs[i][lam]["blocked"]==True].index)/len(self.pevs[i][lam].index)
+                temp1[lam] = len(self.pevs[i][lam][self.pevs[i][lam]["abandoned"]==True].index)/len(self.pevs[i][lam].index)
             res.append(temp1)
         return res
     
-    def get_mean_waiting_time(self):
+    @profiled
+    def get_mean_waiting_time(self, numerical=False):
         res = list()
+        if numerical:
+            moments = self.get_charge_moments()
         for i in range(2):
             temp1 = dict()
-            for lam in self.lam:
-                temp2 = self.pevs[i][lam][self.pevs[i][lam]["blocked"]==False]
-                temp1[lam] = (temp2["start_time"]-temp2["arrival_time"]).mean()
+            if numerical:
+                mean_t_w = self.get_queue(i, moments[i])[1]
+                for k, lam in enumerate(self.lam):
+                    temp1[lam] = float(mean_t_w[k])
+            else:
+                for lam in self.lam:
+                    temp2 = self.pevs[i][lam][self.pevs[i][lam]["blocked"]==False]
+                    temp1[lam] = (temp2["start_time"]-temp2["arrival_time"]).mean()
             res.append(temp1)
         return res
     
-    def get_system_revenue(self):
+    @profiled
+    def get_system_revenue(self, numerical=False):
         res = list()
-        p_k = self.get_blocking_probability()
-        mean_t_w = self.get_mean_waiting_time()
-        mean_t_ch = self.get_mean_charging_time()
+        p_k = self.get_blocking_probability(numerical)
+        mean_t_w = self.get_mean_waiting_time(numerical)
+        mean_t_ch = self.get_mean_charging_time(numerical)
+        if numerical:
+            moments = self.get_charge_moments()
+        else:
+            p_a = self.get_abandonment_probability()
         for i in range(2):
             temp1 = dict()
             reward = self.reward["m"]*self.soc_r+self.reward["n"]
             for lam in self.lam:
-                temp2 = self.pevs[i][lam][self.pevs[i][lam]["blocked"]==False]
-                mean_c_batt = temp2["c_batt"].mean()
-                temp1[lam] = self.theta[i]*lam*(1-p_k[i][lam])*(reward-self.c_w*mean_t_w[i][lam]/60.0-mean_c_batt*mean_t_ch[i][lam]/60.0)
+                if numerical:
+                    mean_c_batt = moments[i]["mean_c_batt"]
+                else:
+                    temp2 = self.pevs[i][lam][self.pevs[i][lam]["blocked"]==False]
+                    mean_c_batt = temp2["c_batt"].mean()
+                # the queue of the numerical getters has no reneging
+                abandoned = 0.0 if numerical else p_a[i][lam]
+                temp1[lam] = self.theta[i]*lam*(1-p_k[i][lam]-abandoned)*(reward-self.c_w*mean_t_w[i][lam]/60.0-mean_c_batt*mean_t_ch[i][lam]/60.0)
+                if abandoned > 0:
+                    # a PEV that gave up pays no reward, but its wait still costs
+                    temp3 = temp2[temp2["abandoned"]==True]
+                    temp1[lam] -= self.theta[i]*lam*abandoned*self.c_w*(temp3["departure_time"]-temp3["arrival_time"]).mean()/60.0
+            res.append(temp1)
+        return res
+
+    # time weighted queue length, PEVs at the station and utilization of every charger
+    @profiled
+    def get_occupancy(self, end=None):
+        res = list()
+        for i in range(2):
+            temp1 = dict()
+            for lam in self.lam:
+                temp1[lam] = occupancy.get_occupancy(self.pevs[i][lam], self.s, end)
+            res.append(temp1)
+        return res
+
+    # the revenue, waiting penalty and battery cost of every PEV
+    @profiled
+    def get_revenue_ledger(self):
+        res = list()
+        reward = self.reward["m"]*self.soc_r+self.reward["n"]
+        for i in range(2):
+            temp1 = dict()
+            for lam in self.lam:
+                temp1[lam] = ledger.get_ledger(self.pevs[i][lam], reward, self.c_w)
+            res.append(temp1)
+        return res
+
+    # percentiles, CVaR of the waiting penalty and revenue per charger of the ledger, every
+    # class weighted with theta like in get_system_revenue
+    @profiled
+    def get_revenue_distribution(self, percentiles=ledger.PERCENTILES, alpha=ledger.ALPHA):
+        res = list()
+        ledgers = self.get_revenue_ledger()
+        for i in range(2):
+            temp1 = dict()
+            for lam in self.lam:
+                temp1[lam] = ledger.get_distribution(ledgers[i][lam], self.theta[i]*lam, percentiles, alpha)
             res.append(temp1)
         return res
 
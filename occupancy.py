@@ -0,0 +1,84 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+def get_column(pevs, name):
+    return pevs[name].to_numpy(dtype=float, na_value=np.nan)
+
+# time spent at every level of a count that changes by deltas at times, over [0, end],
+# from a sweep over the events sorted by time; the count is 0 before the first event
+def get_level_times(times, deltas, end):
+    order = np.argsort(times, kind="stable")
+    times = np.minimum(times[order], end)
+    levels = np.cumsum(deltas[order])
+    durations = np.diff(np.append(times, end))
+    res = np.bincount(levels, weights=durations, minlength=int(levels.max(initial=0))+1)
+    res[0] += times[0] if len(times) else end
+    return res
+
+# time weighted statistics of a finished run from its PEVs, without replaying it: the
+# number of waiting PEVs and of PEVs at the station and the share of time at every value
+# of them, the mean number of busy chargers and the busy share of every charger; the
+# window is [0, end], by default up to the last arrival, as after it the station only
+# empties; every charge is on the charger of its record from its start to its departure,
+# a PEV that gave up waiting waits until its departure and has no charge
+def get_occupancy(pevs, s, end=None):
+    admitted = ~pevs["blocked"].to_numpy(dtype=bool)
+    arrival = get_column(pevs, "arrival_time")
+    start = get_column(pevs, "start_time")[admitted]
+    departure = get_column(pevs, "departure_time")[admitted]
+    charger = pevs["charger"].to_numpy(dtype=np.int64)[admitted]
+    abandoned = pevs["abandoned"].to_numpy(dtype=bool)[admitted]
+    # the wait of every PEV ends at its start or, if it gave up, at its departure
+    waited = np.where(abandoned, departure, start)
+    if end is None:
+        end = float(arrival.max()) if len(arrival) else 0.0
+    arrival = arrival[admitted]
+    n = len(arrival)
+    ones = np.ones(n, dtype=np.int64)
+    waiting = get_level_times(np.concatenate((arrival, waited)), np.concatenate((ones, -ones)), end)
+    at_station = get_level_times(np.concatenate((arrival, departure)), np.concatenate((ones, -ones)), end)
+    # the part of every charge inside the window
+    busy = np.where(abandoned, 0.0, np.clip(np.minimum(departure, end)-np.minimum(start, end), 0.0, None))
+    per_charger = np.bincount(charger, weights=busy, minlength=s+1)[1:]
+    if end <= 0.0:
+        end = float("nan")
+    return {
+        "mean_queue_length": float(np.arange(len(waiting))@waiting/end),
+        "queue_length_distribution": pd.Series(waiting/end, index=pd.Index(np.arange(len(waiting)), name="waiting")),
+        "mean_pevs": float(np.arange(len(at_station))@at_station/end),
+        "pevs_distribution": pd.Series(at_station/end, index=pd.Index(np.arange(len(at_station)), name="pevs")),
+        "mean_busy_chargers": float(busy.sum()/end),
+        "utilization": float(busy.sum()/(s*end)),
+        "charger_utilization": pd.Series(per_charger/end, index=pd.Index(np.arange(1, len(per_charger)+1), name="charger"))
+    }
+
+if __name__ == "__main__":
+    import single_class
+
+    pev_num = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+    sim = single_class.Simulation(
+        pev_num=pev_num,
+        lam=single_class.LAM,
+        s=single_class.S,
+        r=single_class.R,
+        soc_rs=[0.9],
+        soc_i_p=single_class.SOC_I_P,
+        p_max=single_class.P_MAX,
+        e_max=single_class.E_MAX,
+        e_c=single_class.E_C,
+        batt_deg=single_class.BATT_DEG,
+        reward=single_class.REWARD,
+        c_w=single_class.C_W,
+        t_ch_coefficient=single_class.T_CH_COEFFICIENT
+    )
+    t = time.perf_counter()
+    res = sim.get_occupancy()[0.9]
+    print("{} PEVs in {:.3f} s".format(pev_num, time.perf_counter()-t))
+    # by Little's law the mean queue length is the admitted rate times the mean wait
+    little = single_class.LAM*(1.0-sim.get_blocking_probability()[0.9])*sim.get_mean_waiting_time()[0.9]/60.0
+    print("mean queue length {:.4f}, by Little's law {:.4f}".format(res["mean_queue_length"], little))
+    print(res["queue_length_distribution"])
+    print(res["charger_utilization"])
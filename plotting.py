@@ -0,0 +1,133 @@
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.ticker import AutoLocator
+
+# above these sizes a sweep is thinned out before it is handed to matplotlib
+MAX_LINE_POINTS = 2000
+MAX_STEMS = 200
+MAX_TICKS = 12
+STEM_BOTTOM = -1
+# the y axis only grows past, or shrinks below, this much headroom
+Y_HEADROOM = 1.25
+
+# keeps the minimum and maximum of every bucket so peaks survive the thinning
+def decimate_line(x, y, max_points=MAX_LINE_POINTS):
+    if len(x) <= max_points:
+        return x, y
+    buckets = max_points//2
+    size = -(-len(x)//buckets)
+    padded = np.full(buckets*size, np.nan)
+    padded[:len(y)] = y
+    padded = padded.reshape(buckets, size)
+    missing = np.isnan(padded)
+    offsets = np.arange(buckets)*size
+    low = offsets+np.argmin(np.where(missing, np.inf, padded), axis=1)
+    high = offsets+np.argmax(np.where(missing, -np.inf, padded), axis=1)
+    keep = np.unique(np.concatenate((low, high)))
+    keep = keep[keep < len(x)]
+    return x[keep], y[keep]
+
+def decimate_stems(x, y, max_stems=MAX_STEMS):
+    if len(x) <= max_stems:
+        return x, y
+    stride = -(-len(x)//max_stems)
+    return x[::stride], y[::stride]
+
+# one axes of a results window, the artists are created once and updated in place
+class SweepPlot:
+    def __init__(self, ax, xlabel, ylabel, line_num=1, stem=False, legend=None):
+        self.ax = ax
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        self.lines = [ax.plot([], [], color="C"+str(i), animated=True)[0] for i in range(line_num)]
+        self.markers = None
+        self.stems = None
+        if stem:
+            self.markers = ax.plot([], [], "C3o", animated=True)[0]
+            self.stems = LineCollection([], colors="C3", animated=True)
+            ax.add_collection(self.stems)
+        if legend:
+            handles = self.lines+([self.markers] if stem else [])
+            ax.legend(handles, legend)
+        self.xlim = None
+        self.ylim = None
+        self.xticks = None
+
+    def get_artists(self):
+        return self.lines+([self.markers, self.stems] if self.stems else [])
+
+    # returns True when the axes limits or ticks moved, which needs a full redraw
+    def update(self, x, ys, stem_y=None):
+        x = np.asarray(x, dtype=float)
+        top = 0.0
+        for line, y in zip(self.lines, ys):
+            y = np.asarray(y, dtype=float)
+            line.set_data(*decimate_line(x, y))
+            if np.any(np.isfinite(y)):
+                top = max(top, np.nanmax(y[np.isfinite(y)]))
+        if self.stems is not None and stem_y is not None:
+            stem_x, stem_y = decimate_stems(x, np.asarray(stem_y, dtype=float))
+            self.markers.set_data(stem_x, stem_y)
+            segments = np.empty((len(stem_x), 2, 2))
+            segments[:, :, 0] = stem_x[:, None]
+            segments[:, 0, 1] = STEM_BOTTOM
+            segments[:, 1, 1] = stem_y
+            self.stems.set_segments(segments)
+            if np.any(np.isfinite(stem_y)):
+                top = max(top, np.nanmax(stem_y[np.isfinite(stem_y)]))
+        changed = False
+        span = x[-1]-x[0] if len(x) > 1 else 1.0
+        xlim = (x[0]-0.05*span, x[-1])
+        if xlim != self.xlim:
+            self.xlim = xlim
+            self.ax.set_xlim(*xlim)
+            changed = True
+        if top <= 0.0:
+            top = 1.0
+        if self.ylim is None or top > self.ylim[1] or top*Y_HEADROOM**2 < self.ylim[1]:
+            self.ylim = (0.0, top*Y_HEADROOM)
+            self.ax.set_ylim(*self.ylim)
+            changed = True
+        xticks = tuple(x) if len(x) <= MAX_TICKS else None
+        if xticks != self.xticks:
+            self.xticks = xticks
+            if xticks is None:
+                self.ax.xaxis.set_major_locator(AutoLocator())
+            else:
+                self.ax.set_xticks(xticks)
+            changed = True
+        return changed
+
+# blits the updated artists over cached axes backgrounds, the whole figure is only
+# drawn again when some axes changed its limits or the window was resized
+class ResultFigure:
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.plots = list()
+        self.backgrounds = None
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+
+    def add(self, *args, **kwargs):
+        plot = SweepPlot(*args, **kwargs)
+        self.plots.append(plot)
+        return plot
+
+    def on_draw(self, event):
+        self.backgrounds = [self.canvas.copy_from_bbox(plot.ax.bbox) for plot in self.plots]
+        self.draw_artists()
+
+    def draw_artists(self):
+        figure = self.canvas.figure
+        for plot in self.plots:
+            for artist in plot.get_artists():
+                figure.draw_artist(artist)
+
+    def draw(self, full=False):
+        if full or self.backgrounds is None:
+            self.canvas.draw()
+            return
+        for plot, background in zip(self.plots, self.backgrounds):
+            self.canvas.restore_region(background)
+            for artist in plot.get_artists():
+                self.canvas.figure.draw_artist(artist)
+            self.canvas.blit(plot.ax.bbox)
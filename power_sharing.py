@@ -0,0 +1,258 @@
+from heapq import heappop, heappush
+from itertools import count
+
+from simpy.events import Event
+
+# completions this close to the current time are treated as due
+EPS = 1e-9
+
+# the sessions of one peak power, they always run at the same speed, so one virtual time
+# and a heap of finish tags, the virtual time at the start plus the work, are enough
+class PeakGroup:
+    def __init__(self):
+        self.virtual_time = 0.0
+        self.speed = 1.0
+        self.tags = list()
+
+# the site limit is split equally between the active sessions by water filling: a session
+# whose peak is below the fair share gets its peak, the rest of the power is shared
+# equally by the others, each of which follows its curve at the fraction share/peak of
+# its speed; sessions of the same peak move together, so the work is kept per peak power
+# and an event costs O(log s) plus the number of different peaks
+class EqualShare:
+    def __init__(self, power_cap):
+        self.power_cap = power_cap
+        self.updated = 0.0
+        self.groups = dict()
+        self.peaks = dict()
+
+    def advance(self, now):
+        for group in self.groups.values():
+            group.virtual_time += group.speed*(now-self.updated)
+        self.updated = now
+
+    def set_speeds(self):
+        power = self.power_cap
+        count = len(self.peaks)
+        share = None
+        for peak in sorted(self.groups):
+            group = self.groups[peak]
+            if share is None and peak*count <= power:
+                group.speed = 1.0
+                power -= peak*len(group.tags)
+                count -= len(group.tags)
+            else:
+                if share is None:
+                    share = power/count
+                group.speed = share/peak
+
+    def start(self, now, session, work, peak, priority):
+        self.advance(now)
+        group = self.groups.setdefault(peak, PeakGroup())
+        heappush(group.tags, (group.virtual_time+work, session))
+        self.peaks[session] = peak
+        self.set_speeds()
+
+    def pop_completed(self, now):
+        self.advance(now)
+        res = list()
+        for peak, group in list(self.groups.items()):
+            while group.tags and group.tags[0][0] <= group.virtual_time+EPS*max(1.0, group.virtual_time):
+                _, session = heappop(group.tags)
+                del self.peaks[session]
+                res.append(session)
+            if not group.tags:
+                del self.groups[peak]
+        if res:
+            self.set_speeds()
+        return res
+
+    def get_next_completion(self, now):
+        res = None
+        for group in self.groups.values():
+            completion = now+max(0.0, group.tags[0][0]-group.virtual_time)/group.speed
+            if res is None or completion < res:
+                res = completion
+        return res
+
+class Session:
+    __slots__ = ("key", "peak", "work", "speed", "updated", "place", "served", "timing")
+
+    def __init__(self, key, peak, work, now):
+        self.key = key
+        self.peak = peak
+        # minutes of charging at full power that are left
+        self.work = work
+        self.speed = 0.0
+        self.updated = now
+        self.place = 0
+        self.served = False
+        self.timing = 0
+
+# the sessions with the lowest SoC charge at full power as long as their peak powers fit
+# under the site limit, the next one gets what is left and the others wait; the served
+# sessions are in a heap with the worst one on top and the waiting ones in a heap with
+# the best one on top, and entries of sessions that moved, changed speed or finished are
+# skipped when they come up
+class SocPriority:
+    def __init__(self, power_cap):
+        self.power_cap = power_cap
+        self.used = 0.0
+        self.served_num = 0
+        self.served = list()
+        self.waiting = list()
+        self.completions = list()
+        self.sessions = dict()
+        self.fractional = None
+
+    def set_speed(self, now, session, speed):
+        state = self.sessions[session]
+        if state.speed == speed:
+            return
+        state.work = max(0.0, state.work-state.speed*(now-state.updated))
+        state.updated = now
+        state.speed = speed
+        state.timing += 1
+        if speed > 0.0:
+            heappush(self.completions, (now+state.work/speed, state.timing, session))
+
+    def place(self, session, served):
+        state = self.sessions[session]
+        state.place += 1
+        state.served = served
+        if served:
+            self.used += state.peak
+            self.served_num += 1
+            heappush(self.served, (tuple(-k for k in state.key), state.place, session))
+        else:
+            heappush(self.waiting, (state.key, state.place, session))
+
+    def get_top(self, heap):
+        while heap:
+            _, place, session = heap[0]
+            state = self.sessions.get(session)
+            if state is not None and state.place == place:
+                return session
+            heappop(heap)
+        return None
+
+    def demote(self, now, session):
+        heappop(self.served)
+        self.used -= self.sessions[session].peak
+        self.served_num -= 1
+        self.place(session, False)
+        self.set_speed(now, session, 0.0)
+
+    def promote(self, now, session):
+        heappop(self.waiting)
+        self.place(session, True)
+        self.set_speed(now, session, 1.0)
+
+    def rebalance(self, now):
+        sessions = self.sessions
+        limit = self.power_cap*(1.0+EPS)
+        worst = self.get_top(self.served)
+        best = self.get_top(self.waiting)
+        # a session with a lower SoC takes the place of the worst served one
+        while worst is not None and best is not None and sessions[best].key < sessions[worst].key:
+            self.demote(now, worst)
+            self.promote(now, best)
+            worst = self.get_top(self.served)
+            best = self.get_top(self.waiting)
+        while worst is not None and self.used > limit:
+            self.demote(now, worst)
+            worst = self.get_top(self.served)
+        best = self.get_top(self.waiting)
+        while best is not None and self.used+sessions[best].peak <= limit:
+            self.promote(now, best)
+            best = self.get_top(self.waiting)
+        if self.served_num == 0:
+            self.used = 0.0
+        # whatever power is left goes to the best waiting session
+        fractional = self.fractional
+        if fractional is not None and fractional != best and fractional in sessions and not sessions[fractional].served:
+            self.set_speed(now, fractional, 0.0)
+        self.fractional = best
+        if best is not None:
+            self.set_speed(now, best, min(1.0, max(0.0, self.power_cap-self.used)/sessions[best].peak))
+
+    def start(self, now, session, work, peak, priority):
+        self.sessions[session] = Session((priority, session), peak, work, now)
+        self.place(session, False)
+        self.rebalance(now)
+
+    def pop_completed(self, now):
+        res = list()
+        while self.completions and self.completions[0][0] <= now+EPS*max(1.0, now):
+            _, timing, session = heappop(self.completions)
+            state = self.sessions.get(session)
+            if state is None or state.timing != timing:
+                continue
+            if state.served:
+                self.used -= state.peak
+                self.served_num -= 1
+            del self.sessions[session]
+            res.append(session)
+        if res:
+            self.rebalance(now)
+        return res
+
+    def get_next_completion(self, now):
+        while self.completions:
+            _, timing, session = self.completions[0]
+            state = self.sessions.get(session)
+            if state is not None and state.timing == timing:
+                return self.completions[0][0]
+            heappop(self.completions)
+        return None
+
+POLICIES = {"equal": EqualShare, "soc_priority": SocPriority}
+
+# runs the charges of a power capped station on top of simpy: a charge is an event that
+# succeeds when its session is done, and a single pending timeout wakes the station at
+# the next completion; a timeout is only added when the next completion moves earlier,
+# a later one finds nothing due and sets the next
+class PowerSharing:
+    def __init__(self, env, sim, power_cap, policy="equal"):
+        if policy not in POLICIES:
+            raise ValueError("unknown power sharing policy: "+str(policy))
+        # a cap of zero would never finish a charge, the shares are fractions of the cap
+        if not power_cap > 0:
+            raise ValueError("the power cap has to be positive, not "+str(power_cap))
+        self.env = env
+        self.sim = sim
+        self.policy = POLICIES[policy](power_cap)
+        self.sessions = dict()
+        self.ids = count()
+        self.scheduled = None
+
+    # work is the charging time in minutes at the full power of the curve
+    def charge(self, pev, work):
+        event = Event(self.env)
+        session = next(self.ids)
+        self.sessions[session] = (pev, event, self.env.now, work)
+        self.policy.start(self.env.now, session, work, pev.profile.peak_power, pev.e_i)
+        self.schedule()
+        return event
+
+    def schedule(self):
+        next_completion = self.policy.get_next_completion(self.env.now)
+        if next_completion is None:
+            return
+        if self.scheduled is None or next_completion < self.scheduled-EPS*max(1.0, self.scheduled):
+            self.scheduled = next_completion
+            timeout = self.env.timeout(max(0.0, next_completion-self.env.now))
+            timeout.callbacks.append(self.wake)
+
+    def wake(self, event):
+        if self.scheduled is not None and self.env.now < self.scheduled-EPS*max(1.0, self.scheduled):
+            # an older timeout, the pending one is earlier
+            return
+        self.scheduled = None
+        for session in self.policy.pop_completed(self.env.now):
+            pev, event, start, work = self.sessions.pop(session)
+            duration = self.env.now-start
+            # the curve was followed more slowly, so the mean power drops with it
+            pev.set_mean_power(pev.p_ow*work/duration if duration > 0.0 else pev.p_ow, self.sim)
+            event.succeed()
+        self.schedule()
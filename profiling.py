@@ -0,0 +1,130 @@
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from time import perf_counter
+import json
+import tracemalloc
+
+from simpy import Environment
+
+# an environment that counts every event it processes
+class CountingEnvironment(Environment):
+    def __init__(self, initial_time=0):
+        super().__init__(initial_time)
+        self.events_processed = 0
+
+    def step(self):
+        self.events_processed += 1
+        super().step()
+
+# used when profiling is off, every hook is a no-op
+class NullProfiler:
+    enabled = False
+
+    def phase(self, name):
+        return nullcontext()
+
+    def sweep_point(self, point, sim):
+        return nullcontext()
+
+    def get_environment(self, initial_time=0):
+        return Environment(initial_time)
+
+NULL_PROFILER = NullProfiler()
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.phases = dict()
+        self.sweep_points = list()
+        self.created = perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter()-start
+            if name not in self.phases:
+                self.phases[name] = {"calls": 0, "wall_time": 0.0}
+            self.phases[name]["calls"] += 1
+            self.phases[name]["wall_time"] += elapsed
+
+    def get_environment(self, initial_time=0):
+        return CountingEnvironment(initial_time)
+
+    # records wall time, events, PEVs and peak memory of one run of a sweep
+    @contextmanager
+    def sweep_point(self, point, sim):
+        started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+        start = perf_counter()
+        try:
+            with self.phase("run"):
+                yield
+        finally:
+            elapsed = perf_counter()-start
+            peak_memory = None
+            retained_memory = None
+            if self.trace_memory:
+                retained_memory, peak_memory = tracemalloc.get_traced_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+            events = getattr(sim.env, "events_processed", None)
+            pevs = len(sim.temp_pevs)
+            self.sweep_points.append({
+                "point": point,
+                "wall_time": elapsed,
+                "events": events,
+                "events_per_sec": events/elapsed if events is not None and elapsed > 0 else None,
+                "pevs": pevs,
+                "pevs_per_sec": pevs/elapsed if elapsed > 0 else None,
+                "peak_memory": peak_memory,
+                "retained_memory": retained_memory
+            })
+
+    def report(self):
+        events = sum(point["events"] or 0 for point in self.sweep_points)
+        run_time = sum(point["wall_time"] for point in self.sweep_points)
+        return {
+            "total_wall_time": perf_counter()-self.created,
+            "events": events,
+            "events_per_sec": events/run_time if run_time > 0 else None,
+            "pevs": sum(point["pevs"] for point in self.sweep_points),
+            "phases": {name: dict(phase) for name, phase in self.phases.items()},
+            "sweep_points": [dict(point) for point in self.sweep_points]
+        }
+
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+    def __str__(self):
+        report = self.report()
+        lines = ["{:<32}{:>8}{:>12}".format("phase", "calls", "time (s)")]
+        for name, phase in sorted(report["phases"].items(), key=lambda item: -item[1]["wall_time"]):
+            lines.append("{:<32}{:>8}{:>12.4f}".format(name, phase["calls"], phase["wall_time"]))
+        lines.append("{:<16}{:>12}{:>14}{:>14}{:>14}".format("point", "events", "events/s", "PEVs/s", "peak (MB)"))
+        for point in report["sweep_points"]:
+            lines.append("{:<16}{:>12}{:>14.0f}{:>14.0f}{:>14}".format(
+                str(point["point"]),
+                point["events"] or 0,
+                point["events_per_sec"] or 0,
+                point["pevs_per_sec"] or 0,
+                "-" if point["peak_memory"] is None else "{:.2f}".format(point["peak_memory"]/2**20)
+            ))
+        return "\n".join(lines)
+
+# times a Simulation getter under its own name when the simulation is profiled
+def profiled(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.profiler.phase(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,191 @@
+from heapq import heappop, heappush
+import sys
+import time
+
+import numpy as np
+
+# trajectories started at every level
+EFFORT = 1000
+REPLICATIONS = 10
+# plain regenerative cycles, for the arrivals per cycle and the first level
+CYCLES = 2000
+BLOCK = 4096
+SEED = 458
+
+# charging times of one soc_r drawn in blocks the way Pev.get_charge_time computes them
+class ChargeTimes:
+    def __init__(self, sim, soc_r, rng, block=BLOCK):
+        self.profile = sim.charging_profile
+        self.soc_r = soc_r
+        self.e_max = sim.e_max
+        self.mu = sim.soc_i_mu
+        self.sigma = sim.soc_i_sigma
+        self.t_ch_coefficient = sim.t_ch_coefficient
+        self.rng = rng
+        self.block = block
+        self.times = list()
+
+    def next(self):
+        if not self.times:
+            soc_i = np.clip(self.rng.normal(self.mu, self.sigma, self.block), 0.05, self.soc_r-0.1)
+            soc_i = np.maximum(soc_i, 0.05)
+            t_ch = self.profile.get_charges(soc_i*self.e_max, self.soc_r*self.e_max)[0]
+            self.times = (t_ch*60.0*self.t_ch_coefficient).tolist()
+        return self.times.pop()
+
+# the station reduced to what its future depends on: the times the busy chargers finish
+# and the number of waiting PEVs, as arrivals are Poisson; a state can be copied and run
+# on from the copy, which the splitting needs and simpy can not do
+class Station:
+    __slots__ = ("now", "busy", "waiting")
+
+    def __init__(self, now=0.0, busy=None, waiting=0):
+        self.now = now
+        self.busy = busy if busy is not None else list()
+        self.waiting = waiting
+
+    def copy(self):
+        return Station(self.now, list(self.busy), self.waiting)
+
+# runs the station until the number of PEVs in it reaches level, returning True, or the
+# station is empty, returning False; without a level it runs until the station is empty,
+# and the arrivals and the blocked PEVs are counted in counts
+class Splitting:
+    def __init__(self, sim, soc_r, rng):
+        self.rate = sim.lam/60.0
+        self.s = sim.s
+        self.r = sim.r
+        self.rng = rng
+        self.charge_times = ChargeTimes(sim, soc_r, rng)
+        self.interarrivals = list()
+        self.events = 0
+
+    def next_interarrival(self):
+        if not self.interarrivals:
+            self.interarrivals = self.rng.exponential(1.0/self.rate, BLOCK).tolist()
+        return self.interarrivals.pop()
+
+    def run(self, station, level=None, counts=None):
+        busy = station.busy
+        now = station.now
+        s = self.s
+        r = self.r
+        charge_times = self.charge_times
+        next_interarrival = self.next_interarrival
+        while True:
+            # a new interarrival time after every event, the arrivals are memoryless
+            arrival = now+next_interarrival()
+            self.events += 1
+            if busy and busy[0] <= arrival:
+                now = heappop(busy)
+                if station.waiting:
+                    station.waiting -= 1
+                    heappush(busy, now+charge_times.next())
+                elif not busy:
+                    station.now = now
+                    return False
+                continue
+            now = arrival
+            if counts is not None:
+                counts["arrivals"] += 1
+            if len(busy) < s:
+                heappush(busy, now+charge_times.next())
+            elif station.waiting < r:
+                station.waiting += 1
+            else:
+                if counts is not None:
+                    counts["blocked"] += 1
+                continue
+            if level is not None and len(busy)+station.waiting >= level:
+                station.now = now
+                return True
+
+    # plain cycles from an empty station to the next time it is empty, keeping the states
+    # in which they first reach first_level
+    def run_cycles(self, cycles, first_level):
+        arrivals = 0
+        entrances = list()
+        for _ in range(cycles):
+            station = Station()
+            counts = {"arrivals": 0, "blocked": 0}
+            if self.run(station, first_level, counts):
+                entrances.append(station.copy())
+                self.run(station, None, counts)
+            arrivals += counts["arrivals"]
+        return arrivals/cycles, entrances
+
+# one fixed effort estimate: the blocked PEVs of a regenerative cycle, all of which come
+# after the station first fills up, are the chance to fill up times the blocked PEVs
+# from then until the station is empty again; the chance is split into the chances to go
+# from every level to the next before the station empties, each estimated from effort
+# runs started at states drawn from those that entered the level before
+def estimate(sim, soc_r, levels, effort=EFFORT, cycles=CYCLES, seed=None):
+    rng = np.random.default_rng(seed)
+    splitting = Splitting(sim, soc_r, rng)
+    arrivals, entrances = splitting.run_cycles(cycles, levels[0])
+    probability = len(entrances)/cycles
+    for level in levels[1:]:
+        if not entrances:
+            return 0.0, splitting.events
+        temp1 = list()
+        for k in rng.integers(len(entrances), size=effort):
+            station = entrances[k].copy()
+            if splitting.run(station, level):
+                temp1.append(station)
+        probability *= len(temp1)/effort
+        entrances = temp1
+    if not entrances:
+        return 0.0, splitting.events
+    # from a full station until it is empty
+    counts = {"arrivals": 0, "blocked": 0}
+    for k in rng.integers(len(entrances), size=effort):
+        splitting.run(entrances[k].copy(), None, counts)
+    return probability*counts["blocked"]/effort/arrivals, splitting.events
+
+# blocking probability of one soc_r of a single class simulation by splitting on the
+# number of PEVs at the station, with the levels 1 to s+r by default; the standard error
+# comes from independent replications, so its relative size tells whether the effort is
+# enough, and events is the number of arrivals and departures simulated in all of them
+def get_blocking_probability(sim, soc_r, levels=None, effort=EFFORT, replications=REPLICATIONS, cycles=CYCLES, seed=SEED):
+    # the PEVs of the splitting runs wait forever
+    if sim.patience is not None:
+        raise ValueError("splitting does not support reneging")
+    if levels is None:
+        levels = list(range(1, sim.s+sim.r+1))
+    seeds = np.random.SeedSequence(seed).spawn(replications)
+    values = list()
+    events = 0
+    for temp1 in seeds:
+        value, temp2 = estimate(sim, soc_r, levels, effort, cycles, temp1)
+        values.append(value)
+        events += temp2
+    return {
+        "blocking_probability": float(np.mean(values)),
+        "se": float(np.std(values, ddof=1)/np.sqrt(replications)) if replications > 1 else float("nan"),
+        "events": events
+    }
+
+if __name__ == "__main__":
+    import single_class
+
+    s = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    r = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    # the PEVs are only needed for the parameters, the estimate does not use them
+    sim = single_class.Simulation(
+        pev_num=1,
+        lam=single_class.LAM,
+        s=s,
+        r=r,
+        soc_rs=[0.8],
+        soc_i_p=single_class.SOC_I_P,
+        p_max=single_class.P_MAX,
+        e_max=single_class.E_MAX,
+        e_c=single_class.E_C,
+        batt_deg=single_class.BATT_DEG,
+        reward=single_class.REWARD,
+        c_w=single_class.C_W,
+        t_ch_coefficient=single_class.T_CH_COEFFICIENT
+    )
+    t = time.perf_counter()
+    res = get_blocking_probability(sim, 0.8)
+    print("{:.3e} +- {:.1e} from {} events in {:.1f} s".format(res["blocking_probability"], res["se"], res["events"], time.perf_counter()-t))
@@ -0,0 +1,60 @@
+from heapq import heappop, heappush
+from itertools import count
+
+from simpy import Resource
+
+# the waiting requests of a charger resource in the order they came, as a heap, with
+# lazy deletion: a request that gives up is only marked and is dropped when it reaches
+# the top, so it leaves in O(1) instead of with a scan of the list simpy uses; simpy only
+# ever looks at the first request, the others are there for inspection
+class WaitingQueue:
+    def __init__(self):
+        self.heap = list()
+        self.ids = count()
+        self.abandoned = set()
+
+    def prune(self):
+        while self.heap and self.heap[0][1] in self.abandoned:
+            self.abandoned.discard(heappop(self.heap)[1])
+
+    def append(self, request):
+        heappush(self.heap, (next(self.ids), request))
+
+    def remove(self, request):
+        self.abandoned.add(request)
+        self.prune()
+
+    def pop(self, index=-1):
+        self.prune()
+        if index == 0:
+            return heappop(self.heap)[1]
+        request = self[index]
+        self.remove(request)
+        return request
+
+    # the waiting requests in order
+    def get_requests(self):
+        return [request for _, request in sorted(self.heap) if request not in self.abandoned]
+
+    def __getitem__(self, index):
+        self.prune()
+        if index == 0 and self.heap:
+            return self.heap[0][1]
+        return self.get_requests()[index]
+
+    def __len__(self):
+        return len(self.heap)-len(self.abandoned)
+
+    def __iter__(self):
+        return iter(self.get_requests())
+
+class ChargerResource(Resource):
+    PutQueue = WaitingQueue
+
+# waits for a charger, with a patience only until it runs out; true if the PEV got one
+def wait(env, request, sim):
+    if request.triggered or sim.patience is None:
+        yield request
+    else:
+        yield request | env.timeout(sim.sampler.patience(sim.patience))
+    return request.triggered
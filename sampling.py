@@ -0,0 +1,230 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtri
+from scipy.stats import qmc
+
+# variates are drawn in blocks of this size
+BLOCK = 1024
+METHODS = ["random", "antithetic", "sobol", "lhs"]
+STREAMS = ["interarrival", "soc_i", "pev_class", "patience"]
+# uniforms are kept away from 0 and 1 so the inverse CDFs stay finite
+EPS = 1e-12
+REPLICATIONS = 8
+GROUPS = 16
+SEED = 458
+
+def get_seed_sequence(seed):
+    return seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+# the SeedSequence of one sweep point of a simulation, the point is a tuple of indices;
+# it is found by its key instead of by spawning in order, so it does not depend on which
+# other points were run
+def get_point_seed(root, point):
+    return np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key+tuple(point), pool_size=root.pool_size)
+
+# enough to make the SeedSequence again, kept in the attrs of every result frame
+def get_seed_record(seed_sequence):
+    return {"entropy": seed_sequence.entropy, "spawn_key": seed_sequence.spawn_key}
+
+# a numpy Generator of its own for every stream, spawned from the SeedSequence of a sweep
+# point, so the streams of different points, replications and purposes are independent;
+# variates are drawn a block at a time
+class StreamSampler:
+    def __init__(self, seed_sequence, block=BLOCK):
+        self.seed_sequence = seed_sequence
+        self.block = block
+        self.generators = {stream: np.random.default_rng(child) for stream, child in zip(STREAMS, seed_sequence.spawn(len(STREAMS)))}
+        self.variates = {stream: [] for stream in STREAMS}
+
+    def refill(self, stream):
+        generator = self.generators[stream]
+        if stream in ("interarrival", "patience"):
+            variates = generator.standard_exponential(self.block)
+        elif stream == "soc_i":
+            variates = generator.standard_normal(self.block)
+        else:
+            variates = generator.integers(0, 2, self.block)
+        self.variates[stream] = variates.tolist()
+
+    def next_variate(self, stream):
+        if not self.variates[stream]:
+            self.refill(stream)
+        return self.variates[stream].pop()
+
+    def interarrival(self, rate):
+        return self.next_variate("interarrival")/rate
+
+    def soc_i(self, mu, sigma):
+        return mu+sigma*self.next_variate("soc_i")
+
+    def pev_class(self):
+        return self.next_variate("pev_class")
+
+    def patience(self, mean):
+        return mean*self.next_variate("patience")
+
+# the variance is reduced across the replications of a group, not inside a run: the
+# n-th variate of every replication comes from the same antithetic pair, Latin hypercube
+# strata or scrambled Sobol set, while the variates of one run stay independent, so
+# every run on its own is still an exact sample of the model
+def get_uniforms(method, n, seed, stream, block_index, replication, replications):
+    if method == "random":
+        rng = np.random.default_rng([seed, stream, block_index, replication])
+        return rng.random(n)
+    if method == "antithetic":
+        # replications 2k and 2k+1 mirror each other
+        rng = np.random.default_rng([seed, stream, block_index, replication//2])
+        u = rng.random(n)
+        return 1.0-u if replication % 2 else u
+    rng = np.random.default_rng([seed, stream, block_index])
+    if method == "lhs":
+        # every variate gets its own random permutation of the strata
+        strata = rng.permuted(np.tile(np.arange(replications), (n, 1)), axis=1)
+        return (strata[:, replication]+rng.random((n, replications))[:, replication])/replications
+    if method == "sobol":
+        # every variate is one dimension of a scrambled Sobol set with a point per replication
+        points = qmc.Sobol(n, scramble=True, seed=rng).random(replications)
+        return points[replication]
+    raise ValueError("unknown sampling method: "+str(method))
+
+def check_replications(method, replications):
+    if method not in METHODS:
+        raise ValueError("unknown sampling method: "+str(method))
+    if method == "antithetic" and replications % 2:
+        raise ValueError("antithetic sampling needs an even number of replications")
+    if method == "sobol" and replications & (replications-1):
+        raise ValueError("Sobol sampling needs a power of two replications")
+
+# draws interarrival times and initial SoC in bulk through the inverse CDFs, every
+# stream keeps a block of standard variates that is only scaled when a PEV asks
+class Sampler:
+    def __init__(self, interarrival="random", soc_i="random", seed=None, replication=0, replications=1, block=BLOCK, pev_class="random", patience="random"):
+        self.methods = {"interarrival": interarrival, "soc_i": soc_i, "pev_class": pev_class, "patience": patience}
+        for method in self.methods.values():
+            check_replications(method, replications)
+        if not 0 <= replication < replications:
+            raise ValueError("replication has to be in [0, replications)")
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.replication = replication
+        self.replications = replications
+        self.block = block
+        self.blocks = {stream: 0 for stream in STREAMS}
+        self.variates = {stream: [] for stream in STREAMS}
+
+    def refill(self, stream):
+        u = get_uniforms(
+            self.methods[stream],
+            self.block,
+            self.seed,
+            STREAMS.index(stream),
+            self.blocks[stream],
+            self.replication,
+            self.replications
+        )
+        self.blocks[stream] += 1
+        u = np.clip(u, EPS, 1.0-EPS)
+        if stream in ("interarrival", "patience"):
+            variates = -np.log1p(-u)
+        elif stream == "soc_i":
+            variates = ndtri(u)
+        else:
+            variates = (u >= 0.5).astype(int)
+        # reversed so the next variate can be popped from the end
+        self.variates[stream] = variates[::-1].tolist()
+
+    def next_variate(self, stream):
+        if not self.variates[stream]:
+            self.refill(stream)
+        return self.variates[stream].pop()
+
+    def interarrival(self, rate):
+        return self.next_variate("interarrival")/rate
+
+    def soc_i(self, mu, sigma):
+        return mu+sigma*self.next_variate("soc_i")
+
+    def pev_class(self):
+        return self.next_variate("pev_class")
+
+    def patience(self, mean):
+        return mean*self.next_variate("patience")
+
+# flattens the nested result dicts of the getters into {(metric, point...): value}, the
+# per class lists of the multiclass getters are indexed by class
+def flatten(res, key):
+    if isinstance(res, (dict, list)):
+        temp1 = dict()
+        for point, value in (res.items() if isinstance(res, dict) else enumerate(res)):
+            temp1.update(flatten(value, key+(point,)))
+        return temp1
+    return {key: float(res) if res is not None else float("nan")}
+
+def run_replication(task):
+    make_sim, metrics, methods, seed, replication, replications = task
+    sim = make_sim(sampler=Sampler(*methods, seed=seed, replication=replication, replications=replications))
+    temp1 = dict()
+    for metric in metrics:
+        temp1.update(flatten(getattr(sim, metric)(), (metric,)))
+    return temp1
+
+# every configuration is run as a number of independent groups of replications, the
+# estimate of a group is the mean of its replications; reported are the mean and the
+# variance of that estimate for every metric, and how many times smaller the variance
+# is than with the first configuration; make_sim has to be picklable and accept the
+# sampler as a keyword
+def get_variance_reduction(make_sim, metrics, configs=None, replications=REPLICATIONS, groups=GROUPS, seed=SEED, max_workers=None):
+    if configs is None:
+        configs = {
+            "random": ("random", "random"),
+            "antithetic": ("antithetic", "antithetic"),
+            "sobol": ("sobol", "sobol"),
+            "lhs": ("lhs", "lhs")
+        }
+    seeds = np.random.SeedSequence(seed).generate_state(groups)
+    tasks = list()
+    for methods in configs.values():
+        for group in range(groups):
+            for replication in range(replications):
+                tasks.append((make_sim, metrics, methods, int(seeds[group]), replication, replications))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        rows = list(executor.map(run_replication, tasks))
+    res = pd.DataFrame(index=pd.MultiIndex.from_tuples(list(rows[0].keys())))
+    size = groups*replications
+    for k, name in enumerate(configs):
+        values = pd.DataFrame(rows[k*size:(k+1)*size])
+        estimates = values.groupby(np.arange(size)//replications).mean()
+        res["mean_"+name] = estimates.mean().values
+        res["variance_"+name] = estimates.var().values
+    base = next(iter(configs))
+    for name in configs:
+        res["reduction_"+name] = res["variance_"+base]/res["variance_"+name]
+    return res
+
+if __name__ == "__main__":
+    from functools import partial
+
+    import single_class
+
+    make_sim = partial(
+        single_class.Simulation,
+        pev_num=2000,
+        lam=single_class.LAM,
+        s=single_class.S,
+        r=single_class.R,
+        soc_rs=[0.8, 0.9],
+        soc_i_p=single_class.SOC_I_P,
+        p_max=single_class.P_MAX,
+        e_max=single_class.E_MAX,
+        e_c=single_class.E_C,
+        batt_deg=single_class.BATT_DEG,
+        reward=single_class.REWARD,
+        c_w=single_class.C_W,
+        t_ch_coefficient=single_class.T_CH_COEFFICIENT
+    )
+    metrics = ["get_mean_charging_time", "get_mean_charging_power", "get_blocking_probability", "get_mean_waiting_time", "get_system_revenue"]
+    pd.set_option("display.width", 200)
+    pd.set_option("display.max_columns", None)
+    res = get_variance_reduction(make_sim, metrics)
+    print(res[[column for column in res.columns if column.startswith(("mean_", "reduction_"))]])
@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+PARAMETERS = ["lam", "p_max", "c_w", "soc_r"]
+METRICS = ["system_revenue", "mean_waiting_time", "blocking_probability", "mean_charging_time"]
+# the standard errors come from the means of this many consecutive batches of PEVs
+BATCHES = 20
+# relative step of the differences of the charging curve
+STEP = 1e-6
+
+# pathwise derivatives of the charging time and the battery cost of every PEV; p_max is
+# taken to scale the whole charging curve, which makes the charging time fall and the mean
+# power grow in proportion, and an initial SoC clipped to soc_r-0.1 moves with soc_r
+def get_charge_time_derivatives(pevs, sim, soc_r):
+    profile = sim.charging_profile
+    soc_i = pevs["soc_i"].to_numpy()
+    t_ch = pevs["departure_time"].to_numpy()-pevs["start_time"].to_numpy()
+    p_ow = pevs["mean_power"].to_numpy()
+    d_cost = 2.0*sim.batt_deg["a"]*p_ow+sim.batt_deg["b"]
+    res = {"p_max": (-t_ch/sim.p_max, d_cost*p_ow/sim.p_max)}
+    clipped = soc_i >= soc_r-0.1
+    h = STEP*soc_r
+    values = list()
+    for sign in (1.0, -1.0):
+        temp_soc_r = soc_r+sign*h
+        temp_soc_i = np.where(clipped, temp_soc_r-0.1, soc_i)
+        values.append(profile.get_charges(temp_soc_i*sim.e_max, temp_soc_r*sim.e_max))
+    d_t_ch = (values[0][0]-values[1][0])/(2.0*h)*60.0*sim.t_ch_coefficient
+    d_p_ow = (values[0][1]-values[1][1])/(2.0*h)
+    res["soc_r"] = (d_t_ch, d_cost*d_p_ow)
+    return res
+
+# infinitesimal perturbation analysis of the start times: a PEV that did not wait starts
+# when it arrives, one that waited starts when the PEV before it on the same charger
+# leaves, so every charger is a chain of busy periods and the derivatives add up along them
+def get_start_time_derivatives(pevs, d_arrival, d_t_ch):
+    charger = pevs["charger"].to_numpy()
+    start = pevs["start_time"].to_numpy()
+    order = np.lexsort((start, charger))
+    waited = (start > pevs["arrival_time"].to_numpy())[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = charger[order][1:] != charger[order][:-1]
+    busy_start = first | ~waited
+    busy_period = np.cumsum(busy_start)-1
+    d_t_ch_sorted = d_t_ch[order]
+    total = np.cumsum(d_t_ch_sorted)
+    before = (total-d_t_ch_sorted)[busy_start]
+    d_departure = d_arrival[order][busy_start][busy_period]+total-before[busy_period]
+    res = np.empty(len(order))
+    res[order] = d_departure-d_t_ch_sorted
+    return res
+
+# score of lam for the likelihood ratio estimators, the score of every interarrival time
+# is only accumulated since the last arrival that found the station empty, which keeps
+# its variance from growing with the length of the run
+def get_cycle_scores(pevs, lam):
+    arrival = pevs["arrival_time"].to_numpy()
+    blocked = pevs["blocked"].to_numpy().astype(bool)
+    departures = np.sort(pevs["departure_time"].to_numpy()[~blocked])
+    admitted_before = np.concatenate(([0], np.cumsum(~blocked)[:-1]))
+    in_station = admitted_before-np.searchsorted(departures, arrival, side="right")
+    cycle_start = in_station <= 0
+    score = 1.0/lam-np.diff(arrival, prepend=0.0)/60.0
+    score[cycle_start] = 0.0
+    cycle = np.cumsum(cycle_start)-1
+    total = np.cumsum(score)
+    return total-(total-score)[cycle_start][cycle]
+
+def get_standard_error(series, batches=BATCHES):
+    batches = min(batches, len(series))
+    if batches < 2:
+        return float("nan")
+    means = [batch.mean() for batch in np.array_split(np.asarray(series, dtype=float), batches)]
+    return float(np.std(means, ddof=1)/np.sqrt(batches))
+
+# gradients of the metrics of one sweep point with respect to the continuous parameters,
+# estimated from that run alone; every estimate is the mean of a series over the PEVs
+# in arrival order, and its standard error comes from the batch means of that series;
+# the scaling of the charging times is exact for p_max, which only scales them, and for
+# soc_r only as far as the metric depends on the mean charging time; both the likelihood
+# ratio and the scaling assume the run is a fixed number of PEVs rather than a horizon
+def get_sensitivities(sim, soc_r, pevs, batches=BATCHES):
+    if sim.patience is not None:
+        raise ValueError("the sensitivities do not support reneging")
+    pevs = pevs.sort_index()
+    lam = sim.lam
+    n = len(pevs)
+    admitted = ~pevs["blocked"].to_numpy().astype(bool)
+    temp2 = pevs[admitted]
+    arrival = temp2["arrival_time"].to_numpy()
+    start = temp2["start_time"].to_numpy()
+    t_ch = temp2["departure_time"].to_numpy()-start
+    # means over the admitted PEVs as series over all of them
+    def spread(values):
+        res = np.zeros(n)
+        res[admitted] = values*n/admitted.sum()
+        return res
+    base = {
+        "p_k": pevs["blocked"].to_numpy().astype(float),
+        "t_w": spread(start-arrival),
+        "c_batt": spread(temp2["c_batt"].to_numpy()),
+        "t_ch": spread(t_ch)
+    }
+    means = {name: series.mean() for name, series in base.items()}
+    charge_derivatives = get_charge_time_derivatives(temp2, sim, soc_r)
+    zero = np.zeros(len(temp2))
+    derivatives = dict()
+    for parameter in PARAMETERS:
+        d_arrival = -arrival/lam if parameter == "lam" else zero
+        d_t_ch, d_c_batt = charge_derivatives.get(parameter, (zero, zero))
+        d_t_w = get_start_time_derivatives(temp2, d_arrival, d_t_ch)-d_arrival
+        derivatives[parameter] = {
+            "t_w": spread(d_t_w),
+            "c_batt": spread(d_c_batt),
+            "t_ch": spread(d_t_ch)
+        }
+    # perturbation analysis holds the set of blocked PEVs fixed, which is only unbiased
+    # when none are blocked; otherwise the waiting time, like the blocking probability,
+    # comes from the likelihood ratio in lam and the scaling of the charging times
+    score = get_cycle_scores(pevs, lam)
+    d_lam = {
+        "p_k": (base["p_k"]-means["p_k"])*score,
+        "t_w": (base["t_w"]-admitted*means["t_w"]*n/admitted.sum())*score
+    }
+    names = ["p_k"] if admitted.all() else ["p_k", "t_w"]
+    # stretching every charging time by a factor c is the same as dividing lam by c and
+    # measuring time in units of c
+    scale = lam*derivatives["soc_r"]["t_ch"].mean()/means["t_ch"] if means["t_ch"] > 0 else 0.0
+    for name in names:
+        dimension = means[name] if name == "t_w" else 0.0
+        derivatives["lam"][name] = d_lam[name]
+        derivatives["p_max"][name] = -(dimension+lam*d_lam[name])/sim.p_max
+        derivatives["c_w"][name] = np.zeros(n)
+        derivatives["soc_r"][name] = (dimension/lam+d_lam[name])*scale
+    # the revenue is lam*(1-p_k)*g, by the chain rule through every mean it is built from
+    reward = sim.reward["m"]*soc_r+sim.reward["n"]
+    g = reward-sim.c_w*means["t_w"]/60.0-means["c_batt"]*means["t_ch"]/60.0
+    rate = lam*(1.0-means["p_k"])
+    coefficients = {
+        "p_k": -lam*g,
+        "t_w": -rate*sim.c_w/60.0,
+        "c_batt": -rate*means["t_ch"]/60.0,
+        "t_ch": -rate*means["c_batt"]/60.0
+    }
+    # the explicit dependence of the revenue on every parameter, and of that on the means
+    explicit = {
+        "lam": ((1.0-means["p_k"])*g, {"p_k": -g, "t_w": coefficients["t_w"]/lam, "c_batt": coefficients["c_batt"]/lam, "t_ch": coefficients["t_ch"]/lam}),
+        "p_max": (0.0, {}),
+        "c_w": (-rate*means["t_w"]/60.0, {"p_k": lam*means["t_w"]/60.0, "t_w": -rate/60.0}),
+        "soc_r": (rate*sim.reward["m"], {"p_k": -lam*sim.reward["m"]})
+    }
+    rows = list()
+    for parameter in PARAMETERS:
+        value, partials = explicit[parameter]
+        series = {
+            "system_revenue": value+sum(coefficients[name]*derivatives[parameter][name] for name in coefficients)
+                +sum(partial*(base[name]-means[name]) for name, partial in partials.items()),
+            "mean_waiting_time": derivatives[parameter]["t_w"],
+            "blocking_probability": derivatives[parameter]["p_k"],
+            "mean_charging_time": derivatives[parameter]["t_ch"]
+        }
+        for metric in METRICS:
+            rows.append({
+                "metric": metric,
+                "parameter": parameter,
+                "gradient": float(np.mean(series[metric])),
+                "se": get_standard_error(series[metric], batches)
+            })
+    return pd.DataFrame(rows).set_index(["metric", "parameter"])
@@ -0,0 +1,299 @@
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import json
+import math
+import os
+import sys
+
+import sweep
+
+HOST = "127.0.0.1"
+PORT = 8458
+# jobs waiting for a worker, a request that does not fit gets a 503
+MAX_QUEUE = 64
+MAX_BODY = 1 << 20
+# the getters a request can ask for, all of them return plain numbers
+METRICS = sweep.METRICS+["get_abandonment_probability"]
+# keyword arguments of the simulations that are not in the defaults of a model
+OPTIONS = ["horizon", "patience", "power_cap", "power_policy"]
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+# every param has to have the shape of its default: a list of numbers, an object with the
+# same keys of numbers or a number; the options and pev_num can be null
+def check_params(model, params):
+    defaults = sweep.get_defaults(model)
+    for name, value in params.items():
+        default = defaults.get(name)
+        if isinstance(default, list):
+            if not isinstance(value, list) or not value or not all(is_number(k) for k in value):
+                raise RequestError(400, name+" has to be a non-empty list of numbers")
+        elif isinstance(default, dict):
+            if not isinstance(value, dict) or set(value) != set(default) or not all(is_number(k) for k in value.values()):
+                raise RequestError(400, name+" has to be an object with the numbers "+", ".join(sorted(default)))
+        elif name == "power_policy":
+            if not isinstance(value, str):
+                raise RequestError(400, name+" has to be a string")
+        elif not (is_number(value) or (value is None and (name == "pev_num" or name in OPTIONS))):
+            raise RequestError(400, name+" has to be a number")
+
+# a request is the block of a sweep study, without a grid: the model, params that replace
+# its defaults, metrics and replications, and a seed; every value of the swept parameter
+# and every replication is a job of its own
+def get_tasks(body):
+    model = body.get("model")
+    if model not in sweep.MODELS:
+        raise RequestError(400, "unknown model: "+str(model))
+    params = body.get("params", dict())
+    if not isinstance(params, dict):
+        raise RequestError(400, "params has to be an object")
+    unknown = set(params)-set(sweep.get_defaults(model))-set(OPTIONS)
+    if unknown:
+        raise RequestError(400, "unknown params: "+", ".join(sorted(unknown)))
+    check_params(model, params)
+    metrics = body.get("metrics", sweep.METRICS)
+    if not isinstance(metrics, list) or not metrics or any(metric not in METRICS for metric in metrics):
+        raise RequestError(400, "metrics has to be a list of "+", ".join(METRICS))
+    replications = body.get("replications", 1)
+    if not isinstance(replications, int) or replications < 1:
+        raise RequestError(400, "replications has to be a positive integer")
+    seed = body.get("seed", sweep.SEED)
+    if not isinstance(seed, int) or seed < 0:
+        raise RequestError(400, "seed has to be a non-negative integer")
+    block = {"model": model, "params": params, "metrics": metrics, "replications": replications}
+    return sweep.expand([block], seed)
+
+def get_value(value):
+    return None if math.isnan(value) else value
+
+# one line of the stream for a finished job
+def get_line(task, res, coalesced):
+    line = {
+        "key": task["key"],
+        "model": task["model"],
+        "replication": task["replication"],
+        "seed": task["seed"],
+        sweep.SWEPT[task["model"]]: task["params"][sweep.SWEPT[task["model"]]][0],
+        "coalesced": coalesced
+    }
+    if "error" in res:
+        line["error"] = res["error"]
+    else:
+        line["elapsed"] = res["elapsed"]
+        line["results"] = [{"metric": metric, "point": "/".join(str(k) for k in point), "value": get_value(value)} for (metric, *point), value in res["results"]]
+    return (json.dumps(line)+"\n").encode()
+
+# a local HTTP/JSON service for the models: POST /run takes a request as in get_tasks and
+# streams a JSON line for every job as it finishes; a job already queued or running for
+# another request is not run again, the requests share its result; GET /status tells
+# how many jobs are queued and running
+class Service:
+    def __init__(self, host=HOST, port=PORT, max_workers=None, max_queue=MAX_QUEUE):
+        self.host = host
+        self.port = port
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        # future of every job that is queued or running, by the key of its task
+        self.jobs = dict()
+        self.running = 0
+        self.coalesced = 0
+        self.finished = 0
+
+    async def start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.queue = asyncio.Queue(self.max_queue)
+        # one dispatcher for every worker process, so a queued job always waits in the queue
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.max_workers or os.cpu_count() or 1)]
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.executor.shutdown(cancel_futures=True)
+
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job_key, task, future = await self.queue.get()
+            self.running += 1
+            try:
+                _, results, elapsed, _ = await loop.run_in_executor(self.executor, sweep.run_task, task)
+                res = {"results": results, "elapsed": elapsed}
+            except Exception as e:
+                # an error is a result too, so it reaches every request sharing the job
+                res = {"error": repr(e)}
+            finally:
+                self.running -= 1
+                del self.jobs[job_key]
+            self.finished += 1
+            future.set_result(res)
+
+    # the future of every task, queued if it is new; all or nothing, so a request that
+    # does not fit in the queue leaves no jobs behind
+    def submit(self, tasks):
+        loop = asyncio.get_running_loop()
+        new = dict()
+        # the key of a task covers its metrics, so two jobs with the same key are the same
+        for task in tasks:
+            if task["key"] not in self.jobs and task["key"] not in new:
+                new[task["key"]] = task
+        if len(new) > self.max_queue-self.queue.qsize():
+            raise RequestError(503, "{} jobs queued, {} more do not fit".format(self.queue.qsize(), len(new)))
+        futures = list()
+        for task in tasks:
+            job_key = task["key"]
+            coalesced = job_key not in new
+            if job_key not in self.jobs:
+                self.jobs[job_key] = loop.create_future()
+                self.queue.put_nowait((job_key, task, self.jobs[job_key]))
+            elif coalesced:
+                self.coalesced += 1
+            futures.append((task, self.jobs[job_key], coalesced))
+        return futures
+
+    def get_status(self):
+        return {"queued": self.queue.qsize(), "running": self.running, "coalesced": self.coalesced, "finished": self.finished, "max_queue": self.max_queue}
+
+    async def handle(self, reader, writer):
+        streaming = False
+        try:
+            try:
+                method, path, body = await read_request(reader)
+                if path == "/status":
+                    if method != "GET":
+                        raise RequestError(405, "use GET")
+                    await write_json(writer, 200, self.get_status())
+                elif path == "/run":
+                    if method != "POST":
+                        raise RequestError(405, "use POST")
+                    futures = self.submit(get_tasks(body))
+                    streaming = True
+                    await self.stream(writer, futures)
+                else:
+                    raise RequestError(404, "no such path: "+path)
+            except RequestError as e:
+                await write_json(writer, e.status, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # the client went away, its jobs still finish for the others
+            pass
+        except Exception as e:
+            # once the stream has begun there is no status to send, the client sees it cut short
+            if not streaming:
+                try:
+                    await write_json(writer, 500, {"error": repr(e)})
+                except ConnectionError:
+                    pass
+        finally:
+            writer.close()
+
+    async def stream(self, writer, futures):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+        # a job asked for twice in one request is answered for both tasks
+        groups = dict()
+        for task, future, coalesced in futures:
+            groups.setdefault(future, list()).append((task, coalesced))
+        for next_done in asyncio.as_completed([wait_job(future, group) for future, group in groups.items()]):
+            group, res = await next_done
+            for task, coalesced in group:
+                write_chunk(writer, get_line(task, res, coalesced))
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+# shielded, so a request that goes away does not cancel a job others wait for
+async def wait_job(future, group):
+    return group, await asyncio.shield(future)
+
+async def read_request(reader):
+    line = (await reader.readline()).decode("latin-1").split()
+    if len(line) != 3:
+        raise RequestError(400, "bad request line")
+    method, path, _ = line
+    headers = dict()
+    while True:
+        header = (await reader.readline()).decode("latin-1").strip()
+        if not header:
+            break
+        name, _, value = header.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0) or 0)
+    except ValueError:
+        raise RequestError(400, "bad content length")
+    if length > MAX_BODY:
+        raise RequestError(413, "the body is larger than {} bytes".format(MAX_BODY))
+    body = dict()
+    if length:
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except ValueError:
+            raise RequestError(400, "the body is not JSON")
+        if not isinstance(body, dict):
+            raise RequestError(400, "the body has to be an object")
+    return method, path.split("?")[0], body
+
+async def write_json(writer, status, res):
+    data = json.dumps(res).encode()
+    writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(status, REASONS[status], len(data)).encode()+data)
+    await writer.drain()
+
+def write_chunk(writer, data):
+    writer.write("{:x}\r\n".format(len(data)).encode()+data+b"\r\n")
+
+# a minimal client for the service, the status and the body or, for a stream, the lines
+async def fetch(method, path, body=None, host=HOST, port=PORT):
+    reader, writer = await asyncio.open_connection(host, port)
+    data = json.dumps(body).encode() if body is not None else b""
+    writer.write("{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(method, path, host, len(data)).encode()+data)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = dict()
+    while True:
+        header = (await reader.readline()).decode("latin-1").strip()
+        if not header:
+            break
+        name, _, value = header.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding") == "chunked":
+        res = list()
+        while True:
+            size = int(await reader.readline(), 16)
+            if size == 0:
+                break
+            res.append(json.loads(await reader.readexactly(size)))
+            await reader.readline()
+    else:
+        res = json.loads(await reader.read())
+    writer.close()
+    await writer.wait_closed()
+    return status, res
+
+async def serve(host, port, max_workers):
+    service = Service(host, port, max_workers)
+    port = await service.start()
+    print("serving on http://{}:{}".format(host, port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.close()
+
+if __name__ == "__main__":
+    # e.g. curl -N -d '{"model": "single_class", "params": {"soc_rs": [0.8, 0.9]}}' http://127.0.0.1:8458/run
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    try:
+        asyncio.run(serve(HOST, port, max_workers))
+    except KeyboardInterrupt:
+        pass
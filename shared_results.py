@@ -0,0 +1,208 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# columns start on multiples of this many bytes
+ALIGNMENT = 64
+
+def get_offsets(arrays):
+    offsets = list()
+    size = 0
+    for array in arrays:
+        offsets.append(size)
+        size += -(-array.nbytes//ALIGNMENT)*ALIGNMENT
+    return offsets, max(size, 1)
+
+# a column as a numeric array, an object column of numbers and None, like the times of
+# blocked PEVs, or one with only None becomes float with NaN
+def get_array(values, name):
+    array = values.to_numpy()
+    if array.dtype.kind in "biuf":
+        return array
+    try:
+        return values.to_numpy(dtype=float, na_value=np.nan)
+    except (TypeError, ValueError):
+        raise ValueError("only numeric and boolean columns can be shared, not "+str(name))
+
+# worker side: copies the index and the columns of a frame of PEVs into one shared memory
+# block and returns what the parent needs to find them, a few hundred bytes to pickle
+# however long the frame is, the attrs included; the block outlives the worker until the
+# parent unlinks it
+def share_frame(df):
+    arrays = [get_array(df.index, df.index.name)]+[get_array(df[column], column) for column in df.columns]
+    offsets, size = get_offsets(arrays)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        for array, offset in zip(arrays, offsets):
+            view = np.ndarray(array.shape, array.dtype, block.buf, offset)
+            view[:] = array
+            del view
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    descriptor = {
+        "name": block.name,
+        "rows": len(df),
+        "index": (df.index.name, arrays[0].dtype.str, offsets[0]),
+        "columns": [(column, array.dtype.str, offset) for column, array, offset in zip(df.columns, arrays[1:], offsets[1:])],
+        "attrs": dict(df.attrs)
+    }
+    block.close()
+    # the parent owns the block from here on, otherwise the tracker of the worker would
+    # unlink it when the worker exits; attaching registers it with the tracker of the parent
+    resource_tracker.unregister(block._name, "shared_memory")
+    return descriptor
+
+# shares every frame of the nested pevs of a simulation, keeping the nesting
+def share_pevs(pevs):
+    if isinstance(pevs, pd.DataFrame):
+        return share_frame(pevs)
+    if isinstance(pevs, dict):
+        return {point: share_pevs(value) for point, value in pevs.items()}
+    return [share_pevs(value) for value in pevs]
+
+# parent side: the frame is made of views into the shared block, nothing is copied; the
+# frame is only valid until close, so anything kept longer has to be copied first, and
+# unlink frees the block for good, which the parent has to do once for every frame
+class SharedFrame:
+    def __init__(self, descriptor):
+        self.name = descriptor["name"]
+        self.block = shared_memory.SharedMemory(name=self.name)
+        rows = descriptor["rows"]
+        index_name, dtype, offset = descriptor["index"]
+        index = pd.Index(np.ndarray(rows, np.dtype(dtype), self.block.buf, offset), name=index_name, copy=False)
+        columns = {column: np.ndarray(rows, np.dtype(dtype), self.block.buf, offset) for column, dtype, offset in descriptor["columns"]}
+        self.frame = pd.DataFrame(columns, index=index, copy=False)
+        self.frame.attrs = descriptor.get("attrs", dict())
+
+    def close(self):
+        # the views have to go before the buffer can be released
+        self.frame = None
+        if self.block is not None:
+            self.block.close()
+
+    def unlink(self):
+        if self.block is not None:
+            self.block.unlink()
+            self.block = None
+
+    def __enter__(self):
+        return self.frame
+
+    def __exit__(self, *args):
+        self.close()
+        self.unlink()
+
+# the nested pevs of a simulation attached from their descriptors, with the frames as pevs;
+# closing it releases and unlinks every block
+class SharedPevs:
+    def __init__(self, descriptors):
+        self.shared = list()
+        self.pevs = self.attach(descriptors)
+
+    def attach(self, descriptors):
+        if isinstance(descriptors, dict) and "name" not in descriptors:
+            return {point: self.attach(value) for point, value in descriptors.items()}
+        if isinstance(descriptors, list):
+            return [self.attach(value) for value in descriptors]
+        shared = SharedFrame(descriptors)
+        self.shared.append(shared)
+        return shared.frame
+
+    def close(self):
+        self.pevs = None
+        for shared in self.shared:
+            shared.close()
+            shared.unlink()
+        self.shared = list()
+
+    def __enter__(self):
+        return self.pevs
+
+    def __exit__(self, *args):
+        self.close()
+
+# writes every frame of nested pevs to an npz file of its own in path, named by name and
+# the point of the frame, e.g. name-0.8.npz; the columns go to the file straight from the
+# views, so frames from SharedPevs are neither pickled nor copied in the parent
+def save_pevs(pevs, path, name):
+    if isinstance(pevs, pd.DataFrame):
+        os.makedirs(path, exist_ok=True)
+        arrays = {"column{}".format(k): get_array(pevs[column], column) for k, column in enumerate(pevs.columns)}
+        meta = {"index": pevs.index.name, "columns": [str(column) for column in pevs.columns], "attrs": pevs.attrs}
+        file = os.path.join(path, name+".npz")
+        with open(file+".tmp", "wb") as f:
+            np.savez(f, index=get_array(pevs.index, pevs.index.name), meta=json.dumps(meta), **arrays)
+        os.replace(file+".tmp", file)
+        return
+    for point, value in (pevs.items() if isinstance(pevs, dict) else enumerate(pevs)):
+        save_pevs(value, path, name+"-"+str(point))
+
+# a frame written by save_pevs; the lists in the attrs, like the spawn_key of the seed,
+# come back as lists
+def load_frame(file):
+    with np.load(file) as data:
+        meta = json.loads(str(data["meta"]))
+        columns = {column: data["column{}".format(k)] for k, column in enumerate(meta["columns"])}
+        df = pd.DataFrame(columns, index=pd.Index(data["index"], name=meta["index"]))
+    df.attrs = meta["attrs"]
+    return df
+
+# runs a simulation in a worker and hands its pevs back through shared memory; make_sim
+# has to be picklable and return a finished simulation
+def run_shared(make_sim):
+    return share_pevs(make_sim().pevs)
+
+# runs the simulations in worker processes, each of the returned SharedPevs has to be
+# closed once its frames are no longer needed
+def run_all_shared(make_sims, max_workers=None):
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        descriptors = list(executor.map(run_shared, make_sims))
+    return [SharedPevs(temp1) for temp1 in descriptors]
+
+def make_frame(rows):
+    rng = np.random.default_rng(rows)
+    arrival = np.cumsum(rng.exponential(6.0, rows))
+    start = arrival+rng.exponential(1.0, rows)
+    return pd.DataFrame({
+        "soc_i": rng.uniform(0.05, 0.8, rows),
+        "charger": rng.integers(1, 8, rows),
+        "arrival_time": arrival,
+        "start_time": start,
+        "departure_time": start+rng.exponential(30.0, rows),
+        "mean_power": rng.uniform(20.0, 45.0, rows),
+        "c_batt": rng.uniform(1.0, 12.0, rows),
+        "blocked": rng.random(rows) < 0.05
+    }, index=pd.Index(np.arange(rows), name="pev"))
+
+def pickled_frame(rows):
+    return make_frame(rows)
+
+def shared_frame(rows):
+    return share_frame(make_frame(rows))
+
+# time to get a frame of rows PEVs from a worker, pickled and through shared memory
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+    print("frame of {} rows, {:.1f} MB pickled".format(rows, len(pickle.dumps(make_frame(rows)))/1e6))
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        # both paths build the frame in the worker, so the difference is the transfer
+        executor.submit(make_frame, 10).result()
+        worker_t = time.perf_counter()
+        make_frame(rows)
+        worker_t = time.perf_counter()-worker_t
+        t = time.perf_counter()
+        df = executor.submit(pickled_frame, rows).result()
+        print("pickled: {:.3f} s".format(time.perf_counter()-t-worker_t))
+        t = time.perf_counter()
+        with SharedFrame(executor.submit(shared_frame, rows).result()) as shared:
+            print("shared memory: {:.3f} s".format(time.perf_counter()-t-worker_t))
+            print("same frame:", shared.equals(df))
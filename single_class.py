@@ -1,11 +1,19 @@
-from math import (log,sqrt,exp,factorial)
+from heapq import heappop, heappush
 import pandas as pd
-import random
 
-from simpy import Environment
-from simpy import Resource
 from simpy.events import Event
 
+import analytic
+import ledger
+import occupancy
+import rare_event
+from charging import CcCvProfile
+from power_sharing import PowerSharing
+from profiling import NULL_PROFILER, profiled
+import reneging
+from sampling import StreamSampler, get_point_seed, get_seed_record, get_seed_sequence
+import sensitivity
+
 PEV_NUM = 500
 LAM = 10.0
 S = 7
@@ -25,18 +33,17 @@ E_C = 5
 T_CH_COEFFICIENT = 2
 
 class Pev:
+    # the simulation is reached through the charging station, so a PEV only holds
+    # what its charge needs and its own record
+    __slots__ = ("e_i", "e_r", "profile", "p_ow", "record")
+
     def __init__(self, soc_r, i, sim: 'Simulation'):
-        self.i = i
-        soc_i = random.gauss(sim.soc_i_mu,sim.soc_i_sigma)
+        soc_i = sim.sampler.soc_i(sim.soc_i_mu,sim.soc_i_sigma)
         soc_i = max(0.05, min(soc_r-0.1, soc_i))
         self.e_i = soc_i*sim.e_max
-        self.e_c = sim.e_c
         self.e_r = soc_r*sim.e_max
-        self.e_max = sim.e_max
-        self.p_max = sim.p_max
-        self.sim = sim
-        self.sim.temp_pevs.append(
-            {
+        self.profile = sim.charging_profile
+        self.record = {
                 "pev": i,
                 "soc_i": soc_i,
                 "charger": 0,
@@ -45,72 +52,95 @@ class Pev:
                 "departure_time": None,
                 "mean_power": None,
                 "c_batt": None,
-                "blocked": False
+                "blocked": False,
+                "abandoned": False
             }
-        )
+        sim.temp_pevs.append(self.record)
     
-    #! there is an assumption that e_r is never lower than e_c
-    def get_charge_time(self):
-        n1 = self.p_max/(self.e_max-self.e_c)
-        m1 = n1*self.e_c + self.p_max
-        e_i = self.e_i
-        t1 = 0.0
-        if e_i <= self.e_c:
-            t1 = (self.e_c-e_i)/self.p_max
-            e_i = self.e_c
-        t2 = log((m1-n1*e_i)/(m1-n1*self.e_r),10.0)/n1
-        p_ow = (self.p_max*t1+(2*m1-n1*(self.e_r+e_i))*t2/2.0)/(t1+t2)
-        self.sim.temp_pevs[self.i-1]["mean_power"] = p_ow
-        self.sim.temp_pevs[self.i-1]["c_batt"] = self.sim.batt_deg["a"]*p_ow**2+self.sim.batt_deg["b"]*p_ow+self.sim.batt_deg["c"]
+    def get_charge_time(self, sim: 'Simulation'):
+        t_ch, self.p_ow = self.profile.get_charge(self.e_i, self.e_r)
+        self.set_mean_power(self.p_ow, sim)
         #! only multiplying by 2 gives the graphs from the paper
-        return (t1+t2)*60.0*self.sim.t_ch_coefficient
+        return t_ch*60.0*sim.t_ch_coefficient
+
+    # a power cap can stretch a charge, and the mean power and the battery cost with it
+    def set_mean_power(self, p_ow, sim: 'Simulation'):
+        self.record["mean_power"] = p_ow
+        self.record["c_batt"] = sim.batt_deg["a"]*p_ow**2+sim.batt_deg["b"]*p_ow+sim.batt_deg["c"]
     
+    # the whole stay of a PEV, charging included, is this one process
     def go_to_charging_station(self, env, charging_station: 'ChargingStation'):
+        record = self.record
         # at this point the PEV in question has just pulled up to the charging station
-        self.sim.temp_pevs[self.i-1]["arrival_time"] = env.now
+        record["arrival_time"] = env.now
         # check if there are any empty spaces near chargers or in the waiting spaces
         if len(charging_station.charger.queue) < charging_station.waiting_space_capacity:
             with charging_station.charger.request() as request:
-                yield request
-                # at this point the PEV in question is near the charger
-                for i in range(1,charging_station.charger.capacity+1):
-                    if charging_station.charger_availability[i-1]:
-                        self.sim.temp_pevs[self.i-1]["charger"] = i
-                        break
-                self.sim.temp_pevs[self.i-1]["start_time"] = env.now
-                yield env.process(charging_station.charge_pev(self))
+                if (yield from reneging.wait(env, request, charging_station.sim)):
+                    yield from self.charge(env, charging_station)
+                else:
+                    # leaving the with block takes the request out of the queue
+                    record["abandoned"] = True
         else:
             # at this point the PEV in question has no place to park so it is blocked
-            self.sim.temp_pevs[self.i-1]["blocked"] = True
+            record["blocked"] = True
+        self.leave(env, charging_station)
+
+    # the charge from the moment the PEV gets a charger
+    def charge(self, env, charging_station: 'ChargingStation'):
+        record = self.record
+        # at this point the PEV in question is near the charger
+        charger = heappop(charging_station.free_chargers)
+        record["charger"] = charger+1
+        record["start_time"] = env.now
+        sim = charging_station.sim
+        # the phase is only entered when profiling, it would cost every PEV a context manager
+        if sim.profiler.enabled:
+            with sim.profiler.phase("get_charge_time"):
+                charge_time = self.get_charge_time(sim)
+        else:
+            charge_time = self.get_charge_time(sim)
+        # wait time until PEV is charged
+        if charging_station.power_sharing is None:
+            yield env.timeout(charge_time)
+        else:
+            yield charging_station.power_sharing.charge(self, charge_time)
+        heappush(charging_station.free_chargers, charger)
+
+    def leave(self, env, charging_station: 'ChargingStation'):
         # at this point the PEV in question is charged and is leaving the charging station
-        self.sim.temp_pevs[self.i-1]["departure_time"] = env.now
-        if not (charging_station.admission or charging_station.charger.count):
-            self.sim.stop_event.succeed()
+        self.record["departure_time"] = env.now
+        # with a single charger the released request is still counted as queued here
+        if not (charging_station.admission or charging_station.charger.count or charging_station.charger.queue):
+            charging_station.sim.stop_event.succeed()
 
 class ChargingStation:
-    def __init__(self, env, s, r):
+    def __init__(self, env, s, r, sim: 'Simulation'):
         self.env = env
-        self.charger = Resource(env, s)
-        self.charger_availability = list()
-        for _ in range(s):
-            self.charger_availability.append(True)
+        self.sim = sim
+        self.charger = reneging.ChargerResource(env, s)
+        # indices of the free chargers, the lowest one is taken first
+        self.free_chargers = list(range(s))
         self.waiting_space_capacity = r
         self.admission = True
-    
-    def charge_pev(self, pev: Pev):
-        for i in range(self.charger.capacity):
-            if self.charger_availability[i]:
-                self.charger_availability[i] = False
-                occupied_charger = i
-                break
-        # wait time until PEV is charged
-        yield self.env.timeout(pev.get_charge_time())
-        self.charger_availability[occupied_charger] = True
+        # with a site power cap the chargers share it and the charges are run by power_sharing
+        self.power_sharing = PowerSharing(env, sim, sim.power_cap, sim.power_policy) if sim.power_cap is not None else None
 
 # this is the main class of the simulation
 # when it is initialized, the simulation is run automatically
 class Simulation:
-    def __init__(self,pev_num,lam,s,r,soc_rs,soc_i_p,p_max,e_max,e_c,batt_deg,reward,c_w,t_ch_coefficient):
+    def __init__(self,pev_num,lam,s,r,soc_rs,soc_i_p,p_max,e_max,e_c,batt_deg,reward,c_w,t_ch_coefficient,profiler=None,horizon=None,sampler=None,charging_profile=None,power_cap=None,power_policy="equal",checkpoint=None,seed=None,patience=None):
+        self.profiler = profiler or NULL_PROFILER
+        self.sampler = sampler
+        # an int or a SeedSequence, e.g. one spawned for every replication
+        self.seed_sequence = get_seed_sequence(seed) if sampler is None else None
+        self.seed_record = None
+        self.horizon = horizon
+        # site limit in kW on the power all chargers draw together, None for no limit
+        self.power_cap = power_cap
+        self.power_policy = power_policy
+        # mean time in minutes a PEV waits for a charger before it leaves, None to wait forever
+        self.patience = patience
         self.pev_num = pev_num
         self.lam = lam
         self.s = s
@@ -124,34 +154,81 @@ class Simulation:
         self.reward = reward
         self.c_w = c_w
         self.t_ch_coefficient = t_ch_coefficient
+        # the charging curve every PEV follows, by default the CC/CV curve of p_max and e_c
+        self.charging_profile = charging_profile or CcCvProfile(p_max, e_max, e_c)
         self.soc_rs=soc_rs
+        # saves the run every so many arrivals and resumes it from the last save
+        self.checkpoint = checkpoint
+        if checkpoint is not None:
+            checkpoint.start(self)
         self.pevs = dict()
-        for soc_r in self.soc_rs:
-            self.env = Environment()
+        for k, soc_r in enumerate(self.soc_rs):
+            if checkpoint is not None and checkpoint.is_done(soc_r):
+                self.pevs[soc_r] = checkpoint.get_done(soc_r)
+                continue
+            self.set_sampler((k,))
             self.temp_pevs = list()
             self.soc_r = soc_r
-            self.stop_event = Event(self.env)
-            self.env.process(self.run_charging_station())
-            self.env.run(self.stop_event)
-            self.temp_pevs = pd.DataFrame(self.temp_pevs)
-            self.temp_pevs.set_index("pev", inplace = True)
+            if checkpoint is not None and checkpoint.is_running(soc_r):
+                self.env = self.profiler.get_environment(checkpoint.get_time())
+                self.stop_event = Event(self.env)
+                charging_station, i = checkpoint.restore(self)
+                self.env.process(self.run_charging_station(charging_station, i))
+            else:
+                self.env = self.profiler.get_environment()
+                self.stop_event = Event(self.env)
+                self.env.process(self.run_charging_station())
+            with self.profiler.sweep_point(soc_r, self):
+                self.env.run(self.stop_event)
+            with self.profiler.phase("dataframe"):
+                self.temp_pevs = pd.DataFrame(self.temp_pevs)
+                self.temp_pevs.set_index("pev", inplace = True)
+                if self.seed_record is not None:
+                    self.temp_pevs.attrs["seed"] = self.seed_record
             self.pevs[soc_r] = self.temp_pevs
+            if checkpoint is not None:
+                checkpoint.finish(self)
 
-    # process function for the simulation to run until a specified number of PEVs is charged
-    def run_charging_station(self):
-        charging_station = ChargingStation(self.env, self.s, self.r)
-        i = 0
+    # without a sampler of its own every sweep point draws from generators spawned from the
+    # seed for it, and the seed is kept in the attrs of its frame
+    def set_sampler(self, point):
+        if self.seed_sequence is not None:
+            seed_sequence = get_point_seed(self.seed_sequence, point)
+            self.sampler = StreamSampler(seed_sequence)
+            self.seed_record = get_seed_record(seed_sequence)
+
+    # process function for the simulation to run until a specified number of PEVs has arrived
+    # or the horizon is reached, after that only the PEVs already at the station are simulated;
+    # a run resumed from a checkpoint starts with its station at the arrival of PEV i+1
+    def run_charging_station(self, charging_station=None, i=0):
+        resumed = charging_station is not None
+        if not resumed:
+            charging_station = ChargingStation(self.env, self.s, self.r, self)
         while True:
-            # wait time until next PEV has to be introduced to the simulation
-            yield self.env.timeout(random.expovariate(self.lam/60))
+            if not resumed:
+                # wait time until next PEV has to be introduced to the simulation
+                interarrival = self.sampler.interarrival(self.lam/60)
+                if self.horizon is not None and self.env.now+interarrival > self.horizon*60.0:
+                    # the next PEV would come after the horizon, so no arrival is scheduled for it
+                    yield self.env.timeout(self.horizon*60.0-self.env.now)
+                    charging_station.admission = False
+                    if not (charging_station.charger.count or charging_station.charger.queue):
+                        self.stop_event.succeed()
+                    return
+                yield self.env.timeout(interarrival)
+                if self.checkpoint is not None:
+                    self.checkpoint.arrival(self, i)
+            resumed = False
             i += 1
-            if charging_station.admission:
-                # create a new PEV in the simulation and send it to the charging station
-                pev = Pev(self.soc_r, i, self)
-                self.env.process(pev.go_to_charging_station(self.env,charging_station))
-            if i >= self.pev_num:
+            # create a new PEV in the simulation and send it to the charging station
+            pev = Pev(self.soc_r, i, self)
+            self.env.process(pev.go_to_charging_station(self.env,charging_station))
+            if self.pev_num is not None and i >= self.pev_num:
+                # the last PEV stops the simulation when it leaves
                 charging_station.admission = False
+                return
     
+    @profiled
     def get_mean_charging_time(self):
         temp1 = dict()
         for soc_r in self.soc_rs:
@@ -159,12 +236,13 @@ class Simulation:
             temp1[soc_r] = (temp2["departure_time"]-temp2["start_time"]).mean()
         return temp1
     
+    @profiled
     def get_mean_charging_power(self, numerical=False):
         temp1 = dict()
         if numerical:
             t_ch = self.get_mean_charging_time()
             for soc_r in self.soc_rs:
-                temp2 = self.pevs[soc_r][self.pevs[soc_r]["blocked"]==False]
+                temp2 = self.pevs[soc_r][(self.pevs[soc_r]["blocked"]==False) & (self.pevs[soc_r]["abandoned"]==False)]
                 temp1[soc_r] = 60.0*self.e_max*(soc_r - temp2["soc_i"].mean())/t_ch[soc_r]
         else:
             for soc_r in self.soc_rs:
@@ -172,6 +250,7 @@ class Simulation:
                 temp1[soc_r] = temp2["mean_power"].mean()
         return temp1
     
+    @profiled
     def get_traffic_intensity(self):
         temp = dict()
         mu_over_1 = self.get_mean_charging_time()
@@ -179,58 +258,99 @@ class Simulation:
             temp[soc_r] = mu_over_1[soc_r]*self.lam/(60*self.s)
         return temp
     
-    def get_blocking_probability(self, numerical=False):
+    @profiled
+    def get_blocking_probability(self, numerical=False, splitting=False):
         temp1 = dict()
-        if numerical:
+        if splitting:
+            # estimated by importance splitting instead of from the simulated PEVs, for
+            # probabilities too small to see in a simulation
+            for soc_r in self.soc_rs:
+                temp1[soc_r] = rare_event.get_blocking_probability(self, soc_r)["blocking_probability"]
+        elif numerical:
             ro = self.get_traffic_intensity()
-            theta = (self.s-1.0)/(self.s+1.0)
-            f = (sqrt((9.0+theta)/(1.0-theta))-2)*theta/(8.0+8.0*theta)
             for soc_r in self.soc_rs:
-                temp2 = self.pevs[soc_r][self.pevs[soc_r]["blocked"]==False]
+                temp2 = self.pevs[soc_r][(self.pevs[soc_r]["blocked"]==False) & (self.pevs[soc_r]["abandoned"]==False)]
                 c_s = (temp2["departure_time"]-temp2["arrival_time"]).std()/60.0
-                g = (1.0-ro[soc_r])/ro[soc_r]
-                r_d = (1.0+f*g*(1-exp(-theta/(f*g))))/2.0
-                r_g = ((1.0+c_s**2.0)*r_d)/((2.0*r_d-1.0)*c_s**2.0+1.0)
-                zeta = ro[soc_r]*r_g/(1.0-ro[soc_r])+ro[soc_r]*r_g
-                p_0 = 1.0/sum([((self.s*ro[soc_r])**j)/factorial(j)+(((self.s*ro[soc_r])**self.s)/factorial(self.s))*((1.0-ro[soc_r]*zeta**self.r)/(1.0-ro[soc_r])) for j in range(self.s)])
-                temp1[soc_r] = ((self.s*ro[soc_r])**self.s)*(zeta**self.r)*p_0/factorial(self.s)
+                temp1[soc_r] = analytic.get_blocking_probability(self.s, self.r, ro[soc_r], c_s)
         else:
             for soc_r in self.soc_rs:
                 temp1[soc_r] = len(self.pevs[soc_r][self.pevs[soc_r]["blocked"]==True].index)/len(self.pevs[soc_r].index)
         return temp1
+
+    # share of the arrivals that got a waiting space but left before a charger was free
+    @profiled
+    def get_abandonment_probability(self):
+        temp1 = dict()
+        for soc_r in self.soc_rs:
+            temp1[soc_r] = len(self.pevs[soc_r][self.pevs[soc_r]["abandoned"]==True].index)/len(self.pevs[soc_r].index)
+        return temp1
     
+    @profiled
     def get_mean_waiting_time(self, numerical=False):
         temp1 = dict()
         if numerical:
             ro = self.get_traffic_intensity()
-            theta = (self.s-1.0)/(self.s+1.0)
-            f = (sqrt((9.0+theta)/(1.0-theta))-2)*theta/(8.0+8.0*theta)
             for soc_r in self.soc_rs:
-                temp2 = self.pevs[soc_r][self.pevs[soc_r]["blocked"]==False]
+                temp2 = self.pevs[soc_r][(self.pevs[soc_r]["blocked"]==False) & (self.pevs[soc_r]["abandoned"]==False)]
                 c_s = (temp2["departure_time"]-temp2["arrival_time"]).std()/60.0
-                g = (1.0-ro[soc_r])/ro[soc_r]
-                r_d = (1.0+f*g*(1-exp(-theta/(f*g))))/2.0
-                r_g = ((1.0+c_s**2.0)*r_d)/((2.0*r_d-1.0)*c_s**2.0+1.0)
-                zeta = ro[soc_r]*r_g/(1.0-ro[soc_r])+ro[soc_r]*r_g
-                p_0 = 1.0/sum([((self.s*ro[soc_r])**j)/factorial(j)+(((self.s*ro[soc_r])**self.s)/factorial(self.s))*((1.0-ro[soc_r]*zeta**self.r)/(1.0-ro[soc_r])) for j in range(self.s)])
-                temp1[soc_r] = 60.0*((self.s*ro[soc_r])**self.s)*zeta*(1.0-zeta**self.r-self.r*(1.0-zeta)*ro[soc_r]*zeta**(self.r-1.0))*p_0/(factorial(self.s)*(1.0-ro[soc_r])*(1.0-zeta)*self.lam)
+                temp1[soc_r] = analytic.get_mean_waiting_time(self.lam, self.s, self.r, ro[soc_r], c_s)
         else:
             for soc_r in self.soc_rs:
                 temp2 = self.pevs[soc_r][self.pevs[soc_r]["blocked"]==False]
                 temp1[soc_r] = (temp2["start_time"]-temp2["arrival_time"]).mean()
         return temp1
     
+    @profiled
     def get_system_revenue(self):
         #TODO add calculation results too
         temp1 = dict()
         reward = lambda x: self.reward["m"]*x+self.reward["n"]
         p_k = self.get_blocking_probability()
+        p_a = self.get_abandonment_probability()
         mean_t_w = self.get_mean_waiting_time()
         mean_t_ch = self.get_mean_charging_time()
         for soc_r in self.soc_rs:
             temp2 = self.pevs[soc_r][self.pevs[soc_r]["blocked"]==False]
             mean_c_batt = temp2["c_batt"].mean()
-            temp1[soc_r] = self.lam*(1-p_k[soc_r])*(reward(soc_r)-self.c_w*mean_t_w[soc_r]/60.0-mean_c_batt*mean_t_ch[soc_r]/60.0)
+            temp1[soc_r] = self.lam*(1-p_k[soc_r]-p_a[soc_r])*(reward(soc_r)-self.c_w*mean_t_w[soc_r]/60.0-mean_c_batt*mean_t_ch[soc_r]/60.0)
+            if p_a[soc_r] > 0:
+                # a PEV that gave up pays no reward, but its wait still costs
+                temp3 = temp2[temp2["abandoned"]==True]
+                temp1[soc_r] -= self.lam*p_a[soc_r]*self.c_w*(temp3["departure_time"]-temp3["arrival_time"]).mean()/60.0
+        return temp1
+
+    # time weighted queue length, PEVs at the station and utilization of every charger
+    @profiled
+    def get_occupancy(self, end=None):
+        temp1 = dict()
+        for soc_r in self.soc_rs:
+            temp1[soc_r] = occupancy.get_occupancy(self.pevs[soc_r], self.s, end)
+        return temp1
+
+    # the revenue, waiting penalty and battery cost of every PEV
+    @profiled
+    def get_revenue_ledger(self):
+        temp1 = dict()
+        for soc_r in self.soc_rs:
+            temp1[soc_r] = ledger.get_ledger(self.pevs[soc_r], self.reward["m"]*soc_r+self.reward["n"], self.c_w)
+        return temp1
+
+    # percentiles, CVaR of the waiting penalty and revenue per charger of the ledger
+    @profiled
+    def get_revenue_distribution(self, percentiles=ledger.PERCENTILES, alpha=ledger.ALPHA):
+        temp1 = dict()
+        ledgers = self.get_revenue_ledger()
+        for soc_r in self.soc_rs:
+            temp1[soc_r] = ledger.get_distribution(ledgers[soc_r], self.lam, percentiles, alpha)
+        return temp1
+
+    # gradients of the revenue, mean waiting time, blocking probability and mean charging
+    # time with respect to lam, p_max, c_w and soc_r, with standard errors, from this run
+    @profiled
+    def get_sensitivities(self, batches=sensitivity.BATCHES):
+        temp1 = dict()
+        for soc_r in self.soc_rs:
+            temp1[soc_r] = sensitivity.get_sensitivities(self, soc_r, self.pevs[soc_r], batches)
         return temp1
 
     def get_results(self):
@@ -0,0 +1,234 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import sys
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import minimize
+from scipy.stats import qmc
+
+import single_class
+
+# the parameters the surrogate takes, with their ranges; everything else is fixed to the
+# defaults of single_class
+DOMAIN = {
+    "lam": (2.0, 40.0),
+    "s": (1, 20),
+    "r": (1, 10),
+    "soc_r": (0.6, 0.99),
+    "p_max": (20.0, 120.0)
+}
+INTEGERS = ["s", "r"]
+TARGETS = ["system_revenue", "blocking_probability", "mean_waiting_time"]
+PEV_NUM = 2000
+INITIAL_POINTS = 64
+ROUNDS = 4
+BATCH = 16
+CANDIDATES = 4096
+# new points are kept at least this far apart in the unit cube
+MIN_DISTANCE = 0.1
+RESTARTS = 3
+SEED = 458
+SURROGATE_PATH = "surrogate.npz"
+
+# zero mean Gaussian process with a squared exponential kernel, a length scale for every
+# input and a noise term, on inputs in the unit cube and standardized outputs
+class GaussianProcess:
+    def __init__(self, dim):
+        self.log_params = np.zeros(dim+2)
+        self.log_params[dim+1] = np.log(0.1)
+        self.x = None
+
+    def get_kernel(self, x1, x2, log_params):
+        length_scales = np.exp(log_params[:-2])
+        d = (x1[:, None, :]-x2[None, :, :])/length_scales
+        return np.exp(2.0*log_params[-2])*np.exp(-0.5*np.sum(d**2, axis=2))
+
+    def get_negative_log_likelihood(self, log_params, x, y):
+        k = self.get_kernel(x, x, log_params)+(np.exp(2.0*log_params[-1])+1e-8)*np.eye(len(x))
+        try:
+            factor = cho_factor(k, lower=True)
+        except np.linalg.LinAlgError:
+            return 1e10
+        alpha = cho_solve(factor, y)
+        return 0.5*y@alpha+np.sum(np.log(np.diag(factor[0])))
+
+    def fit(self, x, y, optimize=True, rng=None):
+        self.y_mean = y.mean()
+        self.y_std = y.std() if y.std() > 0 else 1.0
+        y = (y-self.y_mean)/self.y_std
+        if optimize:
+            rng = rng or np.random.default_rng()
+            best = None
+            starts = [self.log_params]+[rng.uniform(-2.0, 1.0, len(self.log_params)) for _ in range(RESTARTS-1)]
+            bounds = [(-4.0, 3.0)]*(len(self.log_params)-2)+[(-3.0, 3.0), (-7.0, 1.0)]
+            for start in starts:
+                res = minimize(self.get_negative_log_likelihood, start, args=(x, y), method="L-BFGS-B", bounds=bounds)
+                if best is None or res.fun < best.fun:
+                    best = res
+            self.log_params = best.x
+        self.x = x
+        self.length_scales = np.exp(self.log_params[:-2])
+        self.signal = np.exp(2.0*self.log_params[-2])
+        k = self.get_kernel(x, x, self.log_params)+(np.exp(2.0*self.log_params[-1])+1e-8)*np.eye(len(x))
+        factor = cho_factor(k, lower=True)
+        self.alpha = cho_solve(factor, y)
+        self.k_inv = cho_solve(factor, np.eye(len(x)))
+        # inputs divided by the length scales once, so a prediction is one small product
+        self.x_scaled = x/self.length_scales
+
+    # mean and standard deviation of the emulated metric, not of a single simulation run
+    def predict(self, x):
+        x = np.atleast_2d(x)/self.length_scales
+        d = x[:, None, :]-self.x_scaled[None, :, :]
+        k = self.signal*np.exp(-0.5*np.sum(d**2, axis=2))
+        mean = k@self.alpha
+        var = self.signal-np.sum((k@self.k_inv)*k, axis=1)
+        return mean*self.y_std+self.y_mean, np.sqrt(np.maximum(var, 0.0))*self.y_std
+
+    def predict_one(self, x):
+        d = x/self.length_scales-self.x_scaled
+        k = self.signal*np.exp(-0.5*np.einsum("ij,ij->i", d, d))
+        var = self.signal-k@self.k_inv@k
+        return k@self.alpha*self.y_std+self.y_mean, np.sqrt(max(var, 0.0))*self.y_std
+
+def run_point(task):
+    point, seed, pev_num = task
+    soc_r = point["soc_r"]
+    sim = single_class.Simulation(
+        pev_num=pev_num,
+        lam=point["lam"],
+        s=point["s"],
+        r=point["r"],
+        soc_rs=[soc_r],
+        soc_i_p=single_class.SOC_I_P,
+        p_max=point["p_max"],
+        e_max=single_class.E_MAX,
+        e_c=single_class.E_C,
+        batt_deg=single_class.BATT_DEG,
+        reward=single_class.REWARD,
+        c_w=single_class.C_W,
+        t_ch_coefficient=single_class.T_CH_COEFFICIENT,
+        seed=seed
+    )
+    return [float(getattr(sim, "get_"+target)()[soc_r]) for target in TARGETS]
+
+# emulates the single class model over DOMAIN from simulation runs on a space filling
+# design, and adds runs where the emulators are least certain
+class Surrogate:
+    def __init__(self, domain=DOMAIN, pev_num=PEV_NUM, seed=SEED):
+        self.domain = domain
+        self.names = list(domain)
+        self.low = np.array([domain[name][0] for name in self.names], dtype=float)
+        self.high = np.array([domain[name][1] for name in self.names], dtype=float)
+        self.pev_num = pev_num
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.x = np.empty((0, len(self.names)))
+        self.y = np.empty((0, len(TARGETS)))
+        self.processes = dict()
+
+    def get_points(self, u):
+        x = self.low+u*(self.high-self.low)
+        points = list()
+        for row in x:
+            point = dict(zip(self.names, row.tolist()))
+            for name in INTEGERS:
+                if name in point:
+                    point[name] = int(round(point[name]))
+            points.append(point)
+        return points
+
+    def get_unit(self, points):
+        x = np.array([[point[name] for name in self.names] for point in points], dtype=float)
+        return (x-self.low)/(self.high-self.low)
+
+    def in_domain(self, point):
+        return all(self.domain[name][0] <= point[name] <= self.domain[name][1] for name in self.names)
+
+    def get_design(self, n):
+        return qmc.LatinHypercube(len(self.names), seed=self.rng).random(n)
+
+    def run(self, points, max_workers=None):
+        seeds = np.random.SeedSequence([self.seed, len(self.x)]).generate_state(len(points))
+        tasks = [(point, int(seed), self.pev_num) for point, seed in zip(points, seeds)]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            rows = list(executor.map(run_point, tasks))
+        self.x = np.vstack((self.x, self.get_unit(points)))
+        self.y = np.vstack((self.y, np.array(rows, dtype=float)))
+
+    def fit(self, optimize=True):
+        for k, target in enumerate(TARGETS):
+            finite = np.isfinite(self.y[:, k])
+            if target not in self.processes:
+                self.processes[target] = GaussianProcess(len(self.names))
+            self.processes[target].fit(self.x[finite], self.y[finite, k], optimize, self.rng)
+
+    # {target: (mean, standard deviation)} at one point, fast enough for a slider
+    def predict(self, point):
+        u = (np.array([point[name] for name in self.names], dtype=float)-self.low)/(self.high-self.low)
+        temp1 = dict()
+        for target, process in self.processes.items():
+            mean, std = process.predict_one(u)
+            if target == "blocking_probability":
+                mean = min(1.0, max(0.0, mean))
+            temp1[target] = (float(mean), float(std))
+        return temp1
+
+    # the candidates where the standard deviations, relative to the spread of every
+    # target, add up to the most, kept apart so a batch does not pile up in one corner
+    def get_uncertain_points(self, n, candidates=CANDIDATES):
+        u = self.get_unit(self.get_points(self.get_design(candidates)))
+        score = np.zeros(candidates)
+        for process in self.processes.values():
+            score += process.predict(u)[1]/process.y_std
+        chosen = list()
+        for k in np.argsort(-score):
+            if all(np.linalg.norm(u[k]-u[j]) >= MIN_DISTANCE for j in chosen):
+                chosen.append(k)
+                if len(chosen) == n:
+                    break
+        return self.get_points(u[chosen]), score[chosen]
+
+    def add_points(self, n=BATCH, max_workers=None):
+        points, score = self.get_uncertain_points(n)
+        self.run(points, max_workers)
+        self.fit()
+        return points, score
+
+    def save(self, path=SURROGATE_PATH):
+        meta = {
+            "domain": self.domain,
+            "targets": TARGETS,
+            "pev_num": self.pev_num,
+            "seed": self.seed,
+            "log_params": {target: process.log_params.tolist() for target, process in self.processes.items()}
+        }
+        np.savez_compressed(path, x=self.x, y=self.y, meta=json.dumps(meta))
+
+def load_surrogate(path=SURROGATE_PATH):
+    data = np.load(path)
+    meta = json.loads(str(data["meta"]))
+    surrogate = Surrogate({name: tuple(bounds) for name, bounds in meta["domain"].items()}, meta["pev_num"], meta["seed"])
+    surrogate.x = data["x"]
+    surrogate.y = data["y"]
+    for target, log_params in meta["log_params"].items():
+        surrogate.processes[target] = GaussianProcess(len(surrogate.names))
+        surrogate.processes[target].log_params = np.array(log_params)
+    surrogate.fit(optimize=False)
+    return surrogate
+
+def build_surrogate(initial_points=INITIAL_POINTS, rounds=ROUNDS, batch=BATCH, path=SURROGATE_PATH, max_workers=None, log=print):
+    surrogate = Surrogate()
+    surrogate.run(surrogate.get_points(surrogate.get_design(initial_points)), max_workers)
+    surrogate.fit()
+    log("fitted on {} runs".format(len(surrogate.x)))
+    for _ in range(rounds):
+        _, score = surrogate.add_points(batch, max_workers)
+        log("fitted on {} runs, largest relative standard deviation was {:.3f}".format(len(surrogate.x), score.max()))
+    surrogate.save(path)
+    return surrogate
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else ROUNDS
+    build_surrogate(rounds=rounds)
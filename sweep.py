@@ -0,0 +1,244 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import glob
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from sampling import flatten
+from shared_results import SharedPevs, save_pevs, share_pevs
+import single_class
+import multiclass_dedicated
+import multiclass_shared
+
+MODELS = {
+    "single_class": single_class,
+    "multiclass_dedicated": multiclass_dedicated,
+    "multiclass_shared": multiclass_shared
+}
+# the parameter every model sweeps inside its Simulation, a study runs every value of it
+# as a task of its own
+SWEPT = {
+    "single_class": "soc_rs",
+    "multiclass_dedicated": "lam",
+    "multiclass_shared": "lam"
+}
+METRICS = ["get_mean_charging_time", "get_traffic_intensity", "get_blocking_probability", "get_mean_waiting_time", "get_system_revenue"]
+REPLICATIONS = 2
+SEED = 458
+JOURNAL_PATH = "sweep_journal"
+# the per-PEV frames of the tasks of a block with "pevs" go to this folder of the journal path
+PEVS_PATH = "pevs"
+PEV_NUM = 2000
+
+def get_defaults(model):
+    module = MODELS[model]
+    if model == "single_class":
+        return dict(
+            pev_num=module.PEV_NUM,
+            lam=module.LAM,
+            s=module.S,
+            r=module.R,
+            soc_rs=module.SOC_RS,
+            soc_i_p=module.SOC_I_P,
+            p_max=module.P_MAX,
+            e_max=module.E_MAX,
+            e_c=module.E_C,
+            batt_deg=module.BATT_DEG,
+            reward=module.REWARD,
+            c_w=module.C_W,
+            t_ch_coefficient=module.T_CH_COEFFICIENT
+        )
+    return dict(
+        theta=module.THETA,
+        pev_num=module.PEV_NUM,
+        lam=module.LAM,
+        s=module.S,
+        r=module.R,
+        soc_r=module.SOC_R,
+        batt_deg=module.BATT_DEG,
+        reward=module.REWARD,
+        c_w=module.C_W,
+        t_ch_coefficient=module.T_CH_COEFFICIENT,
+        soc_i_mu=module.SOC_I_MU,
+        soc_i_sigma=module.SOC_I_SIGMA,
+        p_max=module.P_MAX,
+        e_max=module.E_MAX,
+        e_c=module.E_C
+    )
+
+# a simulation run is named by the hash of its model, parameters and replication, so the
+# same run has the same seed on every machine and in every run of the study
+def get_run_key(model, params, replication):
+    text = json.dumps([model, params, replication], sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+# a task is a run and the metrics asked of it, so a study that asks for other metrics runs
+# the task again instead of finding it in the journal; the seed stays that of the run
+def get_key(run_key, metrics):
+    return hashlib.sha1(json.dumps([run_key, metrics]).encode()).hexdigest()
+
+def get_seed(seed, key):
+    return int(np.random.SeedSequence([seed, int(key[:16], 16)]).generate_state(1)[0])
+
+# a study is a list of blocks, every block a dict with the model and optionally params
+# that replace its defaults, a grid of parameter values to run every combination of,
+# the replications and the metrics, and "pevs" to keep the per-PEV frames of its tasks;
+# the values of the swept parameter of the model are split into tasks of one value each,
+# so a task is a single simulation run
+def expand(study, seed=SEED):
+    tasks = list()
+    for block in study:
+        model = block["model"]
+        params = get_defaults(model)
+        params.update(block.get("params", dict()))
+        grid = block.get("grid", dict())
+        swept = SWEPT[model]
+        for values in product(*grid.values()):
+            point = dict(params, **dict(zip(grid, values)))
+            for value in point[swept]:
+                task_params = dict(point, **{swept: [value]})
+                for replication in range(block.get("replications", REPLICATIONS)):
+                    run_key = get_run_key(model, task_params, replication)
+                    metrics = block.get("metrics", METRICS)
+                    tasks.append({
+                        "key": get_key(run_key, metrics),
+                        "model": model,
+                        "params": task_params,
+                        "replication": replication,
+                        "seed": get_seed(seed, run_key),
+                        "metrics": metrics,
+                        "pevs": block.get("pevs", False)
+                    })
+    return tasks
+
+# runs one task in a worker process; the frames of a task with pevs come back through
+# shared memory, only their descriptors are pickled
+def run_task(task):
+    start = time.perf_counter()
+    sim = MODELS[task["model"]].Simulation(**task["params"], seed=task["seed"])
+    results = list()
+    for metric in task["metrics"]:
+        for key, value in flatten(getattr(sim, metric)(), (metric,)).items():
+            results.append([list(key), value])
+    descriptors = share_pevs(sim.pevs) if task.get("pevs") else None
+    return task["key"], results, time.perf_counter()-start, descriptors
+
+# the finished tasks of one host; every host writes only its own journal, SQLite locks do
+# not hold on every shared filesystem, and reads the journals of the others
+class Journal:
+    def __init__(self, path, host=None):
+        self.host = host or socket.gethostname()
+        os.makedirs(path, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(path, "journal-"+self.host+".sqlite"))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks (key TEXT PRIMARY KEY, model TEXT, params TEXT, replication INTEGER, seed INTEGER, results TEXT, host TEXT, finished REAL, elapsed REAL)"
+        )
+        self.connection.commit()
+
+    # a task is committed as soon as it is done, so a crash loses at most the running ones
+    def add(self, task, results, elapsed):
+        self.connection.execute(
+            "INSERT OR IGNORE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (task["key"], task["model"], json.dumps(task["params"], sort_keys=True), task["replication"], task["seed"], json.dumps(results), self.host, time.time(), elapsed)
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+# the rows of every journal in path, a task finished on several hosts is kept once
+def read_journals(path):
+    rows = dict()
+    for name in sorted(glob.glob(os.path.join(path, "journal-*.sqlite"))):
+        try:
+            connection = sqlite3.connect("file:"+name+"?mode=ro", uri=True)
+            try:
+                temp1 = connection.execute("SELECT key, model, params, replication, seed, results, host, finished, elapsed FROM tasks").fetchall()
+            finally:
+                connection.close()
+        except sqlite3.DatabaseError:
+            # a journal another host is creating right now, it is read next time
+            continue
+        for row in temp1:
+            if row[0] not in rows or row[7] < rows[row[0]][7]:
+                rows[row[0]] = row
+    return rows
+
+# runs the tasks of a study that no journal in path has yet on a local worker pool; with
+# shard=(index, count) only the tasks of that share are taken, so count machines on one
+# filesystem can split a study without talking to each other; a task that fails is
+# logged and left for the next run; the frames of a task are written before it is journaled
+def run_sweep(study, path=JOURNAL_PATH, seed=SEED, max_workers=None, host=None, shard=None, log=print):
+    tasks = expand(study, seed)
+    finished = read_journals(path)
+    pending = [task for task in tasks if task["key"] not in finished and (shard is None or int(task["key"], 16) % shard[1] == shard[0])]
+    log("{} tasks, {} finished, {} to run".format(len(tasks), len(tasks)-len(pending), len(pending)))
+    journal = Journal(path, host)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(run_task, task): task for task in pending}
+            for k, future in enumerate(as_completed(futures)):
+                task = futures[future]
+                try:
+                    key, results, elapsed, descriptors = future.result()
+                except Exception as e:
+                    log("task {} failed: {!r}".format(task["key"], e))
+                    continue
+                if descriptors is not None:
+                    with SharedPevs(descriptors) as pevs:
+                        save_pevs(pevs, os.path.join(path, PEVS_PATH), key)
+                journal.add(task, results, elapsed)
+                log("{}/{} {} {:.1f} s".format(k+1, len(pending), task["model"], elapsed))
+    finally:
+        journal.close()
+    return load_results(path, tasks)
+
+# the results of every journal in path, merged across hosts, one row for every value a
+# metric getter returned: the model, replication and parameters of the task, the metric
+# and the point of the value, e.g. the soc_r, or the class and lam; with tasks only the
+# rows of those tasks
+def load_results(path=JOURNAL_PATH, tasks=None):
+    rows = read_journals(path)
+    keys = rows.keys() if tasks is None else [task["key"] for task in tasks if task["key"] in rows]
+    temp1 = list()
+    for key in keys:
+        _, model, params, replication, seed, results, host, _, _ = rows[key]
+        params = json.loads(params)
+        swept = params[SWEPT[model]][0]
+        for (metric, *point), value in json.loads(results):
+            temp1.append({
+                "task": key,
+                "model": model,
+                "replication": replication,
+                "seed": seed,
+                "host": host,
+                "lam": swept if SWEPT[model] == "lam" else params["lam"],
+                "s": params["s"],
+                "r": params["r"],
+                "params": json.dumps(params, sort_keys=True),
+                "metric": metric,
+                "point": "/".join(str(k) for k in point),
+                "value": value
+            })
+    return pd.DataFrame(temp1, columns=["task", "model", "replication", "seed", "host", "lam", "s", "r", "params", "metric", "point", "value"])
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else JOURNAL_PATH
+    shard = (int(sys.argv[2]), int(sys.argv[3])) if len(sys.argv) > 3 else None
+    # stopping and running this again with the same path goes on with the unfinished tasks
+    study = [
+        {"model": "single_class", "params": {"pev_num": PEV_NUM}, "grid": {"lam": [5.0, 10.0, 15.0]}},
+        {"model": "multiclass_dedicated", "params": {"pev_num": PEV_NUM, "lam": [2, 4, 6]}, "grid": {"s": [8, 10]}},
+        {"model": "multiclass_shared", "params": {"pev_num": PEV_NUM, "lam": [2, 4, 6]}, "grid": {"s": [8, 10]}}
+    ]
+    res = run_sweep(study, path, shard=shard)
+    pd.set_option("display.width", 200)
+    print(res[res["metric"] == "get_system_revenue"].groupby(["model", "lam", "s", "point"])["value"].agg(["mean", "std", "count"]))
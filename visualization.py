@@ -0,0 +1,314 @@
+from bisect import bisect_right
+from heapq import heapify, heappop, heappush
+from time import perf_counter
+import tkinter as tk
+
+import numpy as np
+
+# event kinds, ordered so that at equal times a charger is freed before it is taken
+DEPART = 0
+ARRIVE = 1
+BLOCK = 2
+START = 3
+ABANDON = 4
+
+FRAME_MS = 33
+CHARGERS_PER_ROW = 12
+MAX_CANVAS_HEIGHT = 700
+CHARGER_IMAGE = "images/charger.gif"
+PEV_IMAGE = "images/pev.gif"
+
+def get_column(pevs, name):
+    return pevs[name].to_numpy(dtype=float, na_value=np.nan)
+
+# sorted list of everything that happens at the station during one finished run
+class Timeline:
+    def __init__(self, pevs, s):
+        ids = pevs.index.to_numpy()
+        arrival_time = get_column(pevs, "arrival_time")
+        start_time = get_column(pevs, "start_time")
+        departure_time = get_column(pevs, "departure_time")
+        blocked = pevs["blocked"].to_numpy(dtype=bool)
+        # a PEV that gave up waiting arrives and leaves the waiting spaces without a charge
+        abandoned = pevs["abandoned"].to_numpy(dtype=bool)
+        served = ~blocked & ~abandoned
+        n_served = int(served.sum())
+        n_blocked = int(blocked.sum())
+        n_abandoned = int(abandoned.sum())
+        times = np.concatenate((arrival_time[served], start_time[served], departure_time[served], arrival_time[blocked],
+            arrival_time[abandoned], departure_time[abandoned]))
+        kinds = np.concatenate((
+            np.full(n_served, ARRIVE),
+            np.full(n_served, START),
+            np.full(n_served, DEPART),
+            np.full(n_blocked, BLOCK),
+            np.full(n_abandoned, ARRIVE),
+            np.full(n_abandoned, ABANDON)
+        ))
+        events_pevs = np.concatenate((ids[served], ids[served], ids[served], ids[blocked], ids[abandoned], ids[abandoned]))
+        # for a start event the value is the waiting time, for a departure it is the charging time
+        values = np.concatenate((
+            np.zeros(n_served),
+            start_time[served]-arrival_time[served],
+            departure_time[served]-start_time[served],
+            np.zeros(n_blocked),
+            np.zeros(n_abandoned),
+            departure_time[abandoned]-arrival_time[abandoned]
+        ))
+        order = np.lexsort((kinds, times))
+        self.s = s
+        self.times = times[order].tolist()
+        self.kinds = kinds[order].tolist()
+        self.pevs = events_pevs[order].tolist()
+        self.values = values[order].tolist()
+        self.chargers = self.assign_chargers()
+        self.end = self.times[-1] if self.times else 0.0
+
+    # the charger column of the results can't be trusted when two PEVs start at once,
+    # so the chargers are handed out again from the ordered start and departure events
+    def assign_chargers(self):
+        free = list(range(self.s))
+        heapify(free)
+        occupied = dict()
+        chargers = list()
+        for kind, pev in zip(self.kinds, self.pevs):
+            if kind == START:
+                occupied[pev] = heappop(free)
+                chargers.append(occupied[pev])
+            elif kind == DEPART:
+                charger = occupied.pop(pev)
+                heappush(free, charger)
+                chargers.append(charger)
+            else:
+                chargers.append(-1)
+        return chargers
+
+    def __len__(self):
+        return len(self.times)
+
+# occupancy of the station at one point of a timeline
+class StationState:
+    def __init__(self, s):
+        self.k = 0
+        self.occupants = [None]*s
+        self.waiting = dict()
+        self.charged_num = 0
+        self.total_charge_time = 0.0
+        self.started_num = 0
+        self.total_wait_time = 0.0
+        self.blocked_num = 0
+        self.abandoned_num = 0
+        self.dirty_chargers = set()
+        self.dirty_waiting = True
+
+    def copy(self):
+        state = StationState.__new__(StationState)
+        state.k = self.k
+        state.occupants = self.occupants.copy()
+        state.waiting = self.waiting.copy()
+        state.charged_num = self.charged_num
+        state.total_charge_time = self.total_charge_time
+        state.started_num = self.started_num
+        state.total_wait_time = self.total_wait_time
+        state.blocked_num = self.blocked_num
+        state.abandoned_num = self.abandoned_num
+        state.dirty_chargers = set()
+        state.dirty_waiting = False
+        return state
+
+    # applies events of the timeline up to (but excluding) event number stop
+    def advance(self, timeline: Timeline, stop):
+        k = self.k
+        while k < stop:
+            kind = timeline.kinds[k]
+            pev = timeline.pevs[k]
+            if kind == ARRIVE:
+                self.waiting[pev] = None
+                self.dirty_waiting = True
+            elif kind == START:
+                del self.waiting[pev]
+                self.dirty_waiting = True
+                charger = timeline.chargers[k]
+                self.occupants[charger] = pev
+                self.dirty_chargers.add(charger)
+                self.started_num += 1
+                self.total_wait_time += timeline.values[k]
+            elif kind == DEPART:
+                charger = timeline.chargers[k]
+                self.occupants[charger] = None
+                self.dirty_chargers.add(charger)
+                self.charged_num += 1
+                self.total_charge_time += timeline.values[k]
+            elif kind == ABANDON:
+                del self.waiting[pev]
+                self.dirty_waiting = True
+                self.abandoned_num += 1
+            else:
+                self.blocked_num += 1
+            k += 1
+        self.k = k
+
+# snapshots of the station state every few events, so any time can be looked up
+# with a bisect on the event times and at most one snapshot interval of replay
+class StationIndex:
+    def __init__(self, timeline: Timeline, interval=None):
+        self.timeline = timeline
+        # restoring a snapshot already costs O(s), so replaying as many events is free
+        self.interval = interval or max(64, timeline.s)
+        self.snapshots = list()
+        state = StationState(timeline.s)
+        for k in range(0, len(timeline)+1, self.interval):
+            state.advance(timeline, k)
+            self.snapshots.append(state.copy())
+
+    def state_at(self, t):
+        k = bisect_right(self.timeline.times, t)
+        state = self.snapshots[k//self.interval].copy()
+        state.advance(self.timeline, k)
+        state.dirty_chargers = set(range(self.timeline.s))
+        state.dirty_waiting = True
+        return state
+
+    def charging_at(self, t):
+        return [pev for pev in self.state_at(t).occupants if pev is not None]
+
+    def waiting_at(self, t):
+        return list(self.state_at(t).waiting)
+
+# plays a timeline back on a canvas with Tk after() callbacks, so the GUI never blocks;
+# the slider seeks through a StationIndex instead of replaying from t=0
+class StationPlayback:
+    def __init__(self, master, timeline: Timeline, r, speed, until):
+        self.timeline = timeline
+        self.index = StationIndex(timeline)
+        self.s = timeline.s
+        self.r = r
+        # simulation minutes per real second
+        self.speed = speed
+        self.until = until
+        self.clock = 0.0
+        self.state = StationState(self.s)
+        self.job = None
+        self.last_frame = None
+        self.playing = False
+
+        columns = min(self.s, CHARGERS_PER_ROW)
+        rows = -(-self.s//CHARGERS_PER_ROW)
+        waiting_y = 20+100*rows
+        stats_y = waiting_y+110
+        width = max(450, 25+75*max(columns, min(self.r, CHARGERS_PER_ROW)))
+        height = stats_y+100
+        canvas_frm = tk.Frame(master, bg="#fff")
+        self.canvas = tk.Canvas(canvas_frm, width=width, height=min(height, MAX_CANVAS_HEIGHT),
+            scrollregion=(0, 0, width, height), bg="#fff")
+        self.canvas.grid(column=0,row=0)
+        if height > MAX_CANVAS_HEIGHT:
+            scrollbar = tk.Scrollbar(canvas_frm, orient=tk.VERTICAL, command=self.canvas.yview)
+            scrollbar.grid(column=1,row=0,sticky=tk.NS)
+            self.canvas.config(yscrollcommand=scrollbar.set)
+        canvas_frm.grid()
+        self.charger_img = tk.PhotoImage(file=CHARGER_IMAGE)
+        self.pev_img = tk.PhotoImage(file=PEV_IMAGE)
+        self.pev_icons = list()
+        self.pev_labels = list()
+        for i in range(self.s):
+            x = 25+75*(i%CHARGERS_PER_ROW)
+            y = 20+100*(i//CHARGERS_PER_ROW)
+            self.canvas.create_image(x, y, anchor=tk.NW, image=self.charger_img)
+            self.canvas.create_text(x+35, y+10, text=str(i+1), anchor=tk.NW)
+            self.pev_icons.append(self.canvas.create_image(x, y+30, anchor=tk.NW, image=self.pev_img, state=tk.HIDDEN))
+            self.pev_labels.append(self.canvas.create_text(x, y+65, text="", anchor=tk.NW, state=tk.HIDDEN))
+        self.waiting_cars_num = self.canvas.create_text(25, waiting_y, text="# of waiting cars: 0", anchor=tk.NW)
+        self.waiting_icons = list()
+        self.waiting_labels = list()
+        for i in range(min(self.r, CHARGERS_PER_ROW)):
+            x = 25+75*i
+            self.waiting_icons.append(self.canvas.create_image(x, waiting_y+25, anchor=tk.NW, image=self.pev_img, state=tk.HIDDEN))
+            self.waiting_labels.append(self.canvas.create_text(x, waiting_y+60, text="", anchor=tk.NW, state=tk.HIDDEN))
+        self.canvas.create_rectangle(25, stats_y, 260, stats_y+90, fill="#fff")
+        self.time = self.canvas.create_text(35, stats_y+5, text="Time = 0.0m", anchor=tk.NW)
+        self.charge_time = self.canvas.create_text(35, stats_y+25, text="Average Charge time = 0", anchor=tk.NW)
+        self.wait_time = self.canvas.create_text(35, stats_y+45, text="Average Wait time = 0", anchor=tk.NW)
+        self.blocked = self.canvas.create_text(35, stats_y+65, text="# of blocked cars: 0", anchor=tk.NW)
+        self.canvas.bind("<Destroy>", lambda event: self.stop())
+
+        controls_frm = tk.Frame(master, bg="#fff")
+        self.play_button = tk.Button(controls_frm, text="Pause", width=6, command=self.toggle)
+        self.play_button.grid(column=0,row=0,padx=10,pady=5)
+        self.slider = tk.Scale(controls_frm, from_=0.0, to=self.until, resolution=0.1, orient=tk.HORIZONTAL,
+            length=width-120, label="Time (minutes)", showvalue=False, background="#fff", highlightthickness=0)
+        self.slider.grid(column=1,row=0,padx=10,pady=5)
+        self.slider.bind("<B1-Motion>", lambda event: self.seek(self.slider.get()))
+        self.slider.bind("<ButtonRelease-1>", lambda event: self.seek(self.slider.get()))
+        controls_frm.grid()
+
+    def start(self):
+        self.playing = True
+        self.last_frame = perf_counter()
+        self.job = self.canvas.after(FRAME_MS, self.frame)
+
+    def stop(self):
+        self.playing = False
+        if self.job is not None:
+            self.canvas.after_cancel(self.job)
+            self.job = None
+
+    def toggle(self):
+        if self.playing:
+            self.stop()
+            self.play_button.config(text="Play")
+        else:
+            if self.clock >= self.until:
+                self.seek(0.0)
+            self.start()
+            self.play_button.config(text="Pause")
+
+    def seek(self, t):
+        self.clock = min(self.until, max(0.0, float(t)))
+        self.state = self.index.state_at(self.clock)
+        self.last_frame = perf_counter()
+        self.redraw()
+
+    def frame(self):
+        now = perf_counter()
+        self.clock = min(self.until, self.clock+(now-self.last_frame)*self.speed)
+        self.last_frame = now
+        self.state.advance(self.timeline, bisect_right(self.timeline.times, self.clock))
+        self.redraw()
+        self.slider.set(self.clock)
+        if self.clock < self.until:
+            self.job = self.canvas.after(FRAME_MS, self.frame)
+        else:
+            self.job = None
+            self.playing = False
+            self.play_button.config(text="Play")
+
+    # canvas items are created once and only reconfigured, at most s+r of them per frame
+    def redraw(self):
+        itemconfig = self.canvas.itemconfig
+        state = self.state
+        for charger in state.dirty_chargers:
+            pev = state.occupants[charger]
+            if pev is None:
+                itemconfig(self.pev_icons[charger], state=tk.HIDDEN)
+                itemconfig(self.pev_labels[charger], state=tk.HIDDEN)
+            else:
+                itemconfig(self.pev_icons[charger], state=tk.NORMAL)
+                itemconfig(self.pev_labels[charger], text="PEV #"+str(pev), state=tk.NORMAL)
+        state.dirty_chargers.clear()
+        if state.dirty_waiting:
+            waiting = iter(state.waiting)
+            for icon, label in zip(self.waiting_icons, self.waiting_labels):
+                pev = next(waiting, None)
+                if pev is None:
+                    itemconfig(icon, state=tk.HIDDEN)
+                    itemconfig(label, state=tk.HIDDEN)
+                else:
+                    itemconfig(icon, state=tk.NORMAL)
+                    itemconfig(label, text="PEV #"+str(pev), state=tk.NORMAL)
+            itemconfig(self.waiting_cars_num, text="# of waiting cars: "+str(len(state.waiting)))
+            state.dirty_waiting = False
+        itemconfig(self.time, text="Time = "+str(round(self.clock, 1))+"m")
+        itemconfig(self.charge_time, text="Average Charge time = "+str(round(state.total_charge_time/state.charged_num if state.charged_num else 0, 1)))
+        itemconfig(self.wait_time, text="Average Wait time = "+str(round(state.total_wait_time/state.started_num if state.started_num else 0, 1)))
+        itemconfig(self.blocked, text="# of blocked cars: "+str(state.blocked_num))